@@ -0,0 +1,375 @@
+"""
+Benchmark for the worker. Starts server.py in a subprocess (with its own
+files directory) and drives it with synthetic clients speaking the real
+protobuf websocket protocol: handshake, execute, file requests answered
+with file chunks, incremental updates and results. Runs on a CPU-only box
+without network access: model tasks are replaced by stubs with a
+configurable latency.
+
+    python bench.py                                  # every scenario
+    python bench.py --scenarios capitalize,uploads --clients 8 --requests 400
+    python bench.py --json new.json --baseline old.json --tolerance 0.2
+
+Reports throughput, p50/p95/p99 latency (execute sent to result received)
+and the server's memory per scenario. With --baseline, exits with status 1
+when a scenario's p95 or throughput regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from proto.py import tasks as proto_tasks  # type: ignore
+from proto.py import websocket as wsmsg  # type: ignore
+
+import betterproto
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_SIZES = (16 * 1024, 256 * 1024, 2 * 1024 * 1024)
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of `values`."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(fraction * len(ordered)))) - 1]
+
+# --- stub model tasks, registered by the server subprocess ---
+
+def stub_tasks(latency: float) -> Dict[str, type]:
+    """Stand-ins for the model tasks: same requests and results, `latency` seconds of blocking work."""
+    from PIL import Image
+    from tasks.task import Task, blocking
+    from tasks.file import FileReference
+    from tasks.streaming import TokenCoalescer
+
+    class StubText2Image(Task):
+        concurrency = 1
+
+        @classmethod
+        def load(cls):
+            pass
+
+        @classmethod
+        def unload(cls):
+            pass
+
+        @classmethod
+        async def execute(cls, prompt: str, size: str = "512x512", seed: int = 0, send_update=None) -> FileReference:
+            return await cls.render(prompt, send_update, asyncio.get_running_loop())
+
+        @classmethod
+        @blocking
+        def render(cls, prompt: str, send_update, loop) -> FileReference:
+            steps = 4
+            for step in range(steps):
+                time.sleep(latency / steps)
+                if send_update is not None:
+                    asyncio.run_coroutine_threadsafe(send_update(f"Step {step + 1}/{steps}", percent=(step + 1) * 100 // steps), loop)
+            image = Image.new("RGB", (64, 64), (len(prompt) % 256, 64, 128))
+            data = io.BytesIO()
+            image.save(data, format="PNG")
+            file = FileReference(f"stub_{uuid.uuid4()}.png")
+            file.write(data.getvalue())
+            return file
+
+    class StubText2Text(Task):
+        concurrency = 16
+
+        @classmethod
+        def load(cls):
+            pass
+
+        @classmethod
+        def unload(cls):
+            pass
+
+        @classmethod
+        async def execute(cls, roles: List[str], messages: List[str], max_tokens: int = 300, send_update=None) -> str:
+            stream = TokenCoalescer(send_update)
+            tokens = 20
+            for index in range(tokens):
+                await asyncio.sleep(latency / tokens)
+                stream.push(f"token{index} ")
+            return await stream.close()
+
+    return {"Text2Image": StubText2Image, "Text2Text": StubText2Text}
+
+def serve(port: int, latency: float):
+    import uvicorn
+    import server
+
+    server.load_tasks(["Capitalize", "Text2Imagefile", "File2Text"])
+    for name, task_class in stub_tasks(latency).items():
+        server.TASKS[name] = task_class
+        server.engine.set_limit(name, task_class.concurrency)
+    # measure the work itself, not cache hits or journal writes
+    server.result_cache = None
+    server.journal.enabled = False
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+# --- scenarios ---
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    # request number -> (task name, request, {file id: content})
+    make: Callable[[int], Tuple[str, proto_tasks.TaskRequest, Dict[str, bytes]]]
+
+def upload_request(index: int) -> Tuple[str, proto_tasks.TaskRequest, Dict[str, bytes]]:
+    content = random.Random(index).randbytes(UPLOAD_SIZES[index % len(UPLOAD_SIZES)])
+    file_id = f"bench-{uuid.uuid4()}"
+    file = proto_tasks.File(type="file_reference", id=file_id, name=f"{file_id}.bin",
+                            size=len(content), hash=hashlib.sha256(content).hexdigest())
+    return "file2text", proto_tasks.TaskRequest(file2text=proto_tasks.File2textRequest(file=file)), {file_id: content}
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in [
+        Scenario("capitalize", "cheap task, protocol and scheduling overhead",
+                 lambda i: ("capitalize", proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text=f"request {i}")), {})),
+        Scenario("text2imagefile", "CPU image rendering and an output file",
+                 lambda i: ("text2imagefile", proto_tasks.TaskRequest(text2imagefile=proto_tasks.Text2imagefileRequest(prompt=f"image {i}")), {})),
+        Scenario("uploads", "File2Text with uploaded inputs of 16 KiB to 2 MiB",
+                 upload_request),
+        Scenario("text2image_stub", "model stand-in: blocking latency, concurrency 1, progress updates",
+                 lambda i: ("text2image", proto_tasks.TaskRequest(text2image=proto_tasks.Text2imageRequest(prompt=f"image {i}", seed=i + 1)), {})),
+        Scenario("text2text_stub", "model stand-in: streamed tokens",
+                 lambda i: ("text2text", proto_tasks.TaskRequest(text2text=proto_tasks.Text2textRequest(roles=["user"], messages=[f"question {i}"])), {})),
+    ]
+}
+
+# --- client ---
+
+class BenchClient:
+    """One websocket connection that executes tasks and answers the server's file requests."""
+    def __init__(self, url: str, client_id: str):
+        self.url = f"{url}/ws/{client_id}"
+        self.files: Dict[str, bytes] = {}
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.updates = 0
+        self.capacity = 0
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, max_size=None)
+        await self.ws.send(bytes(wsmsg.ClientMessage(handshake=wsmsg.ClientHandshake("1.0.0"))))
+        message_type, handshake = betterproto.which_one_of(wsmsg.ServerMessage().parse(await self.ws.recv()), "message")
+        if message_type != "handshake":
+            raise RuntimeError(f"Expected a handshake, got {message_type}")
+        self.capacity = handshake.capacity
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for data in self.ws:
+            message_type, content = betterproto.which_one_of(wsmsg.ServerMessage().parse(data), "message")
+            if message_type in ("task_result", "error"):
+                future = self.pending.pop(content.task_id, None)
+                if future is not None and not future.done():
+                    future.set_result(message_type == "task_result")
+            elif message_type == "file_request":
+                asyncio.create_task(self.upload(content.file_id, content.offset))
+            elif message_type == "incremental_update":
+                self.updates += 1
+
+    async def upload(self, file_id: str, offset: int):
+        content = self.files[file_id]
+        for start in range(offset, len(content), UPLOAD_CHUNK_SIZE):
+            chunk = wsmsg.FileChunk(file_id=file_id, name=f"{file_id}.bin", offset=start,
+                                    data=content[start:start + UPLOAD_CHUNK_SIZE], size=len(content))
+            await self.ws.send(bytes(wsmsg.ClientMessage(file_chunk=chunk)))
+
+    async def execute(self, name: str, request: proto_tasks.TaskRequest, files: Dict[str, bytes]) -> Tuple[bool, float]:
+        """Run one task, returns whether it succeeded and its latency in seconds."""
+        self.files.update(files)
+        task_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self.pending[task_id] = future
+        started = time.perf_counter()
+        await self.ws.send(bytes(wsmsg.ClientMessage(execute=wsmsg.ExecuteTask(task_id=task_id, name=name, request=request))))
+        ok = await future
+        for file_id in files:
+            self.files.pop(file_id, None)
+        return ok, time.perf_counter() - started
+
+    async def close(self):
+        await self.ws.close()
+        self.reader.cancel()
+
+# --- running ---
+
+def memory_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Resident and peak resident memory of process `pid` (Linux only)."""
+    values: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values["rss_mb" if key == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return values
+
+async def run_scenario(url: str, pid: int, scenario: Scenario, clients: int, inflight: int, requests: int, warmup: int) -> Dict:
+    connections = [BenchClient(url, f"bench-{scenario.name}-{index}") for index in range(clients)]
+    await asyncio.gather(*(client.connect() for client in connections))
+    counter = iter(range(warmup + requests))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(client: BenchClient):
+        nonlocal errors
+        for index in counter:
+            name, request, files = scenario.make(index)
+            ok, latency = await client.execute(name, request, files)
+            if index < warmup:
+                continue
+            latencies.append(latency)
+            errors += not ok
+
+    # warmup requests run first and alone, so model loads stay out of the numbers
+    warm = [next(counter) for _ in range(warmup)]
+    for index in warm:
+        await connections[0].execute(*scenario.make(index))
+    memory_before = memory_mb(pid)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in connections for _ in range(inflight)))
+    elapsed = time.perf_counter() - started
+    memory_after = memory_mb(pid)
+    updates = sum(client.updates for client in connections)
+    await asyncio.gather(*(client.close() for client in connections))
+
+    return {
+        "description": scenario.description,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        "incremental_updates": updates,
+        "rss_before_mb": memory_before["rss_mb"],
+        "rss_after_mb": memory_after["rss_mb"],
+        "peak_rss_mb": memory_after["peak_rss_mb"],
+    }
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int, files_dir: str, serve_args: List[str], script: str = __file__) -> subprocess.Popen:
+    """Run `script --serve` on `port` with `files_dir` as files directory, returns once it answers."""
+    import httpx
+    env = dict(os.environ, TRASK_FILES_DIR=files_dir, TRASK_LOG_LEVEL=os.environ.get("TRASK_LOG_LEVEL", "ERROR"))
+    process = subprocess.Popen([sys.executable, os.path.abspath(script), "--serve", "--port", str(port), *serve_args],
+                               cwd=files_dir, env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/models", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start within 60s")
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        if base["p95_ms"] and result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms vs {base['p95_ms']}ms")
+        if base["throughput"] and result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']}/s vs {base['throughput']}/s")
+    return regressions
+
+def print_table(results: Dict):
+    columns = ["requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "max_ms", "peak_rss_mb"]
+    print(f"{'scenario':<18}" + "".join(f"{column:>13}" for column in columns))
+    for name, result in results["scenarios"].items():
+        cells = [result[column] if result[column] is not None else "-" for column in columns]
+        print(f"{name:<18}" + "".join(f"{cell:>13}" for cell in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the worker over its websocket protocol")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--clients", type=int, default=4, help="Websocket connections (default: 4)")
+    parser.add_argument("--inflight", type=int, default=2, help="Requests each connection keeps outstanding (default: 2)")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario (default: 100)")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests before each scenario (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds of work per stub model call (default: 0.05)")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one (no memory figures, stubs missing)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative p95/throughput regression against the baseline (default: 0.25)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.latency)
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory(prefix="trask-bench-") as files_dir:
+        process = None
+        if args.url:
+            url, pid = args.url.rstrip("/"), -1
+        else:
+            port = free_port()
+            process = start_server(port, files_dir, ["--latency", str(args.latency)])
+            url, pid = f"ws://127.0.0.1:{port}", process.pid
+        try:
+            results = {
+                "config": {key: getattr(args, key) for key in ("clients", "inflight", "requests", "warmup", "latency")},
+                "scenarios": {},
+            }
+            for name in names:
+                results["scenarios"][name] = asyncio.run(run_scenario(
+                    url, pid, SCENARIOS[name], args.clients, args.inflight, args.requests, args.warmup))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
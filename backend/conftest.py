@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db
+
+@pytest.fixture
+def isolated_server(monkeypatch, tmp_path):
+    """
+    The server with its stored files and file mapping in `tmp_path`, no
+    request journal, and fresh upload state, all restored after the test.
+    """
+    import server
+    import storage
+    import tasks.file
+
+    database = db.DatabaseManager(str(tmp_path / "id_map.db"))
+    database.setup()
+    for module in (server, tasks.file):
+        for name in ("get_file_path", "add_file_mapping", "get_file_hash", "set_file_hash"):
+            monkeypatch.setattr(module, name, getattr(database, name))
+    monkeypatch.setattr(server, "find_file_by_hash", database.find_file_by_hash)
+    monkeypatch.setattr(tasks.file, "FILES_DIR", str(tmp_path))
+    monkeypatch.setattr(tasks.file, "TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(storage, "TEMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(server.storage, "files_dir", str(tmp_path))
+    monkeypatch.setattr(server.journal, "enabled", False)
+    for name in ("available_files", "file_upload_events", "upload_activity", "requested_files", "resync_requested"):
+        monkeypatch.setattr(server, name, type(getattr(server, name))())
+    yield server
+    database.close()
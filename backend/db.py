@@ -1,35 +1,83 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from fastapi import HTTPException
 from contextlib import contextmanager
 
+from log import logger
+
 class DatabaseManager:
-    def __init__(self, db_path):
+    """
+    File id -> path/hash mapping in sqlite.
+
+    The database runs in WAL mode so reads never wait on the writer. Each
+    thread gets its own read connection, and all writes go through a single
+    writer thread that commits queued statements in batches, so bursts of
+    `add_file_mapping` cost one transaction instead of one each. Mappings are
+    kept in an in-memory LRU cache that writes update immediately, so lookups
+    from the event loop rarely touch sqlite and always see queued writes.
+    A batch that still fails after `write_retries` retries is dropped, and
+    its file ids leave the cache so lookups fall back to what is on disk.
+    """
+    def __init__(self, db_path, cache_size: int = 10000, batch_size: int = 256, write_retries: int = 3):
         self.db_path = db_path
-        self.conn = None
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # file_id -> (file_path, hash), most recently used last
+        self._cache: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+        # hash -> ids of cached files with that content, so find_file_by_hash needs no scan
+        self._by_hash: Dict[str, Set[str]] = {}
+        self._cache_lock = threading.Lock()
+        # (statement, parameters, file id it changes)
+        self._writes: "queue.Queue[Optional[Tuple[str, tuple, str]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "commits": 0, "retries": 0, "failed_writes": 0}
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
 
-    def connect(self):
-        if not self.conn:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
+    def connect(self) -> sqlite3.Connection:
+        """This thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
 
     def close(self):
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        self.flush()
+        if self._writer:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
     @contextmanager
     def get_cursor(self):
-        self.connect()
-        if not self.conn:
-            raise Exception("Database connection is closed")
-        
-        cursor = self.conn.cursor()
+        conn = self.connect()
+        cursor = conn.cursor()
         try:
             yield cursor
-            self.conn.commit()
+            conn.commit()
         except Exception:
-            self.conn.rollback()
+            conn.rollback()
             raise
         finally:
             cursor.close()
@@ -39,25 +87,166 @@ class DatabaseManager:
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS file_mapping (
                     file_id TEXT PRIMARY KEY,
-                    file_path TEXT NOT NULL
+                    file_path TEXT NOT NULL,
+                    hash TEXT
                 )
             ''')
+            # databases created before content hashing lack the hash column
+            columns = [row['name'] for row in cursor.execute("PRAGMA table_info(file_mapping)")]
+            if 'hash' not in columns:
+                cursor.execute("ALTER TABLE file_mapping ADD COLUMN hash TEXT")
+            cursor.execute("CREATE INDEX IF NOT EXISTS file_mapping_hash ON file_mapping (hash)")
 
-    def get_file_path(self, file_id: str) -> str:
+    # writes
+
+    def _write(self, sql: str, params: tuple, file_id: str):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+            self._writer.start()
+        self.stats["writes"] += 1
+        self._writes.put((sql, params, file_id))
+
+    def _commit(self, conn: sqlite3.Connection, statements: List[Tuple[str, tuple, str]]):
+        for attempt in range(self.write_retries + 1):
+            try:
+                with conn:
+                    for sql, params, _ in statements:
+                        conn.execute(sql, params)
+                self.stats["commits"] += 1
+                return
+            except sqlite3.Error as e:
+                if attempt < self.write_retries:
+                    self.stats["retries"] += 1
+                    logger.warning("Database write of %d statements failed, retrying: %s", len(statements), e)
+                    time.sleep(0.1 * (attempt + 1))
+                    continue
+                self.stats["failed_writes"] += len(statements)
+                logger.error("Database write of %d statements failed: %s", len(statements), e)
+        # the cache must not keep serving mappings that never reached the database
+        with self._cache_lock:
+            for _, _, file_id in statements:
+                self._uncache(file_id)
+
+    def _write_loop(self):
+        conn = self._open()
+        stop = False
+        while not stop:
+            batch = [self._writes.get()]
+            # whatever queued up meanwhile goes into the same transaction
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            statements = [item for item in batch if item is not None]
+            stop = len(statements) < len(batch)
+            try:
+                if statements:
+                    self._commit(conn, statements)
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def flush(self):
+        """Block until every queued write is committed."""
+        if self._writer:
+            self._writes.join()
+
+    def _remember(self, file_id: str, file_path: str, file_hash: Optional[str]):
+        with self._cache_lock:
+            self._uncache(file_id)
+            self._cache[file_id] = (file_path, file_hash)
+            if file_hash:
+                self._by_hash.setdefault(file_hash, set()).add(file_id)
+            while len(self._cache) > self.cache_size:
+                self._uncache(next(iter(self._cache)))
+
+    def _uncache(self, file_id: str):
+        """Drop a cache entry and its hash index entry. Hold the cache lock."""
+        entry = self._cache.pop(file_id, None)
+        if entry is not None and entry[1]:
+            ids = self._by_hash[entry[1]]
+            ids.discard(file_id)
+            if not ids:
+                del self._by_hash[entry[1]]
+
+    def _lookup(self, file_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        with self._cache_lock:
+            entry = self._cache.get(file_id)
+            if entry is not None:
+                self._cache.move_to_end(file_id)
+                self.stats["hits"] += 1
+                return entry
+        self.stats["misses"] += 1
         with self.get_cursor() as cursor:
-            cursor.execute("SELECT file_path FROM file_mapping WHERE file_id = ?", (file_id,))
+            cursor.execute("SELECT file_path, hash FROM file_mapping WHERE file_id = ?", (file_id,))
             result = cursor.fetchone()
-        
-        if result:
-            return result['file_path']
+        if result is None:
+            return None
+        self._remember(file_id, result['file_path'], result['hash'])
+        return result['file_path'], result['hash']
+
+    def get_file_path(self, file_id: str) -> str:
+        entry = self._lookup(file_id)
+        if entry:
+            return entry[0]
         raise HTTPException(status_code=404, detail=f"File ID {file_id} not found")
 
-    def add_file_mapping(self, file_id: str, file_path: str):
+    def add_file_mapping(self, file_id: str, file_path: str, file_hash: Optional[str] = None):
+        self._remember(file_id, file_path, file_hash)
+        self._write("INSERT OR REPLACE INTO file_mapping (file_id, file_path, hash) VALUES (?, ?, ?)", (file_id, file_path, file_hash), file_id)
+
+    def set_file_hash(self, file_id: str, file_hash: str):
+        entry = self._lookup(file_id)
+        if entry is not None:
+            self._remember(file_id, entry[0], file_hash)
+        self._write("UPDATE file_mapping SET hash = ? WHERE file_id = ?", (file_hash, file_id), file_id)
+
+    def get_file_hash(self, file_id: str) -> Optional[str]:
+        entry = self._lookup(file_id)
+        return entry[1] if entry else None
+
+    def find_file_by_hash(self, file_hash: str) -> Optional[str]:
+        """Path of a stored file with this content hash, if we have one on disk."""
+        with self._cache_lock:
+            paths = [self._cache[file_id][0] for file_id in self._by_hash.get(file_hash, ())]
+        for path in paths:
+            if os.path.exists(path):
+                return path
         with self.get_cursor() as cursor:
-            cursor.execute("INSERT OR REPLACE INTO file_mapping (file_id, file_path) VALUES (?, ?)", (file_id, file_path))
+            cursor.execute("SELECT file_path FROM file_mapping WHERE hash = ?", (file_hash,))
+            rows = cursor.fetchall()
+        for row in rows:
+            if os.path.exists(row['file_path']):
+                return row['file_path']
+        return None
+
+    def file_paths(self) -> List[str]:
+        """Every distinct stored path."""
+        self.flush()
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT DISTINCT file_path FROM file_mapping")
+            return [row['file_path'] for row in cursor.fetchall()]
+
+    def remove_paths(self, paths: Iterable[str]) -> int:
+        """Drop every mapping to `paths`, returns the number of rows removed."""
+        paths = set(paths)
+        if not paths:
+            return 0
+        with self._cache_lock:
+            for file_id in [file_id for file_id, (path, _) in self._cache.items() if path in paths]:
+                self._uncache(file_id)
+        self.flush()
+        with self.get_cursor() as cursor:
+            cursor.executemany("DELETE FROM file_mapping WHERE file_path = ?", [(path,) for path in paths])
+            return cursor.rowcount
+
+    def report(self) -> Dict:
+        return dict(self.stats, cached=len(self._cache), queued=self._writes.qsize())
 
 # Create an instance of the DatabaseManager
-file_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')
+# stored files and their mapping db, $TRASK_FILES_DIR moves them (e.g. for benchmarks)
+file_dir = os.path.abspath(os.environ.get("TRASK_FILES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')))
 os.makedirs(file_dir, exist_ok=True)
 db_path = os.path.join(file_dir, 'id_map.db')
 db_manager = DatabaseManager(db_path)
@@ -68,6 +257,10 @@ db_manager.setup()
 # Expose the methods we need
 get_file_path = db_manager.get_file_path
 add_file_mapping = db_manager.add_file_mapping
+set_file_hash = db_manager.set_file_hash
+get_file_hash = db_manager.get_file_hash
+find_file_by_hash = db_manager.find_file_by_hash
+flush_db = db_manager.flush
 
 def close_db_connection():
-    db_manager.close()
\ No newline at end of file
+    db_manager.close()
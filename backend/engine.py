@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from log import logger
+from metrics import TASK_STAGE_SECONDS
+
+class ExecutionEngine:
+    """
+    Runs task executions as scheduled jobs so the websocket receive loop never
+    waits on them. Each task type gets its own concurrency limit: I/O bound
+    tasks (OpenAI calls) can run many at once, GPU pipelines usually one.
+    """
+    def __init__(self, default_limit: int = 1):
+        self.default_limit = default_limit
+        self.limits: Dict[str, int] = {}
+        self.jobs: Dict[str, asyncio.Task] = {}
+        self.job_owners: Dict[str, str] = {}
+        self.queued: Dict[str, int] = {}
+        self.running: Dict[str, int] = {}
+        # jobs that got a slot, as opposed to ones still preparing or waiting for one
+        self.started: Set[str] = set()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def set_limit(self, task_name: str, limit: int):
+        if limit < 1:
+            raise ValueError(f"Concurrency limit for {task_name} must be at least 1, got {limit}")
+        self.limits[task_name] = limit
+        # semaphores are created lazily, drop the old one so the new limit applies to new jobs
+        self._semaphores.pop(task_name, None)
+
+    def get_limit(self, task_name: str) -> int:
+        return self.limits.get(task_name, self.default_limit)
+
+    def _semaphore(self, task_name: str) -> asyncio.Semaphore:
+        if task_name not in self._semaphores:
+            self._semaphores[task_name] = asyncio.Semaphore(self.get_limit(task_name))
+        return self._semaphores[task_name]
+
+    def queue_depth(self, task_name: Optional[str] = None) -> int:
+        if task_name is None:
+            return sum(self.queued.values())
+        return self.queued.get(task_name, 0)
+
+    def running_count(self, task_name: Optional[str] = None) -> int:
+        if task_name is None:
+            return sum(self.running.values())
+        return self.running.get(task_name, 0)
+
+    def submit(self,
+               job_id: str,
+               task_name: str,
+               job: Callable[..., Awaitable],
+               owner: str = "",
+               prepare: Optional[Callable[[], Awaitable[Any]]] = None) -> asyncio.Task:
+        """
+        Schedule `job` to run once a slot for `task_name` is free and return its asyncio task.
+        `prepare` (e.g. fetching input files) runs right away, before waiting for a slot, so
+        queued jobs are ready to go when one frees up; its result is passed to `job`, and a
+        None result drops the job.
+        """
+        state = {"waiting": True}
+
+        async def run():
+            args = ()
+            if prepare is not None:
+                prepared = await prepare()
+                if prepared is None:
+                    return None
+                args = (prepared,)
+            ready = time.perf_counter()
+            async with self._semaphore(task_name):
+                TASK_STAGE_SECONDS.observe(time.perf_counter() - ready, task=task_name, stage="queue_wait")
+                self.queued[task_name] -= 1
+                state["waiting"] = False
+                self.started.add(job_id)
+                self.running[task_name] = self.running.get(task_name, 0) + 1
+                try:
+                    return await job(*args)
+                finally:
+                    self.running[task_name] -= 1
+
+        def done(task: asyncio.Task):
+            # a job cancelled before it ever started never enters run(), so bookkeeping lives here
+            if state["waiting"]:
+                self.queued[task_name] -= 1
+            if self.jobs.get(job_id) is task:
+                del self.jobs[job_id]
+                self.job_owners.pop(job_id, None)
+                self.started.discard(job_id)
+            self._report_failure(task)
+
+        self.queued[task_name] = self.queued.get(task_name, 0) + 1
+        task = asyncio.create_task(run(), name=f"{task_name}:{job_id}")
+        task.add_done_callback(done)
+        self.jobs[job_id] = task
+        self.job_owners[job_id] = owner
+        return task
+
+    @staticmethod
+    def _report_failure(task: asyncio.Task):
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            logger.error("Job %s failed outside of task error handling", task.get_name(), exc_info=exc)
+
+    def cancel(self, job_id: str) -> bool:
+        task = self.jobs.get(job_id)
+        if task is None:
+            return False
+        return task.cancel()
+
+    def is_started(self, job_id: str) -> bool:
+        return job_id in self.started
+
+    def jobs_of(self, owner: str) -> Set[str]:
+        return {job_id for job_id, job_owner in self.job_owners.items() if job_owner == owner}
+
+    def cancel_owner(self, owner: str) -> Set[str]:
+        """Cancel every job submitted on behalf of `owner` (e.g. a disconnected client)."""
+        cancelled = self.jobs_of(owner)
+        for job_id in cancelled:
+            self.cancel(job_id)
+        return cancelled
+
+    async def shutdown(self):
+        jobs = list(self.jobs.values())
+        for task in jobs:
+            task.cancel()
+        if jobs:
+            await asyncio.gather(*jobs, return_exceptions=True)
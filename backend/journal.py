@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import betterproto
+
+from log import logger
+
+def to_json(value: Any) -> Any:
+    """json.dumps default for journal entries, which may hold protobuf messages."""
+    if isinstance(value, betterproto.Message):
+        return value.to_dict()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return str(value)
+
+class RequestJournal:
+    """
+    Append-only log of handled requests, one JSON object per line in
+    `directory`/`filename` (requests.jsonl). The file is rotated to
+    requests.1.jsonl, requests.2.jsonl, ... once it would grow past
+    `max_bytes`, keeping at most `backups` old files.
+
+    `record` only queues the entry: a writer thread serializes and writes it,
+    so entries may hold protobuf messages as they are and the event loop
+    never waits on disk. The last `recent` entries are also kept in memory.
+    """
+    def __init__(self,
+                 directory: str,
+                 filename: str = "requests.jsonl",
+                 max_bytes: int = 64 * 1024 * 1024,
+                 backups: int = 5,
+                 recent: int = 200):
+        self.directory = directory
+        self.path = os.path.join(directory, filename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = True
+        self.recent: deque = deque(maxlen=recent)
+        self.stats = {"entries": 0, "bytes": 0, "rotations": 0, "errors": 0}
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+
+    def record(self, entry: Dict):
+        self.recent.append(entry)
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="request-journal", daemon=True)
+                self._writer.start()
+        self._queue.put(entry)
+
+    def _write_loop(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            entries = [self._queue.get()]
+            # drain whatever piled up meanwhile, one write per burst
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in entries
+            lines = []
+            for entry in entries:
+                if entry is None:
+                    continue
+                try:
+                    lines.append(json.dumps(entry, default=to_json, ensure_ascii=False) + "\n")
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error("Could not serialize journal entry %s: %s", entry.get("id"), e)
+            try:
+                self._write(lines)
+            except OSError as e:
+                self.stats["errors"] += 1
+                logger.error("Could not write request journal: %s", e)
+            for _ in entries:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, lines: List[str]):
+        data = "".join(lines).encode()
+        if not data:
+            return
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size and size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.stats["entries"] += len(lines)
+        self.stats["bytes"] += len(data)
+
+    def _rotate(self):
+        base, ext = os.path.splitext(self.path)
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{base}.{index}{ext}"
+            if os.path.exists(older):
+                os.replace(older, f"{base}.{index + 1}{ext}")
+        os.replace(self.path, f"{base}.1{ext}")
+        self.stats["rotations"] += 1
+
+    def flush(self):
+        """Wait until every recorded entry is on disk."""
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    def latest(self, limit: int = 50) -> List[Dict]:
+        """The most recent entries, newest first, as plain JSON data."""
+        entries = list(self.recent)[-limit:][::-1] if limit > 0 else []
+        return json.loads(json.dumps(entries, default=to_json))
+
+    def report(self) -> Dict:
+        return dict(
+            self.stats,
+            enabled=self.enabled,
+            path=self.path,
+            pending=self._queue.qsize(),
+            max_bytes=self.max_bytes,
+            backups=self.backups,
+        )
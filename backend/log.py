@@ -0,0 +1,98 @@
+import atexit
+import dataclasses
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Any, Optional
+
+import betterproto
+
+# Every backend module logs through this logger (or a child of it)
+logger = logging.getLogger("trask")
+
+# A summarized payload keeps this much of each string and list
+MAX_STRING = int(os.environ.get("TRASK_LOG_MAX_STRING", 200))
+MAX_ITEMS = int(os.environ.get("TRASK_LOG_MAX_ITEMS", 10))
+
+def summarize(value: Any, max_string: int = MAX_STRING, max_items: int = MAX_ITEMS) -> Any:
+    """
+    A JSON-friendly view of `value` with a bounded size: protobuf messages
+    keep only fields that are set, bytes become their length, and long
+    strings and lists are cut short.
+    """
+    if isinstance(value, betterproto.Message):
+        fields = {}
+        for field in dataclasses.fields(value):
+            item = getattr(value, field.name)
+            # unset oneof members and defaults are noise
+            if isinstance(item, betterproto.Message):
+                if not betterproto.serialized_on_wire(item):
+                    continue
+            elif not item:
+                continue
+            fields[field.name] = summarize(item, max_string, max_items)
+        return fields
+    if isinstance(value, dict):
+        return {str(key): summarize(item, max_string, max_items) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarize(item, max_string, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"... (+{len(value) - max_items} items)")
+        return items
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > max_string:
+        return f"{text[:max_string]}... (+{len(text) - max_string} chars)"
+    return text
+
+class Payload:
+    """
+    Log argument that is only summarized and serialized if the record is
+    actually emitted, e.g. logger.debug("Sending %s", Payload(message)).
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(summarize(self.value), default=str, ensure_ascii=False)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread as they are. The stock QueueHandler
+    formats the message first, which would serialize payloads on the
+    caller's thread (usually the event loop).
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: str = os.environ.get("TRASK_LOG_LEVEL", "INFO"), stream=None, prefix: str = ""):
+    """Send backend logs at `level` and above to `stream` (stdout) from a background thread, each line after `prefix`."""
+    global _listener
+    stop_logging()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(f"%(asctime)s %(levelname)-7s {prefix}%(message)s", "%Y-%m-%d %H:%M:%S"))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    logger.handlers[:] = [DeferredQueueHandler(records)]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+def stop_logging():
+    """Write out queued records and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
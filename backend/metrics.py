@@ -0,0 +1,161 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds, from a fast cache hit to a long diffusion run with a cold model load
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values]
+
+class Gauge(Metric):
+    """A value read when metrics are rendered, e.g. the current queue depth."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Callable[[], Dict[Tuple[str, ...], float]] = dict):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+                for key, value in sorted(self.collect().items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: count per bucket (the last one is +Inf), sum
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.series:
+                self.series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self.series[key]
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the block takes, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self.series.get(self.key(labels))
+        return sum(series[0]) if series else 0
+
+    def sum(self, **labels: str) -> float:
+        series = self.series.get(self.key(labels))
+        return series[1][0] if series else 0.0
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self.series.items())
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))  # type: ignore
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (),
+              collect: Callable[[], Dict[Tuple[str, ...], float]] = dict) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))  # type: ignore
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))  # type: ignore
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+registry = Registry()
+
+# Where a task's time goes, per task type. Stages: file_wait (inputs being
+# uploaded), queue_wait (ready, waiting for an execution slot), model_load,
+# execute, convert (result to protobuf and serialized) and send.
+TASK_STAGE_SECONDS = registry.histogram(
+    "trask_task_stage_seconds", "Time spent in each stage of a task execution", ("task", "stage"))
+TASK_BYTES = registry.counter(
+    "trask_task_bytes_total", "Bytes of task input files (in) and results sent to clients (out)", ("task", "direction"))
+TASKS_TOTAL = registry.counter(
+    "trask_tasks_total", "Finished tasks by outcome: success, error, cancelled or cached", ("task", "outcome"))
+TASK_ERRORS = registry.counter(
+    "trask_task_errors_total", "Failed tasks by exception type", ("task", "error"))
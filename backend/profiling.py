@@ -0,0 +1,220 @@
+import asyncio
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import types
+from datetime import datetime
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Set
+
+from log import logger
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dumps", "profiles")
+
+def env_tasks(value: str) -> Set[str]:
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+class Invocation:
+    """
+    Profiles of one task execution: the execute coroutine's own steps on the
+    event loop, and every blocking call it makes (run_blocking / @blocking)
+    on worker threads. With `use_torch`, blocking calls are also recorded by
+    torch.profiler, one call at a time since it profiles the whole process.
+    """
+    def __init__(self, task_name: str, task_id: str, use_torch: bool):
+        self.task_name = task_name
+        self.task_id = task_id
+        self.use_torch = use_torch
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.profiles: List[cProfile.Profile] = []
+        self.traces: List[Any] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _enable(profile: cProfile.Profile, wait: float = 0) -> bool:
+        # sections of one execution may overlap (e.g. gathered blocking calls), those run unprofiled
+        if not _section_lock.acquire(timeout=wait):
+            return False
+        profile.enable()
+        return True
+
+    @staticmethod
+    def _disable(profile: cProfile.Profile):
+        profile.disable()
+        _section_lock.release()
+
+    def _profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    @types.coroutine
+    def steps(self, coroutine: Coroutine):
+        """
+        Await `coroutine`, profiling only while it runs, so other coroutines
+        sharing the event loop meanwhile do not end up in its profile.
+        """
+        profile = self._profile()
+        value, error = None, None
+        while True:
+            enabled = self._enable(profile)
+            try:
+                yielded = coroutine.throw(error) if error is not None else coroutine.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if enabled:
+                    self._disable(profile)
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+    def call(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking call of this execution under the profiler(s), on the calling thread."""
+        profile = self._profile()
+        torch_profile = self._torch_profile()
+        try:
+            if torch_profile is not None:
+                torch_profile.__enter__()
+            # the event loop step that started this call may still be profiled for a moment
+            enabled = self._enable(profile, wait=SECTION_WAIT)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if enabled:
+                    self._disable(profile)
+        finally:
+            if torch_profile is not None:
+                torch_profile.__exit__(None, None, None)
+                with self.lock:
+                    self.traces.append(torch_profile)
+                _torch_lock.release()
+
+    def _torch_profile(self) -> Optional[Any]:
+        # only if a task already imported torch, and never two at once
+        if not self.use_torch or "torch" not in sys.modules or not _torch_lock.acquire(blocking=False):
+            return None
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return torch.profiler.profile(activities=activities, record_shapes=True)
+
+    def save(self, directory: str, top: int = 40) -> List[str]:
+        """Write the merged cProfile stats (.prof), a text summary and torch traces, returns the paths."""
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", self.task_id)[:64]
+        base = os.path.join(directory, f"{stamp}_{self.task_name}_{safe_id}")
+        paths = []
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(base + ".prof")
+            summary = io.StringIO()
+            summary.write(f"{self.task_name} {self.task_id}: {self.seconds:.3f}s wall, {len(profiles)} profiled sections\n\n")
+            pstats.Stats(base + ".prof", stream=summary).sort_stats("cumulative").print_stats(top)
+            with open(base + ".txt", "w") as f:
+                f.write(summary.getvalue())
+            paths += [base + ".prof", base + ".txt"]
+        for index, trace in enumerate(self.traces):
+            path = f"{base}.torch{index}.json"
+            trace.export_chrome_trace(path)
+            paths.append(path)
+        return paths
+
+_current: contextvars.ContextVar[Optional[Invocation]] = contextvars.ContextVar("profiling_invocation", default=None)
+_torch_lock = threading.Lock()
+# Python 3.12+ allows only one active cProfile profiler per process (they share
+# sys.monitoring), so one execution is profiled at a time, one section at a time
+_invocation_lock = threading.Lock()
+_section_lock = threading.Lock()
+SECTION_WAIT = 0.1  # seconds a blocking call waits for another section to end before running unprofiled
+
+def current() -> Optional[Invocation]:
+    """The profiled execution the caller belongs to, if any."""
+    return _current.get()
+
+class Profiler:
+    """
+    Opt-in profiling of task executions, switched on per task type ("*" for
+    all of them) through $TRASK_PROFILE, the --profile flag or the
+    /api/profiling endpoint. Each profiled execution writes its profiles to
+    `directory`, which keeps only the newest `max_files` files.
+    """
+    def __init__(self,
+                 directory: str = PROFILES_DIR,
+                 tasks: Set[str] = env_tasks(os.environ.get("TRASK_PROFILE", "")),
+                 use_torch: bool = os.environ.get("TRASK_PROFILE_TORCH", "") not in ("", "0"),
+                 max_files: int = 100):
+        self.directory = directory
+        self.tasks = set(tasks)
+        self.use_torch = use_torch
+        self.max_files = max_files
+        self.stats: Dict[str, int] = {"profiled": 0, "skipped": 0, "removed_files": 0}
+
+    def enabled(self, task_name: str) -> bool:
+        return task_name in self.tasks or "*" in self.tasks
+
+    def set(self, task_name: str, enabled: bool):
+        if enabled:
+            self.tasks.add(task_name)
+        else:
+            self.tasks.discard(task_name)
+
+    async def run(self, task_name: str, task_id: str, coroutine: Coroutine) -> Any:
+        """Await a task's execute coroutine under the profiler, or unprofiled while another execution is profiled."""
+        if not _invocation_lock.acquire(blocking=False):
+            self.stats["skipped"] += 1
+            logger.info("Not profiling %s %s: another profiled execution is running", task_name, task_id)
+            return await coroutine
+        invocation = Invocation(task_name, task_id, self.use_torch)
+        token = _current.set(invocation)
+        try:
+            return await invocation.steps(coroutine)
+        finally:
+            _current.reset(token)
+            _invocation_lock.release()
+            invocation.seconds = time.perf_counter() - invocation.started
+            try:
+                # pstats sorting and file writes stay off the event loop
+                paths = await asyncio.to_thread(self._save, invocation)
+                logger.info("Profiled %s %s in %.3fs: %s", task_name, task_id, invocation.seconds, paths[0] if paths else "no samples")
+            except Exception as e:
+                logger.warning("Could not save profile of %s %s: %s", task_name, task_id, e)
+
+    def _save(self, invocation: Invocation) -> List[str]:
+        paths = invocation.save(self.directory)
+        self.stats["profiled"] += 1
+        self.prune()
+        return paths
+
+    def prune(self):
+        files = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory) if entry.is_file())
+        for _, path in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(path)
+                self.stats["removed_files"] += 1
+            except OSError:
+                pass
+
+    def report(self) -> Dict:
+        files = sorted(os.listdir(self.directory)) if os.path.isdir(self.directory) else []
+        return dict(
+            self.stats,
+            tasks=sorted(self.tasks),
+            torch=self.use_torch,
+            directory=self.directory,
+            max_files=self.max_files,
+            files=files[-20:],
+        )
@@ -125,6 +125,18 @@ class ProtoGenerator:
         
         return proto_definitions
 
+def adapt_name(task_name):
+    pascal = ProtoGenerator.to_pascal_case(task_name)
+    # also cap after numbers
+    final = ""
+    for i, c in enumerate(pascal):
+        if i > 0 and pascal[i-1].isdigit() and c.isalpha() and c.islower():
+            final += c.upper()
+        else:
+            final += c
+    
+    return final
+
 # Create an instance of ProtoGenerator
 proto_gen = ProtoGenerator()
 
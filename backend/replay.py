@@ -0,0 +1,351 @@
+"""
+Replays recorded traffic against the worker. Reads the request journal
+(dumps/requests.jsonl and its rotated requests.N.jsonl files) or the older
+dumps/*_logs.json files, and sends every recorded request again over the
+websocket protocol at its original time offset, or faster with --speed.
+
+    python replay.py dumps/requests*.jsonl                  # original pacing
+    python replay.py dumps/requests.jsonl --speed 20        # 20x faster
+    python replay.py dumps/requests.jsonl --speed 0         # everything at once
+    python replay.py old.json --json new.json --baseline base.json
+
+Like bench.py it starts server.py in a subprocess with an empty files
+directory. Tasks outside --real are replaced by timing stubs that take as
+long as the recorded executions of that task type (sampled from the
+trace), so scheduler, result cache and batching changes can be evaluated
+against production traffic shapes on a CPU-only box. Input files are
+replaced by random content of the recorded size; a file id used by several
+requests stays one file, as it was in production.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from proto.py import tasks as proto_tasks  # type: ignore
+
+import betterproto
+
+from bench import BenchClient, compare, free_port, memory_mb, percentile, start_server
+from protobuf_generator import adapt_name
+
+# tasks that run for real by default: CPU only, no model downloads
+REAL_TASKS = ("Capitalize", "Text2Imagefile", "File2Text")
+# size of replayed input files whose recorded reference has none
+DEFAULT_FILE_SIZE = 64 * 1024
+# execution time of stubbed tasks without a recorded duration
+DEFAULT_STUB_SECONDS = 0.1
+
+@dataclass
+class TraceEntry:
+    offset: float  # seconds after the first recorded request
+    client: str
+    name: str  # request field, e.g. "text2image"
+    task: str  # task class name, e.g. "Text2Image"
+    request: Dict[str, Any]  # as recorded, a TaskRequest in JSON form
+    seconds: Optional[float]  # recorded execution time
+    cached: bool
+
+def read_entries(path: str) -> List[Dict]:
+    """Raw entries of a journal file (JSON lines) or of an old dump (one JSON list)."""
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def replayable(value: Any) -> bool:
+    """Old dumps stored input files as FileReference reprs, those requests cannot be rebuilt."""
+    if isinstance(value, dict):
+        return all(replayable(item) for item in value.values())
+    if isinstance(value, list):
+        return all(replayable(item) for item in value)
+    return not (isinstance(value, str) and "FileReference object" in value)
+
+def build_request(request: Dict[str, Any]) -> Optional[proto_tasks.TaskRequest]:
+    """The TaskRequest recorded as `request`, None if it is not one."""
+    (name, fields), = request.items()
+    field = getattr(proto_tasks.TaskRequest(), name, None)
+    if not isinstance(field, betterproto.Message) or not isinstance(fields, dict):
+        return None
+    # from_dict on TaskRequest itself would leave the oneof unset
+    return proto_tasks.TaskRequest(**{name: type(field)().from_dict(fields)})
+
+def load_trace(paths: List[str], max_gap: float = 0) -> Tuple[List[TraceEntry], int]:
+    """
+    All replayable entries of `paths` ordered by time, and how many entries
+    were skipped. With `max_gap`, idle periods between two requests (e.g.
+    between traces of different days) are shortened to at most that many seconds.
+    """
+    raw, skipped = [], 0
+    for path in paths:
+        for entry in read_entries(path):
+            request = entry.get("input")
+            if not isinstance(request, dict) or len(request) != 1 or not replayable(request):
+                skipped += 1
+                continue
+            if build_request(request) is None:
+                skipped += 1
+                continue
+            raw.append((datetime.fromisoformat(str(entry["time"])), entry, next(iter(request))))
+    raw.sort(key=lambda item: item[0])
+    if not raw:
+        return [], skipped
+    offsets, offset = [], 0.0
+    for index, (recorded, _, _) in enumerate(raw):
+        if index:
+            gap = (recorded - raw[index - 1][0]).total_seconds()
+            offset += min(gap, max_gap) if max_gap > 0 else gap
+        offsets.append(offset)
+    return [
+        TraceEntry(
+            offset=offset,
+            client=str(entry.get("client") or "replay"),
+            name=name,
+            task=adapt_name(entry.get("type") or name),
+            request=entry["input"],
+            seconds=entry.get("seconds"),
+            cached=bool(entry.get("cached")),
+        )
+        for offset, (_, entry, name) in zip(offsets, raw)
+    ], skipped
+
+def stub_durations(trace: List[TraceEntry], real: List[str]) -> Dict[str, List[float]]:
+    """Recorded execution times per stubbed task type. Cached answers say nothing about execution, so they are left out."""
+    durations: Dict[str, List[float]] = defaultdict(list)
+    for entry in trace:
+        if entry.task not in real and entry.seconds is not None and not entry.cached:
+            durations[entry.task].append(round(float(entry.seconds), 4))
+    stubbed = {entry.task for entry in trace if entry.task not in real}
+    return {task: durations.get(task) or [DEFAULT_STUB_SECONDS] for task in sorted(stubbed)}
+
+# --- server side ---
+
+def timing_stub(task_name: str, durations: List[float], concurrency: int) -> type:
+    """A task that answers like `task_name` after blocking for one of the recorded `durations`."""
+    from tasks.task import Task, blocking
+    from tasks.file import FileReference
+
+    response_class = getattr(proto_tasks, f"{task_name[0]}{task_name[1:].lower()}Response", None)
+    returns_file = response_class is not None and isinstance(response_class().result, proto_tasks.File)
+    rng = random.Random(task_name)
+
+    class TimingStub(Task):
+        @classmethod
+        def load(cls):
+            pass
+
+        @classmethod
+        def unload(cls):
+            pass
+
+        @classmethod
+        async def execute(cls, send_update=None, **request) -> Any:
+            return await cls.wait(rng.choice(durations))
+
+        @classmethod
+        @blocking
+        def wait(cls, seconds: float) -> Any:
+            time.sleep(seconds)
+            if not returns_file:
+                return f"{task_name} stub result"
+            file = FileReference(f"stub_{uuid.uuid4()}.bin")
+            file.write(b"\0" * 1024)
+            return file
+
+    TimingStub.__name__ = TimingStub.__qualname__ = f"{task_name}Stub"
+    TimingStub.concurrency = concurrency
+    return TimingStub
+
+def serve(port: int, stubs_path: str, real: List[str], cache: bool):
+    import uvicorn
+    import server
+
+    with open(stubs_path) as f:
+        stubs = json.load(f)
+    # real task classes, also to learn the stubbed tasks' concurrency where they import
+    server.load_tasks()
+    for name, durations in stubs.items():
+        concurrency = server.concurrency_overrides.get(name, server.TASKS[name].concurrency if name in server.TASKS else 1)
+        server.TASKS[name] = timing_stub(name, durations, concurrency)
+        server.engine.set_limit(name, concurrency)
+    for name in list(server.TASKS):
+        if name not in real and name not in stubs:
+            del server.TASKS[name]
+    if not cache:
+        server.result_cache = None
+    server.journal.enabled = False
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+# --- client side ---
+
+class FileMapper:
+    """Stands in random content of the recorded size for every recorded input file."""
+    def __init__(self):
+        self.files: Dict[str, Tuple[str, bytes]] = {}
+
+    def rewrite(self, value: Any, files: Dict[str, bytes]) -> Any:
+        if isinstance(value, list):
+            return [self.rewrite(item, files) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if value.get("type") != "file_reference":
+            return {key: self.rewrite(item, files) for key, item in value.items()}
+        recorded_id = value.get("id", "")
+        if recorded_id not in self.files:
+            size = int(value.get("size") or DEFAULT_FILE_SIZE)
+            self.files[recorded_id] = (f"replay-{uuid.uuid4()}", random.Random(recorded_id).randbytes(size))
+        file_id, content = self.files[recorded_id]
+        files[file_id] = content
+        return dict(value, id=file_id, name=value.get("name") or f"{file_id}.bin",
+                    size=len(content), hash=hashlib.sha256(content).hexdigest())
+
+async def replay(url: str, pid: int, trace: List[TraceEntry], speed: float) -> Dict:
+    clients = {name: BenchClient(url, f"replay-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}") for name in {entry.client for entry in trace}}
+    await asyncio.gather(*(client.connect() for client in clients.values()))
+    mapper = FileMapper()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lags: List[float] = []
+
+    async def send(entry: TraceEntry, due: float):
+        lags.append(max(0.0, time.perf_counter() - due))
+        files: Dict[str, bytes] = {}
+        request = build_request(mapper.rewrite(entry.request, files))
+        ok, latency = await clients[entry.client].execute(entry.name, request, files)
+        latencies[entry.task].append(latency)
+        errors[entry.task] += not ok
+
+    memory_before = memory_mb(pid)
+    started = time.perf_counter()
+    running = []
+    for entry in trace:
+        due = started + (entry.offset / speed if speed > 0 else 0)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        running.append(asyncio.create_task(send(entry, due)))
+    await asyncio.gather(*running)
+    elapsed = time.perf_counter() - started
+    memory_after = memory_mb(pid)
+    await asyncio.gather(*(client.close() for client in clients.values()))
+
+    recorded: Dict[str, List[float]] = defaultdict(list)
+    for entry in trace:
+        if entry.seconds is not None:
+            recorded[entry.task].append(float(entry.seconds))
+    span = trace[-1].offset if trace else 0.0
+    return {
+        "requests": len(trace),
+        "clients": len(clients),
+        "recorded_seconds": round(span, 3),
+        "seconds": round(elapsed, 3),
+        "send_lag_p95_ms": round(percentile(lags, 0.95) * 1000, 2),
+        "rss_before_mb": memory_before["rss_mb"],
+        "rss_after_mb": memory_after["rss_mb"],
+        "peak_rss_mb": memory_after["peak_rss_mb"],
+        "scenarios": {
+            task: {
+                "requests": len(values),
+                "errors": errors[task],
+                "throughput": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "recorded_p50_ms": round(percentile(recorded[task], 0.50) * 1000, 2),
+                "recorded_p95_ms": round(percentile(recorded[task], 0.95) * 1000, 2),
+            }
+            for task, values in sorted(latencies.items())
+        },
+    }
+
+def print_report(results: Dict):
+    print(f"{results['requests']} requests from {results['clients']} clients, recorded over {results['recorded_seconds']}s, "
+          f"replayed in {results['seconds']}s (p95 send lag {results['send_lag_p95_ms']}ms, peak RSS {results['peak_rss_mb']} MB)")
+    columns = ["requests", "errors", "p50_ms", "p95_ms", "p99_ms", "recorded_p50_ms", "recorded_p95_ms"]
+    print(f"{'task':<18}" + "".join(f"{column:>16}" for column in columns))
+    for name, result in results["scenarios"].items():
+        print(f"{name:<18}" + "".join(f"{result[column]:>16}" for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded requests against the worker")
+    parser.add_argument("traces", nargs="*", help="Journal (.jsonl) or old dump (.json) files, default: dumps/requests*.jsonl")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing relative to the recording, 0 sends everything at once (default: 1)")
+    parser.add_argument("--max-gap", type=float, default=60.0, help="Shorten idle periods in the trace to this many seconds, 0 keeps them (default: 60)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--real", default=",".join(REAL_TASKS), help=f"Tasks that run for real, the others are stubbed (default: {','.join(REAL_TASKS)})")
+    parser.add_argument("--concurrency", action="append", default=[], metavar="TASK=N", help="Concurrency of a task on the replay server, passed to server.py")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the server's result cache")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier replay to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative p95/throughput regression against the baseline (default: 0.25)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--stubs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    real = [name.strip() for name in args.real.split(",") if name.strip()]
+    if args.serve:
+        import server
+        for override in args.concurrency:
+            task_name, _, limit = override.partition("=")
+            server.concurrency_overrides[task_name] = int(limit)
+        serve(args.port, args.stubs, real, not args.no_cache)
+        return
+
+    dumps_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dumps")
+    paths = args.traces or sorted(glob.glob(os.path.join(dumps_dir, "requests*.jsonl")))
+    if not paths:
+        parser.error("No trace files given and none found in dumps/")
+    trace, skipped = load_trace(paths, args.max_gap)
+    if args.limit:
+        trace = trace[:args.limit]
+    if not trace:
+        parser.error(f"No replayable requests in {', '.join(paths)} ({skipped} skipped)")
+    if skipped:
+        print(f"Skipped {skipped} entries that cannot be replayed")
+
+    with tempfile.TemporaryDirectory(prefix="trask-replay-") as files_dir:
+        stubs_path = os.path.join(files_dir, "stubs.json")
+        with open(stubs_path, "w") as f:
+            json.dump(stub_durations(trace, real), f)
+        serve_args = ["--stubs", stubs_path, "--real", ",".join(real)]
+        serve_args += [f"--concurrency={override}" for override in args.concurrency]
+        if args.no_cache:
+            serve_args.append("--no-cache")
+        port = free_port()
+        process = start_server(port, files_dir, serve_args, script=__file__)
+        try:
+            results = asyncio.run(replay(f"ws://127.0.0.1:{port}", process.pid, trace, args.speed))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    results["config"] = {"traces": paths, "speed": args.speed, "real": real, "cache": not args.no_cache}
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
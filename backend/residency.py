@@ -0,0 +1,252 @@
+import asyncio
+import gc
+import sys
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Type
+
+from tasks.task import Task, get_executor
+from log import logger
+from metrics import TASK_STAGE_SECONDS
+
+RESOURCES = ("vram", "ram")
+
+def footprint(task_class: Type[Task]) -> Dict[str, float]:
+    return {"vram": task_class.vram_mb, "ram": task_class.ram_mb}
+
+def is_out_of_memory(error: Exception) -> bool:
+    if isinstance(error, MemoryError):
+        return True
+    return isinstance(error, RuntimeError) and ("CUDA" in str(error) or "out of memory" in str(error).lower())
+
+def unload_and_free(task_class: Type[Task]):
+    task_class.unload()
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+class ResidencyManager:
+    """
+    Keeps task models loaded within a RAM/VRAM budget (in MB, None = unlimited).
+    Resident tasks are kept in least-recently-used order; when a load does not
+    fit, idle tasks are unloaded oldest first until it does. Tasks that are
+    currently executing are never evicted.
+
+    Loads run in the background: each task is "unloaded", "loading" or "ready",
+    and callers can start a load without waiting for it. With `warmup` set, a
+    task's warmup() runs right after load() so lazy kernel/compile work does
+    not land on the first real job.
+    """
+    def __init__(self, budgets: Optional[Dict[str, Optional[float]]] = None, warmup: bool = False):
+        self.budgets: Dict[str, Optional[float]] = {resource: None for resource in RESOURCES}
+        self.budgets.update(budgets or {})
+        self.warmup = warmup
+        self.resident: "OrderedDict[str, Type[Task]]" = OrderedDict()
+        self.loading: Dict[str, asyncio.Task] = {}
+        self.load_started: Dict[str, float] = {}
+        self.in_use: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._executed_since_load: Set[str] = set()
+        self._load_lock: Optional[asyncio.Lock] = None
+        # state of tasks whose models live in worker processes, as last reported by them
+        self.external: Dict[str, str] = {}
+
+    def _stats(self, name: str) -> Dict[str, float]:
+        if name not in self.stats:
+            self.stats[name] = {
+                "hits": 0, "misses": 0, "loads": 0, "evictions": 0,
+                "load_time_total": 0.0, "last_load_time": 0.0, "last_warmup_time": 0.0,
+                "cold_runs": 0, "cold_time_total": 0.0, "warm_runs": 0, "warm_time_total": 0.0,
+            }
+        return self.stats[name]
+
+    @property
+    def load_lock(self) -> asyncio.Lock:
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        return self._load_lock
+
+    def state(self, name: str) -> str:
+        if name in self.external:
+            return self.external[name]
+        if name in self.resident:
+            return "ready"
+        if name in self.loading:
+            return "loading"
+        return "unloaded"
+
+    def is_resident(self, name: str) -> bool:
+        return name in self.resident or self.external.get(name) == "ready"
+
+    def usage(self) -> Dict[str, float]:
+        totals = {resource: 0.0 for resource in RESOURCES}
+        for task_class in self.resident.values():
+            for resource, amount in footprint(task_class).items():
+                totals[resource] += amount
+        return totals
+
+    def fits(self, task_class: Type[Task]) -> bool:
+        usage = self.usage()
+        for resource, amount in footprint(task_class).items():
+            budget = self.budgets.get(resource)
+            if budget is not None and usage[resource] + amount > budget:
+                return False
+        return True
+
+    def eviction_candidate(self, exclude: str = "") -> Optional[str]:
+        for name in self.resident:
+            if name != exclude and not self.in_use.get(name):
+                return name
+        return None
+
+    async def evict(self, name: str):
+        task_class = self.resident.pop(name)
+        self._executed_since_load.discard(name)
+        self._stats(name)["evictions"] += 1
+        logger.info("Evicting %s (resident: %s)", name, list(self.resident))
+        await asyncio.get_running_loop().run_in_executor(get_executor("thread"), unload_and_free, task_class)
+
+    async def _load(self, name: str, task_class: Type[Task]):
+        loop = asyncio.get_running_loop()
+        stats = self._stats(name)
+        async with self.load_lock:
+            while not self.fits(task_class):
+                candidate = self.eviction_candidate(exclude=name)
+                if candidate is None:
+                    logger.warning("Loading %s exceeds the memory budget, but every resident task is in use", name)
+                    break
+                await self.evict(candidate)
+
+            started = time.perf_counter()
+            self.load_started[name] = started
+            while True:
+                try:
+                    await loop.run_in_executor(get_executor("thread"), task_class.load)
+                    break
+                except Exception as e:
+                    # the footprint estimate was off: free the oldest idle model and try again
+                    candidate = self.eviction_candidate(exclude=name)
+                    if not is_out_of_memory(e) or candidate is None:
+                        raise
+                    logger.warning("Out of memory loading %s, evicting %s and retrying", name, candidate)
+                    await self.evict(candidate)
+            elapsed = time.perf_counter() - started
+
+            stats["loads"] += 1
+            stats["load_time_total"] += elapsed
+            stats["last_load_time"] = elapsed
+            TASK_STAGE_SECONDS.observe(elapsed, task=name, stage="model_load")
+            logger.info("Loaded %s in %.2fs", name, elapsed)
+
+        if self.warmup:
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(get_executor("thread"), task_class.warmup)
+                stats["last_warmup_time"] = time.perf_counter() - started
+                logger.info("Warmed up %s in %.2fs", name, stats['last_warmup_time'])
+            except Exception as e:
+                logger.warning("Warmup of %s failed, continuing without it: %s", name, e)
+
+        self.resident[name] = task_class
+        self._executed_since_load.discard(name)
+
+    def start_loading(self, name: str, task_class: Type[Task]) -> Optional[asyncio.Task]:
+        """Load `name` in the background (no-op if it is already ready) and return the load task."""
+        if name in self.resident:
+            return None
+        if name not in self.loading:
+            load = asyncio.create_task(self._load(name, task_class), name=f"load:{name}")
+
+            def done(task: asyncio.Task):
+                if self.loading.get(name) is task:
+                    del self.loading[name]
+                    self.load_started.pop(name, None)
+                if not task.cancelled() and task.exception() is not None:
+                    logger.warning("Background load of %s failed: %s", name, task.exception())
+
+            load.add_done_callback(done)
+            self.loading[name] = load
+        return self.loading[name]
+
+    def prefetch(self, name: str, task_class: Type[Task]) -> bool:
+        """Start loading `name` only if that needs no eviction. Returns True if a load is running."""
+        if self.state(name) == "unloaded" and self.fits(task_class):
+            self.start_loading(name, task_class)
+        return self.state(name) == "loading"
+
+    async def acquire(self, name: str, task_class: Type[Task]) -> bool:
+        """
+        Make sure `name` is loaded and pin it until release() is called.
+        Returns True for a cold start: the first execution since the task was loaded.
+        """
+        self.in_use[name] = self.in_use.get(name, 0) + 1
+        try:
+            if name in self.resident:
+                self._stats(name)["hits"] += 1
+            else:
+                self._stats(name)["misses"] += 1
+                while name not in self.resident:
+                    # shielded: a cancelled job must not abort a load other jobs may be waiting for
+                    await asyncio.shield(self.start_loading(name, task_class))
+            self.resident.move_to_end(name)
+        except BaseException:
+            self.release(name)
+            raise
+        cold = name not in self._executed_since_load
+        self._executed_since_load.add(name)
+        return cold
+
+    def release(self, name: str):
+        self.in_use[name] -= 1
+        if not self.in_use[name]:
+            del self.in_use[name]
+
+    @asynccontextmanager
+    async def use(self, name: str, task_class: Type[Task]):
+        started = time.perf_counter()
+        cold = await self.acquire(name, task_class)
+        try:
+            yield task_class
+        finally:
+            self.release(name)
+        self.record_latency(name, time.perf_counter() - started, cold)
+
+    def record_latency(self, name: str, elapsed: float, cold: bool):
+        stats = self._stats(name)
+        kind = "cold" if cold else "warm"
+        stats[f"{kind}_runs"] += 1
+        stats[f"{kind}_time_total"] += elapsed
+        if cold:
+            logger.info("%s cold start took %.2fs", name, elapsed)
+
+    def preload(self, tasks: Dict[str, Type[Task]]):
+        """Start background loads for `tasks` in order, skipping the ones that would exceed the budget."""
+        reserved = {resource: 0.0 for resource in RESOURCES}
+        for name, task_class in tasks.items():
+            needed = footprint(task_class)
+            if any(budget is not None and reserved[resource] + needed[resource] > budget
+                   for resource, budget in self.budgets.items()):
+                logger.info("Not preloading %s: it does not fit in the memory budget", name)
+                continue
+            for resource in RESOURCES:
+                reserved[resource] += needed[resource]
+            self.start_loading(name, task_class)
+
+    def report(self) -> Dict:
+        tasks = {}
+        for name, stats in self.stats.items():
+            tasks[name] = dict(stats, state=self.state(name))
+            for kind in ("cold", "warm"):
+                runs = stats[f"{kind}_runs"]
+                tasks[name][f"{kind}_latency_avg"] = stats[f"{kind}_time_total"] / runs if runs else None
+        return {
+            "budgets": self.budgets,
+            "usage": self.usage(),
+            "resident": list(self.resident),
+            "loading": list(self.loading),
+            "in_use": dict(self.in_use),
+            "workers": dict(self.external),
+            "tasks": tasks,
+        }
@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from scheduler import task_files
+
+class ResultCache:
+    """
+    On-disk cache of task responses for deterministic requests. Entries are
+    keyed on the task name, the canonical request and the content hashes of
+    its input files, and stored one JSON file per entry. The cache is kept
+    under `max_bytes` by evicting least recently used entries, and entries
+    older than `ttl` seconds are dropped.
+
+    Responses refer to output files by id; an entry whose files are gone
+    (e.g. cleaned up) counts as a miss.
+    """
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = 512 * 1024 * 1024,
+                 ttl: Optional[float] = 7 * 24 * 3600,
+                 file_exists: Callable[[str], bool] = lambda file_id: True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.file_exists = file_exists
+        # key -> entry size in bytes, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _scan(self):
+        """Rebuild the index from disk, oldest access first, so the cache survives restarts."""
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                found.append((stat.st_mtime, filename[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+
+    @staticmethod
+    def key(task_name: str, request: Dict[str, Any], file_hashes: Dict[str, str]) -> str:
+        """Cache key for a request whose file references map to `file_hashes` (file id -> content hash)."""
+        def canonical(value: Any) -> Any:
+            if isinstance(value, dict):
+                if value.get('type') == 'file_reference':
+                    # ids and names differ between uploads of the same content
+                    return {"sha256": file_hashes[value['id']]}
+                return {k: canonical(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [canonical(v) for v in value]
+            return value
+
+        payload = json.dumps({"task": task_name, "request": canonical(request)}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The cached serialized TaskResponse for `key`, or None."""
+        entry = self._load(key) if key in self.entries else None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.entries.move_to_end(key)
+        # the file's mtime doubles as its last access time across restarts
+        os.utime(self._path(key))
+        return base64.b64decode(entry["response"])
+
+    def _load(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            self.stats["expired"] += 1
+            self._remove(key)
+            return None
+        if not all(self.file_exists(file_id) for file_id in entry.get("files", [])):
+            self._remove(key)
+            return None
+        return entry
+
+    def put(self, key: str, task_name: str, response: bytes, response_dict: Dict):
+        entry = {
+            "task": task_name,
+            "created": time.time(),
+            "files": list(task_files(response_dict)),
+            "response": base64.b64encode(response).decode(),
+        }
+        data = json.dumps(entry)
+        with open(self._path(key), "w") as f:
+            f.write(data)
+        self.entries[key] = len(data)
+        self.entries.move_to_end(key)
+        self.stats["stores"] += 1
+        self._evict()
+
+    def _remove(self, key: str):
+        self.entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def size(self) -> int:
+        return sum(self.entries.values())
+
+    def _evict(self):
+        total = self.size()
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, size = next(iter(self.entries.items()))
+            self._remove(key)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def report(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            hit_rate=self.stats["hits"] / lookups if lookups else None,
+            entries=len(self.entries),
+            bytes=self.size(),
+            max_bytes=self.max_bytes,
+            ttl=self.ttl,
+        )
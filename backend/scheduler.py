@@ -0,0 +1,326 @@
+import argparse
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from residency import ResidencyManager
+from engine import ExecutionEngine
+from protobuf_generator import adapt_name
+
+# Fallbacks used until a task type has been observed on this worker
+DEFAULT_EXEC_SECONDS = 2.0
+DEFAULT_UPLOAD_BYTES_PER_SECOND = 10 * 1024 * 1024
+
+def task_files(value: Any) -> Dict[str, int]:
+    """Find every file reference in a task request dict, mapped to its size in bytes."""
+    files: Dict[str, int] = {}
+    if isinstance(value, dict):
+        if value.get('type') == 'file_reference':
+            # int64 fields come out of betterproto's to_dict as strings
+            files[value['id']] = int(value.get('size') or 0)
+        else:
+            for item in value.values():
+                files.update(task_files(item))
+    elif isinstance(value, list):
+        for item in value:
+            files.update(task_files(item))
+    return files
+
+class ExecutionHistory:
+    """Exponentially weighted moving averages of observed execute times and upload bandwidth."""
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.exec_seconds: Dict[str, float] = {}
+        self.upload_bytes_per_second = float(DEFAULT_UPLOAD_BYTES_PER_SECOND)
+
+    def _update(self, previous: Optional[float], observed: float) -> float:
+        if previous is None:
+            return observed
+        return self.alpha * observed + (1 - self.alpha) * previous
+
+    def record_execution(self, name: str, seconds: float):
+        self.exec_seconds[name] = self._update(self.exec_seconds.get(name), seconds)
+
+    def record_upload(self, size: int, seconds: float):
+        if size > 0 and seconds > 0:
+            self.upload_bytes_per_second = self._update(self.upload_bytes_per_second, size / seconds)
+
+    def estimate(self, name: str, default: float = DEFAULT_EXEC_SECONDS) -> float:
+        return self.exec_seconds.get(name, default)
+
+class Decision:
+    """The tasks the scheduler picked, and the cost breakdown of every candidate it compared."""
+    def __init__(self, tasks: List[Dict], candidates: List[Dict]):
+        self.tasks = tasks
+        self.candidates = candidates
+
+    @property
+    def task(self) -> Optional[Dict]:
+        return self.tasks[0] if self.tasks else None
+
+    def explain(self) -> str:
+        if not self.tasks:
+            return "no runnable task offered"
+        lines = ["picked " + ", ".join(f"{task['name']} ({task['id']})" for task in self.tasks)]
+        for candidate in self.candidates:
+            costs = ", ".join(f"{k}={v:.2f}s" for k, v in candidate['costs'].items())
+            lines.append(f"  {candidate['total']:8.2f}s {candidate['name']} ({candidate['id']}): {costs}")
+        return "\n".join(lines)
+
+class TaskScheduler:
+    """
+    Picks the offered task with the lowest expected time to completion, which
+    maximizes completed jobs per unit of time (shortest job first). The
+    estimate for each candidate is the sum of:
+      queue:  work already queued or running for that task type
+      load:   model load time if not resident (remaining time if loading)
+      upload: input bytes we still need from the client / observed bandwidth
+      exec:   moving average of observed execute times
+
+    Several tasks can be accepted per round: each task type takes up to its
+    concurrency limit plus `prefetch` extra jobs, so the next job is already
+    queued on the worker (inputs uploading) when a slot frees up, instead of
+    waiting for another available_tasks round-trip. Accepted tasks count as
+    queued work until the client sends `execute` for them.
+    """
+    def __init__(self,
+                 tasks: Dict[str, Type],
+                 residency: ResidencyManager,
+                 engine: ExecutionEngine,
+                 available_files: Callable[[], Any],
+                 name_of: Callable[[str], str],
+                 history: Optional[ExecutionHistory] = None,
+                 prefetch: int = 1):
+        self.tasks = tasks
+        self.residency = residency
+        self.engine = engine
+        self.available_files = available_files
+        self.name_of = name_of
+        self.history = history or ExecutionHistory()
+        self.prefetch = prefetch
+        # task id -> (task name, owner) for tasks accepted but not executed yet
+        self.accepted: Dict[str, Tuple[str, str]] = {}
+
+    def accept(self, task_id: str, name: str, owner: str = ""):
+        self.accepted[task_id] = (name, owner)
+
+    def started(self, task_id: str):
+        self.accepted.pop(task_id, None)
+
+    def forget_owner(self, owner: str):
+        for task_id, (_, task_owner) in list(self.accepted.items()):
+            if task_owner == owner:
+                del self.accepted[task_id]
+
+    def pending(self, name: str) -> int:
+        """Jobs of type `name` accepted, queued or running on this worker."""
+        accepted = sum(1 for task_name, _ in self.accepted.values() if task_name == name)
+        return accepted + self.engine.queue_depth(name) + self.engine.running_count(name)
+
+    def slots(self, name: str) -> int:
+        return max(0, self.engine.get_limit(name) + self.prefetch - self.pending(name))
+
+    def capacity(self, max_tasks: int) -> int:
+        """How many more tasks this worker would accept right now, at most `max_tasks`."""
+        return min(max_tasks, sum(self.slots(name) for name in self.tasks))
+
+    def load_cost(self, name: str) -> float:
+        state = self.residency.state(name)
+        if state == "ready":
+            return 0.0
+        stats = self.residency.stats.get(name, {})
+        expected = stats.get("last_load_time") or self.tasks[name].load_seconds
+        if state == "loading":
+            started = self.residency.load_started.get(name, time.perf_counter())
+            return max(0.0, expected - (time.perf_counter() - started))
+        return expected
+
+    def estimate(self, task: Dict, picked: int = 0) -> Dict[str, float]:
+        """Expected costs of running `task` after `picked` other tasks of its type picked this round."""
+        name = self.name_of(task['name'])
+        exec_seconds = self.history.estimate(name)
+        present = self.available_files()
+        missing_bytes = sum(size for file_id, size in task_files(task.get('request', {})).items() if file_id not in present)
+        waiting = self.pending(name) + picked
+        return {
+            "queue": waiting * exec_seconds / self.engine.get_limit(name),
+            "load": self.load_cost(name),
+            "upload": missing_bytes / self.history.upload_bytes_per_second,
+            "exec": exec_seconds,
+        }
+
+    def candidates(self, available_tasks: List[Dict], picked: Dict[str, int]) -> List[Dict]:
+        candidates = []
+        for task in available_tasks:
+            name = self.name_of(task['name'])
+            if name not in self.tasks or task['id'] in self.accepted or task['id'] in self.engine.jobs:
+                continue
+            if self.slots(name) <= picked.get(name, 0):
+                continue
+            costs = self.estimate(task, picked.get(name, 0))
+            candidates.append({"id": task['id'], "name": name, "task": task, "costs": costs, "total": sum(costs.values())})
+        # stable sort: on equal cost keep the client's (oldest first) order
+        candidates.sort(key=lambda candidate: candidate['total'])
+        return candidates
+
+    def select_batch(self, available_tasks: List[Dict], max_tasks: int) -> Decision:
+        """Greedily pick up to `max_tasks` tasks, re-costing the rest after each pick."""
+        chosen: List[Dict] = []
+        picked: Dict[str, int] = {}
+        remaining = list(available_tasks)
+        first_candidates = None
+        while len(chosen) < max_tasks:
+            candidates = self.candidates(remaining, picked)
+            if first_candidates is None:
+                first_candidates = candidates
+            if not candidates:
+                break
+            best = candidates[0]
+            chosen.append(best['task'])
+            picked[best['name']] = picked.get(best['name'], 0) + 1
+            remaining = [task for task in remaining if task['id'] != best['id']]
+        return Decision(chosen, [{k: v for k, v in c.items() if k != 'task'} for c in first_candidates or []])
+
+    def select(self, available_tasks: List[Dict]) -> Decision:
+        return self.select_batch(available_tasks, 1)
+
+# Offline benchmark: replay recorded available_tasks streams against a simulated worker
+
+SIMULATED_TASKS = {
+    # task: (execute seconds, load seconds, VRAM MB)
+    "Text2Image": (6.0, 60.0, 4000),
+    "Text2Imagedraft": (1.5, 25.0, 8000),
+    "TurboEdit": (2.0, 20.0, 7000),
+    "Text2Audio": (20.0, 30.0, 4500),
+    "Text2Prompt": (0.5, 5.0, 500),
+    "Text2Text": (2.0, 0.0, 0),
+    "Image2Caption": (3.0, 0.0, 0),
+    "Capitalize": (0.01, 0.0, 0),
+    "File2Text": (0.01, 0.0, 0),
+    "Text2Imagefile": (0.05, 0.0, 0),
+}
+
+def trace_time(value: Any, default: float) -> float:
+    """A trace line's "time": seconds, or an ISO timestamp as the server records it."""
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+def read_trace(path: str) -> List[Dict]:
+    """
+    Read a JSONL trace. Each line with a "tasks" list is one available_tasks
+    round ({"id", "name", "request"} per task, "request" being the task's
+    TaskRequest.to_dict()); an optional "time" (seconds, or an ISO timestamp)
+    gives its arrival time, by default the line number. Other lines are
+    skipped. `python server.py --record-rounds` writes this format to
+    dumps/rounds.jsonl.
+    """
+    rounds = []
+    with open(path) as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            tasks = entry.get('tasks') if isinstance(entry, dict) else None
+            if tasks:
+                rounds.append({"time": trace_time(entry.get('time'), index), "tasks": tasks})
+    return rounds
+
+class SimulatedTask:
+    """Stand-in task class carrying only what the scheduler and residency manager look at."""
+    def __init__(self, name: str, exec_seconds: float, load_seconds: float, vram_mb: float):
+        self.__name__ = name
+        self.exec_seconds = exec_seconds
+        self.load_seconds = load_seconds
+        self.vram_mb = vram_mb
+        self.ram_mb = 0
+
+def simulate(rounds: List[Dict], policy: str, vram_budget: Optional[float], profiles: Dict[str, tuple] = SIMULATED_TASKS) -> Dict:
+    """Run every task in `rounds` on one simulated worker, choosing with `policy` ("fifo" or "scored")."""
+    tasks = {name: SimulatedTask(name, *profile) for name, profile in profiles.items()}
+    residency = ResidencyManager({"vram": vram_budget})
+    files_present: set = set()
+    scheduler = TaskScheduler(tasks, residency, ExecutionEngine(), lambda: files_present, adapt_name)
+
+    arrivals = []
+    seen = set()
+    start = rounds[0]['time'] if rounds else 0.0
+    for round_ in rounds:
+        for task in round_['tasks']:
+            if task['id'] not in seen and adapt_name(task['name']) in tasks:
+                seen.add(task['id'])
+                arrivals.append((round_['time'] - start, task))
+
+    clock, loads, decision_time, latencies = 0.0, 0, 0.0, []
+    pending: "OrderedDict[str, tuple]" = OrderedDict()
+    next_arrival = 0
+    while next_arrival < len(arrivals) or pending:
+        while next_arrival < len(arrivals) and arrivals[next_arrival][0] <= clock:
+            arrived, task = arrivals[next_arrival]
+            pending[task['id']] = (arrived, task)
+            next_arrival += 1
+        if not pending:
+            clock = arrivals[next_arrival][0]
+            continue
+
+        offered = [task for _, task in pending.values()]
+        started = time.perf_counter()
+        if policy == "fifo":
+            chosen = offered[0]
+        else:
+            chosen = scheduler.select(offered).task
+        decision_time += time.perf_counter() - started
+
+        arrived, _ = pending.pop(chosen['id'])
+        name = adapt_name(chosen['name'])
+        task_class = tasks[name]
+        elapsed = task_class.exec_seconds
+        if not residency.is_resident(name):
+            while not residency.fits(task_class) and residency.eviction_candidate(exclude=name):
+                residency.resident.pop(residency.eviction_candidate(exclude=name))
+            residency.resident[name] = task_class
+            elapsed += task_class.load_seconds
+            loads += 1
+        residency.resident.move_to_end(name)
+        for file_id, size in task_files(chosen.get('request', {})).items():
+            if file_id not in files_present:
+                elapsed += size / DEFAULT_UPLOAD_BYTES_PER_SECOND
+                files_present.add(file_id)
+        scheduler.history.record_execution(name, task_class.exec_seconds)
+        clock += elapsed
+        latencies.append(clock - arrived)
+
+    latencies.sort()
+    return {
+        "policy": policy,
+        "tasks": len(latencies),
+        "makespan_s": round(clock, 2),
+        "throughput_per_min": round(60 * len(latencies) / clock, 2) if clock else 0.0,
+        "mean_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        "p95_latency_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else 0.0,
+        "model_loads": loads,
+        "decision_us": round(1e6 * decision_time / max(1, len(latencies)), 1),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark task selection offline against a recorded available_tasks stream.")
+    parser.add_argument('trace', help='JSONL file with one available_tasks round per line, e.g. dumps/rounds.jsonl from server.py --record-rounds (format: see read_trace)')
+    parser.add_argument('--vram-budget', type=float, help='Simulated VRAM budget in MB (default: unlimited)')
+    parser.add_argument('--profiles', help='JSON file mapping task name to [execute seconds, load seconds, VRAM MB]')
+    args = parser.parse_args()
+
+    profiles = dict(SIMULATED_TASKS)
+    if args.profiles:
+        with open(args.profiles) as f:
+            profiles.update({name: tuple(value) for name, value in json.load(f).items()})
+
+    rounds = read_trace(args.trace)
+    print(f"Loaded {len(rounds)} available_tasks rounds from {args.trace}")
+    for policy in ("fifo", "scored"):
+        print(json.dumps(simulate(rounds, policy, args.vram_budget, profiles)))
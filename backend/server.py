@@ -1,29 +1,45 @@
 import mimetypes
 import traceback
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, File, UploadFile, HTTPException, Header
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
 import json
+import logging
 import argparse
-from typing import Dict, List, Type, Set, Any
+from typing import Dict, List, Type, Set, Any, Optional, Tuple
 from datetime import datetime
 import atexit
-import importlib
 import betterproto
 import asyncio
+import hashlib
 import sqlite3
+from functools import partial
+import inspect
+from contextlib import nullcontext
 
-from time import sleep
-from random import randint
+import time
+from random import uniform
 
-from protobuf_generator import ProtoGenerator
+from protobuf_generator import ProtoGenerator, adapt_name
+from engine import ExecutionEngine
+from residency import ResidencyManager
+from scheduler import TaskScheduler, task_files
+from result_cache import ResultCache
+from storage import StorageManager
+from log import logger, Payload, setup_logging
+from journal import RequestJournal
+from profiling import Profiler
+from supervisor import Supervisor, gpu_processes, split_tasks
+from metrics import registry, TASK_STAGE_SECONDS, TASK_BYTES, TASKS_TOTAL, TASK_ERRORS
 
-from tasks.task import Task
-from tasks.file import FileReference
+from tasks.task import Task, find_tasks, get_executor, shutdown_executors
+from tasks.cancellation import CancellationToken, TaskCancelled
+from tasks import previews
+from tasks.file import FileReference, FILES_DIR, CHUNK_SIZE, iter_file, hash_file, is_content_hash, store_content, temp_file, temp_path
 
-from db import close_db_connection, get_file_path, add_file_mapping
+from db import close_db_connection, get_file_path, add_file_mapping, get_file_hash, set_file_hash, find_file_by_hash
 
 import base64
 
@@ -31,13 +47,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from proto.py import tasks as proto_tasks  # type: ignore
 from proto.py import websocket as wsmsg
 
-file_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')
+file_dir = FILES_DIR
+
+setup_logging()
 
 async def lifespan(app: FastAPI):
-    print("Starting server lifespan")
+    logger.info("Starting server lifespan")
+    await supervisor.start()
+    if preload_on_startup:
+        residency.preload({name: task_class for name, task_class in TASKS.items() if supervisor.worker_for(name) is None})
+    collector = asyncio.create_task(storage.run())
     yield
+    collector.cancel()
+    await engine.shutdown()
+    await supervisor.stop()
+    shutdown_executors(wait=False)
     close_db_connection()
-    print("Closed database connection")
+    logger.info("Closed database connection")
+    journal.flush()
+    task_rounds.flush()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -46,38 +74,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Range", "X-Content-SHA256"],
 )
 
 active_connections: Dict[str, WebSocket] = {}
-request_logs: List[Dict] = []
 TASKS: Dict[str, Type[Task]] = {}
-loaded_tasks: Set[str] = set()
 available_files: Dict[str, FileReference] = {}
 file_upload_events: Dict[str, asyncio.Event] = {}
+resync_requested: Set[str] = set()
+requested_files: Dict[str, Set[str]] = {}  # client id -> file ids we asked that client to send
+upload_activity: Dict[str, float] = {}  # file id -> when its last chunk arrived
+engine = ExecutionEngine()
+residency = ResidencyManager()
+preload_on_startup = False
+scheduler = TaskScheduler(TASKS, residency, engine, lambda: available_files, adapt_name)
+concurrency_overrides: Dict[str, int] = {}
+max_accept = 8  # most tasks accepted in one available_tasks round
+cancel_tokens: Dict[str, CancellationToken] = {}
 
-def adapt_name(task_name):
-    pascal = ProtoGenerator.to_pascal_case(task_name)
-    # also cap after numbers
-    final = ""
-    for i, c in enumerate(pascal):
-        if i > 0 and pascal[i-1].isdigit() and c.isalpha() and c.islower():
-            final += c.upper()
-        else:
-            final += c
-    
-    return final
+registry.gauge("trask_queued_jobs", "Jobs ready to run and waiting for an execution slot", ("task",),
+               lambda: {(name,): engine.queue_depth(name) for name in TASKS})
+registry.gauge("trask_running_jobs", "Jobs executing right now", ("task",),
+               lambda: {(name,): engine.running_count(name) for name in TASKS})
+registry.gauge("trask_model_loaded", "Whether the task's model is resident", ("task",),
+               lambda: {(name,): int(residency.is_resident(name)) for name in TASKS})
+PROTOCOL_VERSION = "1.0.0"  # clients from 1.0.0 on take their first capacity from the handshake
+handshake_timeout = 10.0  # seconds a new connection has to send its handshake
+connect_jitter = 0.0  # most seconds to hold a handshake reply, to spread out reconnect storms
+paused_clients: Set[str] = set()
+
+def stored_file_exists(file_id: str) -> bool:
+    try:
+        return os.path.exists(get_file_path(file_id))
+    except HTTPException:
+        return False
+
+result_cache: Optional[ResultCache] = ResultCache(os.path.join(file_dir, 'results'), file_exists=stored_file_exists)
+
+def forget_files(paths: List[str]):
+    """Collected files have to be uploaded again."""
+    removed = set(paths)
+    for file_id, file in list(available_files.items()):
+        if file.path in removed:
+            available_files.pop(file_id, None)
 
-def dump_logs():
-    dumps_dir = os.path.join(os.path.dirname('.'), 'dumps')
-    os.makedirs(dumps_dir, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_logs.json"
-    filepath = os.path.join(dumps_dir, filename)
-    with open(filepath, 'w') as f:
-        json.dump(request_logs, f, indent=2, default=str)
-    print(f"Logs dumped to {filepath}")
+storage = StorageManager(on_remove=forget_files)
+profiler = Profiler()
+# task types that run in worker processes (--workers / --worker), the others run here
+supervisor = Supervisor(on_state=residency.external.update)
 
-atexit.register(dump_logs)
+# every handled request, streamed to dumps/requests.jsonl
+journal = RequestJournal(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dumps'))
+atexit.register(journal.close)
+# offered available_tasks rounds, streamed to dumps/rounds.jsonl with --record-rounds: a trace for `python scheduler.py`
+task_rounds = RequestJournal(os.path.dirname(journal.path), filename="rounds.jsonl", recent=0)
+task_rounds.enabled = False
+atexit.register(task_rounds.close)
 
 def base64_to_file(base64_str: str, file_path: str):
     try:
@@ -87,27 +139,89 @@ def base64_to_file(base64_str: str, file_path: str):
     with open(file_path, 'wb') as f:
         f.write(base64.b64decode(encoded))
 
+def partial_upload_path(file_id: str) -> str:
+    # kept in the temp area, which the storage manager clears of abandoned uploads
+    try:
+        return temp_path(f"{file_id}.part")
+    except ValueError:
+        # the id comes from the client
+        raise HTTPException(status_code=400, detail=f"Invalid file id: {file_id}")
+
+def uploaded_bytes(file_id: str) -> int:
+    """How much of a file streamed over the websocket has arrived, kept on disk so uploads can resume."""
+    path = partial_upload_path(file_id)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def file_uploaded(file_id: str, file_path: str, file_hash: str):
+    # the content may have been stored long ago, it counts as used now
+    storage.touch(file_path)
+    add_file_mapping(file_id, file_path, file_hash)
+    available_files[file_id] = FileReference.existing(file_id, file_path, file_hash)
+    upload_activity.pop(file_id, None)
+    
+    # Set the event to indicate the file has been uploaded
+    if file_id in file_upload_events:
+        file_upload_events[file_id].set()
+
+async def receive_file_chunk(websocket: WebSocket, client_id: str, chunk: wsmsg.FileChunk):
+    if chunk.file_id not in requested_files.get(client_id, ()):
+        logger.warning("Client %s: dropping chunk of %s, a file we did not request", client_id, chunk.file_id)
+        return
+    received = uploaded_bytes(chunk.file_id)
+    if chunk.offset > received:
+        # we are missing the data before this chunk, ask for the file again from what we have
+        if chunk.file_id not in resync_requested:
+            resync_requested.add(chunk.file_id)
+            logger.debug("Client %s: upload of %s has a gap at %d (chunk at %d), requesting resend", client_id, chunk.file_id, received, chunk.offset)
+            await websocket.send_bytes(bytes(wsmsg.ServerMessage(file_request=wsmsg.FileRequest(file_id=chunk.file_id, offset=received))))
+        return
+    resync_requested.discard(chunk.file_id)
+
+    partial_path = partial_upload_path(chunk.file_id)
+    with open(partial_path, "r+b" if os.path.exists(partial_path) else "wb") as f:
+        f.seek(chunk.offset)
+        f.write(chunk.data)
+    received = max(received, chunk.offset + len(chunk.data))
+    upload_activity[chunk.file_id] = time.monotonic()
+
+    if received >= chunk.size:
+        file_hash = await asyncio.get_running_loop().run_in_executor(get_executor(), hash_file, partial_path)
+        file_path = store_content(partial_path, chunk.name, file_hash)
+        logger.info("Client %s: received file %s over websocket, %d bytes, sha256 %s", client_id, chunk.file_id, received, file_hash)
+        requested_files[client_id].discard(chunk.file_id)
+        file_uploaded(chunk.file_id, file_path, file_hash)
+
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    """Parse a single `bytes=start-end` Range header into inclusive offsets."""
+    unit, _, spec = header.partition("=")
+    start_text, _, end_text = spec.strip().partition("-")
+    if unit.strip() != "bytes" or "," in spec or not (start_text or end_text):
+        raise HTTPException(status_code=416, detail=f"Unsupported range: {header}")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # suffix range: the last N bytes
+            start = max(0, size - int(end_text))
+            end = size - 1
+    except ValueError:
+        raise HTTPException(status_code=416, detail=f"Invalid range: {header}")
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail=f"Range {header} not satisfiable for {size} bytes",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
 def load_tasks(task_names: List[str] = []):
     global TASKS
-    tasks_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend/tasks')
-    sys.path.append(tasks_dir)
-    
-    for filename in os.listdir(tasks_dir):
-        if filename.endswith('.py') and filename != '__init__.py':
-            module_name = filename[:-3]
-            try:
-                module = importlib.import_module(module_name)
-                for name, obj in module.__dict__.items():
-                    if isinstance(obj, type) and issubclass(obj, Task) and obj != Task:
-                        if not task_names or name in task_names:
-                            TASKS[name] = obj
-                            print(f"Enabled task: {name}")
-            except Exception as e:
-                print(f"Error loading task {module_name}: {e}")
+    for name, task_class in find_tasks(task_names).items():
+        TASKS[name] = task_class
+        engine.set_limit(name, concurrency_overrides.get(name, task_class.concurrency))
+        logger.info("Enabled task: %s (concurrency: %d)", name, engine.get_limit(name))
     
     for task in task_names:
         if task not in TASKS:
-            print(f"Task not found, cannot enable: {task}")
+            logger.warning("Task not found, cannot enable: %s", task)
 
 def get_task_files(task: Dict) -> Dict[str, str]:
     files = {}
@@ -119,306 +233,556 @@ def get_task_files(task: Dict) -> Dict[str, str]:
             
     return files
 
-def select_task(available_tasks: List[Dict]):
-    print("Available tasks:", [t['name'] for t in available_tasks])
-    print("Adapted names:", [adapt_name(t['name']) for t in available_tasks])
-    # Prioritize tasks that are already loaded and have all required files
-    for task in available_tasks:
-        task_name = adapt_name(task['name'])
-        if task_name in loaded_tasks:
-            task_files = set(get_task_files(task).values())
-            if task_files.issubset(available_files):
-                return task
-    
-    # now, prioritize tasks that are already loaded
-    for task in available_tasks:
-        task_name = adapt_name(task['name'])
-        if task_name in loaded_tasks:
-            return task
-    
-    # now, tasks that have all required files and are in TASKS
-    for task in available_tasks:
-        task_files = set(get_task_files(task).values())
-        if task_files.issubset(available_files) and adapt_name(task['name']) in TASKS:
-            return task
-        
-    # finally, take any task in TASKS
-    for task in available_tasks:
-        if adapt_name(task['name']) in TASKS:
-            return task
+def select_tasks(available_tasks: List[Dict]) -> List[Dict]:
+    logger.debug("Available tasks: %s", Payload([t['name'] for t in available_tasks]))
+    decision = scheduler.select_batch(available_tasks, max_accept)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Task selection:\n%s", decision.explain())
 
-async def wait_for_file_uploads(file_ids: List[str], timeout: float = 10.0):
-    events = []
+    # Start loading the models of accepted tasks in the background (when they fit without
+    # evicting anything), so they are ready by the time the client sends execute.
+    # Merely offered types are left alone, and worker processes load their own models.
+    for task_name in dict.fromkeys(adapt_name(task['name']) for task in decision.tasks):
+        if supervisor.worker_for(task_name) is None:
+            residency.prefetch(task_name, TASKS[task_name])
+    return decision.tasks
+
+async def request_files(websocket: WebSocket, client_id: str, file_ids: List[str]):
+    """Ask the client for files, unless an earlier job already asked for them and the upload is under way."""
     for file_id in file_ids:
-        if file_id not in file_upload_events:
-            file_upload_events[file_id] = asyncio.Event()
-        events.append(file_upload_events[file_id].wait())
+        event = file_upload_events.get(file_id)
+        if event is not None and not event.is_set():
+            logger.debug("Client %s: file %s already requested, waiting for it", client_id, file_id)
+            continue
+        file_request = wsmsg.ServerMessage(file_request=wsmsg.FileRequest(file_id=file_id, offset=uploaded_bytes(file_id)))
+        file_upload_events[file_id] = asyncio.Event()
+        requested_files.setdefault(client_id, set()).add(file_id)
+        await websocket.send_bytes(bytes(file_request))
+        logger.debug("Client %s: requested file %s", client_id, file_id)
+
+async def wait_for_file_uploads(file_ids: List[str], timeout: float = 10.0):
+    """Wait for requested files, giving up once none of them has received a chunk for `timeout` seconds."""
+    events = {file_id: file_upload_events.setdefault(file_id, asyncio.Event()) for file_id in file_ids}
+    started = time.monotonic()
+    while True:
+        pending = [file_id for file_id, event in events.items() if not event.is_set()]
+        if not pending:
+            return
+        idle = time.monotonic() - max([started] + [upload_activity.get(file_id, 0.0) for file_id in pending])
+        if idle >= timeout:
+            # let the next job that needs them ask again
+            for file_id in pending:
+                if file_upload_events.get(file_id) is events[file_id]:
+                    del file_upload_events[file_id]
+            raise HTTPException(status_code=408, detail=f"Timeout waiting for files: {', '.join(pending)}")
+        try:
+            await asyncio.wait_for(asyncio.gather(*(events[file_id].wait() for file_id in pending)), timeout=timeout - idle)
+        except asyncio.TimeoutError:
+            pass
+
+async def prepare_task(websocket: WebSocket, client_id: str, content: wsmsg.ExecuteTask, cancel_token: CancellationToken):
+    """Fetch the task's input files. Runs before the job waits for an execution slot."""
+    task_type = ProtoGenerator.to_pascal_case(content.name)
+    task_data = content.request.to_dict()
+    task_id = content.task_id
     
+    logger.debug("Client %s: preparing task %s: %s", client_id, task_id, Payload(task_data))
+    
+    files = get_task_files(task_data[task_type.lower()])
+    missing_files = [file_id for file_id in files.values() if file_id not in available_files]
+
+    # content we already hold under another id (e.g. the same source image edited again) needs no upload
+    declared_hashes = {ref['id']: ref.get('hash') for ref in task_data[task_type.lower()].values()
+                       if isinstance(ref, dict) and ref.get('type') == 'file_reference'}
+    for file_id in list(missing_files):
+        file_hash = declared_hashes.get(file_id)
+        existing = find_file_by_hash(file_hash) if is_content_hash(file_hash) else None
+        if existing:
+            logger.debug("Client %s: reusing stored content for %s (sha256 %s)", client_id, file_id, file_hash)
+            file_uploaded(file_id, existing, file_hash)
+            missing_files.remove(file_id)
+
+    if missing_files:
+        started = time.perf_counter()
+        try:
+            await request_files(websocket, client_id, missing_files)
+            await wait_for_file_uploads(missing_files)
+        except HTTPException as e:
+            error_response = wsmsg.ServerMessage(
+                error=wsmsg.ErrorResponse(
+                    task_id=task_id,
+                    error=str(e.detail)
+                )
+            )
+            await websocket.send_bytes(bytes(error_response))
+            return None
+        sizes = task_files(task_data)
+        waited = time.perf_counter() - started
+        scheduler.history.record_upload(sum(sizes.get(file_id, 0) for file_id in missing_files), waited)
+        TASK_STAGE_SECONDS.observe(waited, task=adapt_name(task_type), stage="file_wait")
+
+        for file_id in missing_files:
+            declared = declared_hashes.get(file_id)
+            if is_content_hash(declared) and get_file_hash(file_id) != declared:
+                error_response = wsmsg.ServerMessage(
+                    error=wsmsg.ErrorResponse(
+                        task_id=task_id,
+                        error=f"File {file_id} failed its integrity check: expected sha256 {declared}, got {get_file_hash(file_id)}"
+                    )
+                )
+                await websocket.send_bytes(bytes(error_response))
+                return None
+
+    # All files are now available: answer repeats of deterministic requests from the cache
+    cache_key = None
+    task_class = TASKS.get(adapt_name(task_type))
+    file_hashes = {file_id: get_file_hash(file_id) for file_id in files.values()}
+    if (result_cache is not None and task_class is not None and None not in file_hashes.values()
+            and task_class.is_cacheable(task_data[task_type.lower()])):
+        cache_key = result_cache.key(adapt_name(task_type), task_data[task_type.lower()], file_hashes)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            await send_cached_result(websocket, client_id, content, proto_tasks.TaskResponse().parse(cached))
+            return None
+
+    # a paused client's jobs wait here, without holding an execution slot
     try:
-        await asyncio.wait_for(asyncio.gather(*events), timeout=timeout)
-    except asyncio.TimeoutError:
-        missing_files = [file_id for file_id, event in zip(file_ids, events)]
-        raise HTTPException(status_code=408, detail=f"Timeout waiting for files: {', '.join(missing_files)}")
+        await cancel_token.acheck()
+    except TaskCancelled:
+        await send_cancelled(client_id, task_id)
+        return None
 
-VERBOSE = True  # Set this to False to disable verbose printing
+    for param, file_id in files.items():
+        task_data[task_type.lower()][param] = FileReference.from_id(file_id)
+    return task_data, cache_key
 
-def verbose_print(action: str, message: Any, client_id: str = "NA"):
-    if not VERBOSE:
+async def send_cancelled(client_id: str, task_id: str):
+    """Tell the client a cancelled task will not produce a result, if it is still there to hear it."""
+    websocket = active_connections.get(client_id)
+    if websocket is None:
         return
+    error_response = wsmsg.ServerMessage(error=wsmsg.ErrorResponse(task_id=task_id, error="Task cancelled"))
+    logger.info("Client %s: task %s cancelled", client_id, task_id)
+    await websocket.send_bytes(bytes(error_response))
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    client_info = f"Client {client_id}: " if client_id else ""
+async def cancel_job(client_id: str, task_id: str):
+    """
+    Jobs still fetching inputs or waiting for a slot are dropped right away.
+    Running ones stop at their next checkpoint, never in the middle of a
+    pipeline call, so the model they use is left in a consistent state.
+    """
+    scheduler.started(task_id)
+    token = cancel_tokens.get(task_id)
+    if token is not None:
+        token.cancel()
+    if not engine.is_started(task_id) and engine.cancel(task_id):
+        await send_cancelled(client_id, task_id)
+
+def set_paused(client_id: str, paused: bool):
+    if paused:
+        paused_clients.add(client_id)
+    else:
+        paused_clients.discard(client_id)
+    for job_id in engine.jobs_of(client_id):
+        token = cancel_tokens.get(job_id)
+        if token is not None:
+            token.pause() if paused else token.resume()
+
+async def send_cached_result(websocket: WebSocket, client_id: str, content: wsmsg.ExecuteTask, result: proto_tasks.TaskResponse):
+    result_dict = result.to_dict()
+    for file_id in task_files(result_dict):
+        storage.touch(get_file_path(file_id))
+        await websocket.send_bytes(bytes(wsmsg.ServerMessage(file_send=wsmsg.FileSend(file_id=file_id))))
+    response = wsmsg.ServerMessage(task_result=wsmsg.TaskResult(task_id=content.task_id, result=result))
+    logger.debug("Client %s: sending cached task result %s", client_id, Payload(response))
+    data = bytes(response)
+    await websocket.send_bytes(data)
+    task_name = adapt_name(ProtoGenerator.to_pascal_case(content.name))
+    TASK_BYTES.inc(len(data), task=task_name, direction="out")
+    TASKS_TOTAL.inc(task=task_name, outcome="cached")
+    journal.record({
+        'time': datetime.now(),
+        'id': content.task_id,
+        'client': client_id,
+        'type': ProtoGenerator.to_pascal_case(content.name),
+        'input': content.request,
+        'response': response,
+        'cached': True,
+    })
+
+async def run_task(websocket: WebSocket, client_id: str, content: wsmsg.ExecuteTask, cancel_token: CancellationToken, prepared: Tuple[Dict, Optional[str]]):
+    task_type = ProtoGenerator.to_pascal_case(content.name)
+    super_pascal = adapt_name(task_type)
+    task_id = content.task_id
+    task_data, cache_key = prepared
     
-    print(f"[{timestamp}] {client_info}{action}")
+    logger.info("Client %s: executing task %s (%s)", client_id, task_id, task_type)
     
-    if isinstance(message, (wsmsg.ClientMessage, wsmsg.ServerMessage)):
-        # For protobuf messages, we'll print the dictionary representation
-        print(json.dumps(message.to_dict(), indent=2))
-    elif isinstance(message, bytes):
-        # For raw bytes, we'll print the length and the first few bytes
-        print(f"Raw bytes (length: {len(message)}): {message[:20]}...") # type: ignore
-    else:
-        # For other types, we'll use the default string representation
-        print(str(message))
+    # protobuf messages are serialized by the journal's writer thread
+    request_log = {
+        'time': datetime.now(),
+        'id': task_id,
+        'client': client_id,
+        'type': task_type,
+        'input': content.request,
+    }
+    request_started = time.perf_counter()
     
-    print("---------------------")
+    if super_pascal in TASKS:
+        task_class = TASKS[super_pascal]
+        response_class = getattr(proto_tasks, f"{task_type}Response")
+        
+        async def send_update(msg: str, update=None, percent: int = 0, preview: bytes = b""):
+            wrapped = response_class(result=update)
+            incremental_update = wsmsg.ServerMessage(
+                incremental_update=wsmsg.IncrementalUpdate(
+                    task_id=task_id,
+                    msg=msg,
+                    # tasks pass either a whole TaskResponse or a partial result of their own type
+                    update=update if isinstance(update, proto_tasks.TaskResponse) else proto_tasks.TaskResponse(**{task_type.lower(): wrapped}),
+                    percent=percent,
+                    preview=preview
+                )
+            )
+            logger.debug("Client %s: sending incremental update %s", client_id, Payload(incremental_update))
+            data = bytes(incremental_update)
+            TASK_BYTES.inc(len(data), task=super_pascal, direction="out")
+            await websocket.send_bytes(data)
+            return "success"
 
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await websocket.accept()
-    active_connections[client_id] = websocket
-    verbose_print("Connection established", f"Active connections: {len(active_connections)}, now waiting for handshake", client_id)
+        # inputs of a running task must not be collected
+        inputs = [value.path for value in task_data[task_type.lower()].values() if isinstance(value, FileReference)]
+        storage.acquire(inputs)
+        TASK_BYTES.inc(sum(os.path.getsize(path) for path in inputs if os.path.exists(path)), task=super_pascal, direction="in")
+        # tasks that declare a cancel_token stop at their own checkpoints, others run to completion
+        extra = {}
+        if 'cancel_token' in inspect.signature(task_class.execute).parameters:
+            extra['cancel_token'] = cancel_token
+        # the worker process owning the task type loads its model
+        worker = supervisor.worker_for(super_pascal)
+        try:
+            await cancel_token.acheck()
+            async with residency.use(super_pascal, task_class) if worker is None else nullcontext():
+                started = time.perf_counter()
+                with TASK_STAGE_SECONDS.time(task=super_pascal, stage="execute"):
+                    if worker is not None:
+                        execution = worker.execute(super_pascal, task_id, task_data[task_type.lower()], send_update,
+                                                   cancel_token, profile=profiler.enabled(super_pascal))
+                    else:
+                        execution = task_class.execute(**task_data[task_type.lower()], send_update=send_update, **extra)
+                        if profiler.enabled(super_pascal):
+                            execution = profiler.run(super_pascal, task_id, execution)
+                    result = await execution
+                scheduler.history.record_execution(super_pascal, time.perf_counter() - started)
+            if cancel_token.cancelled:
+                raise TaskCancelled()
+            
+            # recursively convert File objects to proto
+            async def convert_to_proto(obj):
+                if isinstance(obj, FileReference):
+                    await obj.notify_client(websocket)
+                    return obj.to_proto()
+                elif isinstance(obj, dict):
+                    return {k: await convert_to_proto(v) for k, v in obj.items()}
+                elif isinstance(obj, list):
+                    return [await convert_to_proto(v) for v in obj]
+                elif isinstance(obj, tuple):
+                    return tuple([await convert_to_proto(v) for v in obj])
+                else:
+                    return obj
+                
+            with TASK_STAGE_SECONDS.time(task=super_pascal, stage="convert"):
+                result = await convert_to_proto(result)
+                
+                task_response = response_class(result=result)
+                
+                response = wsmsg.ServerMessage(
+                    task_result=wsmsg.TaskResult(
+                        task_id=task_id,
+                        result=proto_tasks.TaskResponse(**{task_type.lower(): task_response})
+                    )
+                )
+                data = bytes(response)
+            logger.debug("Client %s: sending task result %s", client_id, Payload(response))
+            with TASK_STAGE_SECONDS.time(task=super_pascal, stage="send"):
+                await websocket.send_bytes(data)
+            TASK_BYTES.inc(len(data), task=super_pascal, direction="out")
+            TASKS_TOTAL.inc(task=super_pascal, outcome="success")
+            request_log['response'] = response
+            if cache_key is not None and result_cache is not None:
+                result = response.task_result.result
+                result_cache.put(cache_key, super_pascal, bytes(result), result.to_dict())
+
+        except TaskCancelled:
+            await send_cancelled(client_id, task_id)
+            TASKS_TOTAL.inc(task=super_pascal, outcome="cancelled")
+            request_log['cancelled'] = True
+        except Exception as e:
+            TASKS_TOTAL.inc(task=super_pascal, outcome="error")
+            TASK_ERRORS.inc(task=super_pascal, error=getattr(e, 'error_type', e.__class__.__name__))
+            error_traceback = traceback.format_exc()
+            error_response = wsmsg.ServerMessage(
+                error=wsmsg.ErrorResponse(
+                    task_id=task_id,
+                    error=f"Error: {str(e)}\n\nTraceback:\n{error_traceback}"
+                )
+            )
+            logger.warning("Client %s: task %s failed: %s", client_id, task_id, e, exc_info=True)
+            await websocket.send_bytes(bytes(error_response))
+            request_log['response'] = error_response
+            request_log['error_traceback'] = error_traceback
+        finally:
+            storage.release(inputs)
+    else:
+        error_response = wsmsg.ServerMessage(
+            error=wsmsg.ErrorResponse(
+                task_id=task_id,
+                error=f"Unknown task type: {task_type} -- available tasks: {list(TASKS.keys())}"
+            )
+        )
+        logger.warning("Client %s: unknown task type %s", client_id, task_type)
+        TASKS_TOTAL.inc(task=super_pascal, outcome="error")
+        TASK_ERRORS.inc(task=super_pascal, error="UnknownTaskType")
+        await websocket.send_bytes(bytes(error_response))
+        request_log['response'] = error_response
     
-    # wait for initial message
-    data = await websocket.receive_bytes()
-    # parse the message
+    request_log['seconds'] = time.perf_counter() - request_started
+    journal.record(request_log)
+
+def protocol_major(version: str) -> int:
+    try:
+        return int(version.split(".")[0])
+    except ValueError:
+        return 0
+
+def worker_tasks() -> List[wsmsg.WorkerTask]:
+    return [
+        wsmsg.WorkerTask(name=name.lower(), concurrency=engine.get_limit(name), loaded=residency.is_resident(name))
+        for name in TASKS
+    ]
+
+async def handshake(websocket: WebSocket, client_id: str) -> Optional[str]:
+    """
+    Wait for the client's handshake and answer with what this worker runs and
+    how much it takes right now, so the client can offer tasks straight away.
+    Returns the client's protocol version, or None if the connection was closed.
+    """
+    try:
+        data = await asyncio.wait_for(websocket.receive_bytes(), handshake_timeout)
+    except asyncio.TimeoutError:
+        logger.info("Client %s: handshake timed out", client_id)
+        await websocket.close(1008, "Handshake timed out")
+        return None
     client_message = wsmsg.ClientMessage().parse(data)
-    # verify that its client handshake
-    message_type, version = betterproto.which_one_of(client_message, "message")
+    message_type, content = betterproto.which_one_of(client_message, "message")
     if message_type != "handshake":
-        verbose_print("Invalid handshake message", client_message, client_id)
+        logger.warning("Client %s: invalid handshake message %s", client_id, Payload(client_message))
         await websocket.close(1000, "Invalid handshake message")
+        return None
+    logger.debug("Client %s: received handshake %s", client_id, Payload(client_message))
+    if protocol_major(content.version) > protocol_major(PROTOCOL_VERSION):
+        await websocket.close(1002, f"Unsupported protocol version {content.version}, server speaks {PROTOCOL_VERSION}")
+        return None
+
+    if connect_jitter > 0:
+        await asyncio.sleep(uniform(0, connect_jitter))
+    reply = wsmsg.ServerHandshake(version=PROTOCOL_VERSION, capacity=scheduler.capacity(max_accept), tasks=worker_tasks())
+    await websocket.send_bytes(bytes(wsmsg.ServerMessage(handshake=reply)))
+    return content.version
+
+@app.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    await websocket.accept()
+    logger.debug("Client %s: connection accepted, waiting for handshake", client_id)
+    try:
+        version = await handshake(websocket, client_id)
+    except WebSocketDisconnect:
+        logger.info("Client %s: disconnected during handshake", client_id)
         return
-    verbose_print("Received handshake", client_message, client_id)
-    
-    # send server handshake
-    await websocket.send_bytes(bytes(wsmsg.ServerMessage(handshake=wsmsg.ServerHandshake("0.0.0"))))
-    
-    # todo: kill this lmao
-    sleep(randint(10, 30) / 10)
+    if version is None:
+        return
+    active_connections[client_id] = websocket
+    logger.info("Client %s: connection established, active connections: %d", client_id, len(active_connections))
     
-    # to start off, ask for available tasks
-    await websocket.send_bytes(bytes(wsmsg.ServerMessage(request_available_tasks=wsmsg.RequestAvailableTasks(client_id=client_id))))
-    verbose_print("Requested available tasks from", "", client_id)
+    if protocol_major(version) < 1:
+        # older clients wait to be asked for available tasks
+        request = wsmsg.RequestAvailableTasks(client_id=client_id, capacity=scheduler.capacity(max_accept))
+        await websocket.send_bytes(bytes(wsmsg.ServerMessage(request_available_tasks=request)))
+        logger.debug("Client %s: requested available tasks", client_id)
     
     try:
         while True:
             data = await websocket.receive_bytes()
-            # verbose_print("Received raw message", data, client_id)
-            
             client_message = wsmsg.ClientMessage().parse(data)
-            # verbose_print("Parsed client message", client_message, client_id)
-            
             message_type, message_content = betterproto.which_one_of(client_message, "message")
             
-            if message_type == "available_tasks":
-                verbose_print("Processing available tasks", message_content, client_id)
+            if message_type == "available_tasks" and client_id in paused_clients:
+                logger.debug("Client %s: ignoring available tasks while paused", client_id)
+            
+            elif message_type == "available_tasks":
+                logger.debug("Client %s: available tasks %s", client_id, Payload(message_content))
                 available_tasks = [
                     {"id": task.id, "name": task.name, "request": task.request.to_dict()}
                     for task in message_content.tasks
                 ]
-                selected_task = select_task(available_tasks)
-                if selected_task:
+                task_rounds.record({'time': datetime.now(), 'client': client_id, 'tasks': available_tasks})
+                selected_tasks = select_tasks(available_tasks)
+                if selected_tasks:
+                    for task in selected_tasks:
+                        scheduler.accept(task['id'], adapt_name(task['name']), client_id)
+                    task_ids = [task['id'] for task in selected_tasks]
                     response = wsmsg.ServerMessage(
-                        accept_task=wsmsg.AcceptTask(task_id=selected_task['id'])
+                        accept_task=wsmsg.AcceptTask(task_id=task_ids[0], task_ids=task_ids)
                     )
-                    verbose_print("Sending response", response, client_id)
+                    logger.debug("Client %s: accepting %s", client_id, Payload(task_ids))
                     await websocket.send_bytes(bytes(response))
                 else:
-                    print(f"No task available from list -- eligle task types: {TASKS.keys()}")
+                    logger.debug("No task available from list -- eligible task types: %s", Payload(list(TASKS)))
                     response = wsmsg.ServerMessage(no_task_available=wsmsg.NoTaskAvailable())
             
             elif message_type == "execute":
                 content: wsmsg.ExecuteTask = message_content
-                task_type = ProtoGenerator.to_pascal_case(content.name)
-                super_pascal = adapt_name(task_type)
-                task_data = content.request.to_dict()
-                task_id = content.task_id
-                
-                verbose_print("Executing task", task_data, client_id)
-                print("TASK FILES", get_task_files(task_data[task_type.lower()]))
-                
-                files = get_task_files(task_data[task_type.lower()])
-                missing_files = [file_id for file_id in files.values() if file_id not in available_files]
-
-                if missing_files:
-                    for file_id in missing_files:
-                        file_request = wsmsg.ServerMessage(file_request=wsmsg.FileRequest(file_id=file_id))
-                        await websocket.send_bytes(bytes(file_request))
-                        verbose_print(f"Requested file: {file_id}", client_id)
-
-                    try:
-                        await wait_for_file_uploads(missing_files)
-                    except HTTPException as e:
-                        error_response = wsmsg.ServerMessage(
-                            error=wsmsg.ErrorResponse(
-                                task_id=task_id,
-                                error=str(e.detail)
-                            )
-                        )
-                        await websocket.send_bytes(bytes(error_response))
-                        continue
-
-                # All files are now available, proceed with task execution
-                for param, file_id in files.items():
-                    file_path = get_file_path(file_id)
-                    task_data[task_type.lower()][param] = FileReference(filename=os.path.basename(file_path))
-                
-                request_log = {
-                    'time': datetime.now(),
-                    'id': task_id,
-                    'type': task_type,
-                    'input': task_data
-                }
-                
-                if super_pascal in TASKS:
-                    task_class = TASKS[super_pascal]
-                    response_class = getattr(proto_tasks, f"{task_type}Response")
-                    
-                    async def send_update(msg: str, update=None):
-                        wrapped = response_class(result=update)
-                        incremental_update = wsmsg.ServerMessage(
-                            incremental_update=wsmsg.IncrementalUpdate(
-                                task_id=task_id,
-                                msg=msg,
-                                update=update if update else proto_tasks.TaskResponse(**{task_type.lower(): wrapped})
-                            )
-                        )
-                        verbose_print("Sending incremental update", incremental_update, client_id)
-                        await websocket.send_bytes(bytes(incremental_update))
-                        return "success"
-                    try:
-                        if task_type not in loaded_tasks:
-                            try:
-                                task_class.load()
-                            except RuntimeError as e:
-                                # match CUDA memory error
-                                if "CUDA" in str(e):
-                                    # try unloading all tasks and retry
-                                    for task in loaded_tasks:
-                                        TASKS[task].unload()
-                                    loaded_tasks.clear()
-                                    task_class.load()
-                                    
-                            loaded_tasks.add(task_type)
-                    
-                        result = await task_class.execute(**task_data[task_type.lower()], send_update=send_update)
-                        
-                        # recursively convert File objects to proto
-                        async def convert_to_proto(obj):
-                            if isinstance(obj, FileReference):
-                                await obj.notify_client(websocket)
-                                return obj.to_proto()
-                            elif isinstance(obj, dict):
-                                return {k: convert_to_proto(v) for k, v in obj.items()}
-                            elif isinstance(obj, list):
-                                return [convert_to_proto(v) for v in obj]
-                            elif isinstance(obj, tuple):
-                                return tuple(convert_to_proto(v) for v in obj)
-                            else:
-                                return obj
-                            
-                        result = await convert_to_proto(result)
-                        
-                        task_response = response_class(result=result)
-                        
-                        task_response_dict = task_response.to_dict()
-                        print("TASK RESPONSE", task_response_dict)
-                        
-                        response = wsmsg.ServerMessage(
-                            task_result=wsmsg.TaskResult(
-                                task_id=task_id,
-                                result=proto_tasks.TaskResponse(**{task_type.lower(): task_response})
-                            )
-                        )
-                        verbose_print("Sending task result", response, client_id)
-                        await websocket.send_bytes(bytes(response))
-                        request_log['response'] = response.to_dict()
-
-                    except Exception as e:
-                        error_traceback = traceback.format_exc()
-                        error_response = wsmsg.ServerMessage(
-                            error=wsmsg.ErrorResponse(
-                                task_id=task_id,
-                                error=f"Error: {str(e)}\n\nTraceback:\n{error_traceback}"
-                            )
-                        )
-                        verbose_print("Sending error response", error_response, client_id)
-                        await websocket.send_bytes(bytes(error_response))
-                        request_log['response'] = error_response.to_dict()
-                        request_log['error_traceback'] = error_traceback
-                else:
-                    error_response = wsmsg.ServerMessage(
-                        error=wsmsg.ErrorResponse(
-                            task_id=task_id,
-                            error=f"Unknown task type: {task_type} -- available tasks: {list(TASKS.keys())}"
-                        )
-                    )
-                    verbose_print("Sending error response for unknown task type", error_response, client_id)
-                    await websocket.send_bytes(bytes(error_response))
-                    request_log['response'] = error_response.to_dict()
-                
-                request_logs.append(request_log)
+                super_pascal = adapt_name(ProtoGenerator.to_pascal_case(content.name))
+                logger.debug("Client %s: scheduling task %s (%s), queue depth: %d", client_id, content.task_id, super_pascal, engine.queue_depth(super_pascal))
+                scheduler.started(content.task_id)
+                cancel_token = CancellationToken()
+                if client_id in paused_clients:
+                    cancel_token.pause()
+                cancel_tokens[content.task_id] = cancel_token
+                job = engine.submit(content.task_id, super_pascal, partial(run_task, websocket, client_id, content, cancel_token),
+                                    owner=client_id, prepare=partial(prepare_task, websocket, client_id, content, cancel_token))
+                job.add_done_callback(lambda _, task_id=content.task_id: cancel_tokens.pop(task_id, None))
+            
+            elif message_type == "cancel":
+                logger.info("Client %s: cancel requested for %s", client_id, message_content.task_id)
+                await cancel_job(client_id, message_content.task_id)
             
             elif message_type == "file_response":
-                verbose_print("Received file response", message_content.file_id, client_id)
+                logger.debug("Client %s: received file response %s", client_id, message_content.file_id)
                 # Handle file response
                 file_id = message_content.file_id
                 content = message_content.content
                 # Process the file content as needed
             
+            elif message_type == "file_chunk":
+                await receive_file_chunk(websocket, client_id, message_content)
+            
             elif message_type == "pause":
-                verbose_print("Received pause request", message_content, client_id)
-                # Implement pause functionality
-                pass
+                logger.info("Client %s: paused", client_id)
+                # running jobs hold at their next checkpoint and no new tasks are accepted
+                set_paused(client_id, True)
             
             elif message_type == "resume":
-                verbose_print("Received resume request", message_content, client_id)
-                # Implement resume functionality
-                pass
+                logger.info("Client %s: resumed", client_id)
+                set_paused(client_id, False)
+                request = wsmsg.RequestAvailableTasks(client_id=client_id, capacity=scheduler.capacity(max_accept))
+                await websocket.send_bytes(bytes(wsmsg.ServerMessage(request_available_tasks=request)))
             
             else:
-                verbose_print("Received unknown message type", f"{message_type}: {message_content}", client_id)
+                logger.warning("Client %s: unknown message type %s: %s", client_id, message_type, Payload(message_content))
                 
     except WebSocketDisconnect:
-        verbose_print("WebSocket disconnected", "", client_id)
+        logger.info("Client %s: disconnected", client_id)
     finally:
+        scheduler.forget_owner(client_id)
+        paused_clients.discard(client_id)
+        requested_files.pop(client_id, None)
         del active_connections[client_id]
-        verbose_print("Connection closed", f"Active connections: {len(active_connections)}", client_id)
+        # nobody is left to receive results: drop queued jobs, stop running ones at their next checkpoint
+        cancelled = engine.jobs_of(client_id)
+        for job_id in cancelled:
+            await cancel_job(client_id, job_id)
+        if cancelled:
+            logger.info("Client %s: cancelled %d jobs of disconnected client", client_id, len(cancelled))
+        logger.info("Client %s: connection closed, active connections: %d", client_id, len(active_connections))
         
 @app.post("/api/upload/{file_id}")
 async def upload_file(file_id: str, file: UploadFile = File(...)):
-    file_path = os.path.join(file_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    add_file_mapping(file_id, file_path)
-    available_files[file_id] = FileReference(filename=file.filename)
+    # stream to disk chunk by chunk, so a large upload is never held in memory whole,
+    # hashing as we go, then file it under its content hash
+    with temp_file() as partial_path:
+        digest = hashlib.sha256()
+        with open(partial_path, "wb") as buffer:
+            while chunk := await file.read(CHUNK_SIZE):
+                digest.update(chunk)
+                buffer.write(chunk)
+        file_hash = digest.hexdigest()
+        file_path = store_content(partial_path, file.filename, file_hash)
     
-    # Set the event to indicate the file has been uploaded
-    if file_id in file_upload_events:
-        file_upload_events[file_id].set()
+    file_uploaded(file_id, file_path, file_hash)
     
     return {"message": f"File {file_id} uploaded successfully"}
 
+@app.get("/api/models")
+async def model_residency():
+    return residency.report()
+
+@app.get("/api/workers")
+async def worker_processes():
+    return supervisor.report()
+
+@app.get("/api/cache")
+async def cache_stats():
+    if result_cache is None:
+        return {"enabled": False}
+    return dict(result_cache.report(), enabled=True)
+
+@app.get("/api/storage")
+async def storage_stats():
+    return storage.report()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/profiling")
+async def profiling_status():
+    return profiler.report()
+
+@app.post("/api/profiling/{task_name}")
+async def set_profiling(task_name: str, enabled: bool = True):
+    """Profile executions of `task_name` (or "*" for every task) from now on, or stop."""
+    name = task_name if task_name == "*" else adapt_name(task_name)
+    if name != "*" and name not in TASKS:
+        raise HTTPException(status_code=404, detail=f"Unknown task: {task_name}")
+    profiler.set(name, enabled)
+    return profiler.report()
+
+@app.get("/api/requests")
+async def recent_requests(limit: int = 50):
+    return {"journal": journal.report(), "requests": journal.latest(limit)}
+
 @app.get("/api/download/{file_id}")
-async def download_file(file_id: str):
+async def download_file(file_id: str, range: Optional[str] = Header(None)):
     try:
         file_path = get_file_path(file_id)
-        return FileResponse(file_path, filename=os.path.basename(file_path))
     except HTTPException as e:
         raise e
+    filename = os.path.basename(file_path)
+    storage.touch(file_path)
+    file_hash = get_file_hash(file_id)
+    if file_hash is None:
+        file_hash = await asyncio.get_running_loop().run_in_executor(get_executor(), hash_file, file_path)
+        set_file_hash(file_id, file_hash)
+    if range is None:
+        # clients check the content against X-Content-SHA256
+        return FileResponse(file_path, filename=filename, headers={"Accept-Ranges": "bytes", "X-Content-SHA256": file_hash})
+    
+    # partial content, so clients can resume interrupted downloads of large files
+    size = os.path.getsize(file_path)
+    start, end = parse_range(range, size)
+    return StreamingResponse(
+        iter_file(file_path, start, end),
+        status_code=206,
+        media_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "X-Content-SHA256": file_hash,
+            "Content-Length": str(end - start + 1),
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        },
+    )
         
 if __name__ == "__main__":
     import uvicorn
@@ -427,25 +791,104 @@ if __name__ == "__main__":
     parser.add_argument('tasks', nargs='*', help='List of task names to load (optional, loads all tasks if not specified)')
     parser.add_argument('--port', type=int, help='Port to run the server on (default: 8000)')
     # bool option to try to preload all tasks
-    parser.add_argument('--preload', action='store_true', help='Preload all tasks')
+    parser.add_argument('--preload', action='store_true', help='Load all tasks in the background at startup')
+    parser.add_argument('--warmup', action='store_true', help='Run a small warmup inference after each model load')
+    parser.add_argument('--vram-budget', type=float, help='VRAM (MB) that loaded models may use, least recently used models are unloaded to stay within it (default: unlimited)')
+    parser.add_argument('--ram-budget', type=float, help='System RAM (MB) that loaded models may use, in each process with --workers/--worker (default: unlimited)')
+    parser.add_argument('--concurrency', action='append', default=[], metavar='TASK=N',
+                        help='Override how many executions of a task may run at once (repeatable, e.g. --concurrency Text2Text=32)')
+    parser.add_argument('--prefetch', type=int, default=1, help='Extra jobs per task type to accept beyond its concurrency, so the next one is queued with inputs ready (default: 1)')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the result cache for deterministic requests')
+    parser.add_argument('--cache-size', type=float, default=512, help='Result cache size on disk in MB (default: 512)')
+    parser.add_argument('--cache-ttl', type=float, default=7 * 24, help='Hours a cached result stays valid (default: 168)')
+    parser.add_argument('--storage-quota', type=float, default=10240, help='Disk space (MB) for stored files, least recently used files are removed beyond it, 0 for unlimited (default: 10240)')
+    parser.add_argument('--file-retention', type=float, default=7 * 24, help='Hours an unused stored file is kept, 0 to keep files forever (default: 168)')
+    parser.add_argument('--gc-interval', type=float, default=600, help='Seconds between storage collections (default: 600)')
+    parser.add_argument('--preview-interval', type=float, default=previews.preview_interval, help='Seconds between latent previews sent while a diffusion task runs, 0 disables them (default: 0.5)')
+    parser.add_argument('--preview-budget', type=float, default=previews.preview_budget, help='Largest fraction of a task\'s run time that rendering previews may take (default: 0.05)')
+    parser.add_argument('--handshake-timeout', type=float, default=handshake_timeout, help='Seconds a new connection has to send its handshake (default: 10)')
+    parser.add_argument('--connect-jitter', type=float, default=connect_jitter, help='Most seconds to randomly delay a handshake reply, to stagger many workers reconnecting at once (default: 0)')
+    parser.add_argument('--log-level', default=None, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], type=str.upper,
+                        help='Log level, DEBUG includes (summarized) message payloads (default: INFO, or $TRASK_LOG_LEVEL)')
+    parser.add_argument('--no-journal', action='store_true', help='Do not write handled requests to dumps/requests.jsonl')
+    parser.add_argument('--journal-size', type=float, default=64, help='Size in MB at which the request journal is rotated (default: 64)')
+    parser.add_argument('--journal-backups', type=int, default=5, help='Rotated request journal files to keep (default: 5)')
+    parser.add_argument('--record-rounds', action='store_true', help='Write every offered available_tasks round to dumps/rounds.jsonl, a trace for scheduler.py')
+    parser.add_argument('--profile', action='append', default=[], metavar='TASK',
+                        help='Profile every execution of TASK ("*" for all tasks) into dumps/profiles, can be repeated (also $TRASK_PROFILE, comma separated)')
+    parser.add_argument('--profile-torch', action='store_true', help='Also record pipeline calls of profiled tasks with torch.profiler')
+    parser.add_argument('--profile-keep', type=int, default=100, help='Most profile files to keep, older ones are removed (default: 100)')
+    parser.add_argument('--max-accept', type=int, default=8, help='Most tasks to accept in one available_tasks round (default: 8)')
+    parser.add_argument('--workers', type=int, default=0, help='Run tasks in this many worker processes: GPU tasks share the first, the others are spread over the rest (default: 0, all tasks in this process)')
+    parser.add_argument('--worker', action='append', default=[], metavar='TASKS',
+                        help='Run these comma separated tasks in a worker process of their own, can be repeated (e.g. --worker Text2Image,Text2Imagedraft)')
     args = parser.parse_args()
 
+    if args.log_level:
+        logger.setLevel(args.log_level)
+
+    for override in args.concurrency:
+        task_name, _, limit = override.partition('=')
+        if not limit.isdigit() or int(limit) < 1:
+            parser.error(f"Invalid --concurrency value: {override}")
+        concurrency_overrides[task_name] = int(limit)
+
     if args.tasks:
         load_tasks(args.tasks)
     else:
         load_tasks() # Load all tasks
         
-    if args.preload:
-        for task_name, task_class in TASKS.items():
-            task_class.load()
-            loaded_tasks.add(task_name)
+    residency.budgets.update(vram=args.vram_budget, ram=args.ram_budget)
+    residency.warmup = args.warmup
+    preload_on_startup = args.preload
+    scheduler.prefetch = max(0, args.prefetch)
+    max_accept = max(1, args.max_accept)
+    handshake_timeout = args.handshake_timeout
+    connect_jitter = max(0.0, args.connect_jitter)
+    if args.no_cache:
+        result_cache = None
+    elif result_cache is not None:
+        result_cache.max_bytes = int(args.cache_size * 1024 * 1024)
+        result_cache.ttl = args.cache_ttl * 3600
+    storage.max_bytes = int(args.storage_quota * 1024 * 1024) or None
+    storage.max_age = args.file_retention * 3600 or None
+    storage.interval = args.gc_interval
+    previews.preview_interval = args.preview_interval
+    previews.preview_budget = args.preview_budget
+    journal.enabled = not args.no_journal
+    journal.max_bytes = int(args.journal_size * 1024 * 1024)
+    journal.backups = max(0, args.journal_backups)
+    task_rounds.enabled = args.record_rounds
+    task_rounds.max_bytes, task_rounds.backups = journal.max_bytes, journal.backups
+    for task_name in args.profile:
+        profiler.set(task_name if task_name == '*' else adapt_name(task_name), True)
+    profiler.use_torch = profiler.use_torch or args.profile_torch
+    profiler.max_files = max(1, args.profile_keep)
+    groups = [[adapt_name(name.strip()) for name in group.split(',') if name.strip()] for group in args.worker]
+    assigned = {name for group in groups for name in group}
+    unknown = sorted(name for name in assigned if name not in TASKS)
+    if unknown:
+        parser.error(f"Unknown tasks for --worker: {', '.join(unknown)}")
+    if args.workers > 0:
+        groups += split_tasks({name: task_class for name, task_class in TASKS.items() if name not in assigned}, args.workers)
+    gpu = gpu_processes(TASKS, groups)
+    if len(gpu) > 1:
+        parser.error("Tasks using the GPU must run in one process, as each process keeps its models within the whole VRAM budget "
+                     f"(now split as {' / '.join(','.join(names) for names in gpu)})")
+    for group in groups:
+        supervisor.add_worker(group)
+    supervisor.settings.update(
+        vram_budget=args.vram_budget, ram_budget=args.ram_budget, warmup=args.warmup, preload=args.preload,
+        preview_interval=args.preview_interval, preview_budget=args.preview_budget, log_level=args.log_level,
+        profile_torch=profiler.use_torch, profile_keep=profiler.max_files,
+    )
         
     port = args.port if args.port else 8000
     
     cert_path = os.path.join(os.path.dirname(__file__), '..', 'certs', 'cert.pem')
     key_path = os.path.join(os.path.dirname(__file__), '..', 'certs', 'key.pem')
     if os.path.exists(cert_path) and os.path.exists(key_path):
-        print("SSL certificate and key found. Running server with SSL.")
+        logger.info("SSL certificate and key found. Running server with SSL.")
         uvicorn.run(
             app,
             host="0.0.0.0",
@@ -454,5 +897,5 @@ if __name__ == "__main__":
             ssl_certfile=cert_path
         )
     else:
-        print("SSL certificate and key not found. Running server without SSL.")
+        logger.info("SSL certificate and key not found. Running server without SSL.")
         uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from db import db_manager
+from log import logger
+from tasks.file import FILES_DIR, TEMP_DIR
+
+# Files the storage manager never collects, besides dotfiles
+KEEP = {"id_map.db", "id_map.db-wal", "id_map.db-shm"}
+
+class StorageManager:
+    """
+    Keeps the files directory within a disk quota.
+
+    Stored files (uploads, outputs) are collected once they
+    are older than `max_age` seconds, and least recently used files go first
+    while the directory is over `max_bytes`. A file's mtime is its last use:
+    downloads and reuse of uploaded content touch it. Files used by running
+    tasks are never collected, and neither is anything younger than
+    `min_age`, which covers outputs that have not been returned yet and
+    uploads waiting for their task. Mapping rows of removed files are dropped.
+
+    The temp area (`tasks.file.temp_file`, partial uploads) is emptied at
+    startup, and each collection removes what has not been written to for
+    `min_age`. Subdirectories other than the
+    temp area manage themselves (e.g. the result cache).
+    """
+    def __init__(self,
+                 files_dir: str = FILES_DIR,
+                 max_bytes: Optional[int] = 10 * 1024 ** 3,
+                 max_age: Optional[float] = 7 * 24 * 3600,
+                 min_age: float = 3600,
+                 interval: float = 600,
+                 on_remove: Callable[[List[str]], None] = lambda paths: None):
+        self.files_dir = files_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.interval = interval
+        self.on_remove = on_remove
+        self.refs: Counter = Counter()
+        self.lock = threading.Lock()
+        self.stats = {"collections": 0, "removed_files": 0, "removed_bytes": 0, "removed_rows": 0}
+        self.last: Dict = {}
+
+    def acquire(self, paths: Iterable[str]):
+        """Protect `paths` from collection until released, e.g. while a task uses them."""
+        with self.lock:
+            for path in paths:
+                self.refs[path] += 1
+                self.touch(path)
+
+    def release(self, paths: Iterable[str]):
+        with self.lock:
+            for path in paths:
+                self.refs[path] -= 1
+                if self.refs[path] <= 0:
+                    del self.refs[path]
+
+    @staticmethod
+    def touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def clear_temp(self, older_than: float = 0):
+        now = time.time()
+        if not os.path.isdir(TEMP_DIR):
+            return
+        for entry in os.scandir(TEMP_DIR):
+            try:
+                if now - entry.stat().st_mtime >= older_than:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for entry in os.scandir(self.files_dir):
+            if entry.name in KEEP or entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def collect(self) -> Dict:
+        """Run one collection, returns what was removed."""
+        result, removed_paths = self._collect()
+        if removed_paths:
+            self.on_remove(removed_paths)
+        return result
+
+    def _collect(self) -> Tuple[Dict, List[str]]:
+        started = time.perf_counter()
+        now = time.time()
+        self.clear_temp(older_than=self.min_age)
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+
+        removed = []
+        with self.lock:
+            for mtime, size, path in files:
+                age = now - mtime
+                expired = self.max_age is not None and age > self.max_age
+                over_quota = self.max_bytes is not None and total > self.max_bytes
+                if not (expired or over_quota):
+                    continue
+                if age < self.min_age or path in self.refs:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.append((path, size))
+
+        removed_paths = [path for path, _ in removed]
+        existing = {path for _, _, path in files} - set(removed_paths)
+        # rows of removed files, and of files that went missing some other way
+        stale = set(removed_paths) | {path for path in db_manager.file_paths()
+                                      if path not in existing and not os.path.exists(path)}
+        removed_rows = db_manager.remove_paths(stale)
+
+        self.stats["collections"] += 1
+        self.stats["removed_files"] += len(removed)
+        self.stats["removed_bytes"] += sum(size for _, size in removed)
+        self.stats["removed_rows"] += removed_rows
+        self.last = {
+            "time": now,
+            "seconds": time.perf_counter() - started,
+            "removed_files": len(removed),
+            "removed_rows": removed_rows,
+            "bytes": total,
+        }
+        if removed or removed_rows:
+            logger.info("Storage: removed %d files and %d mapping rows, %.1f MB in use", len(removed), removed_rows, total / 1024 ** 2)
+        return self.last, removed_paths
+
+    async def run(self):
+        """Collect every `interval` seconds, in a worker thread, until cancelled."""
+        self.clear_temp()
+        while True:
+            try:
+                _, removed_paths = await asyncio.to_thread(self._collect)
+                # on_remove runs here on the event loop, which owns the state it updates
+                if removed_paths:
+                    self.on_remove(removed_paths)
+            except Exception as e:
+                logger.error("Storage collection failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def report(self) -> Dict:
+        return dict(
+            self.stats,
+            last=self.last,
+            max_bytes=self.max_bytes,
+            max_age=self.max_age,
+            in_use=len(self.refs),
+        )
@@ -0,0 +1,411 @@
+"""
+Supervisor mode: task executions run in worker processes, each owning a
+subset of the task types (and so of the models), so CPU-bound work in one
+task no longer competes for the GIL with the others. The front process
+(server.py) keeps the client connections, uploads, the scheduler, the
+result cache and the journal; it sends each job to the worker owning its
+task type over a local pipe and relays the updates and the result.
+
+The files directory is shared, so files cross the pipe as handles (id,
+path, hash) rather than content. Outputs are registered in the file
+mapping by the front process once they are handed to the client, as for
+tasks running in-process. A worker that exits fails its running jobs and
+is started again for the next one.
+
+    python server.py --workers 2                       # GPU tasks / CPU tasks
+    python server.py --worker Text2Image,Text2Imagedraft --worker File2Text
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import subprocess
+import sys
+import threading
+import traceback
+from dataclasses import dataclass
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import betterproto
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from log import logger, setup_logging
+from profiling import Profiler
+from residency import ResidencyManager
+from tasks.cancellation import CancellationToken, TaskCancelled
+from tasks.file import FileReference
+from tasks.task import find_tasks, shutdown_executors
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from proto.py import tasks as proto_tasks  # type: ignore
+
+@dataclass
+class FileHandle:
+    """A FileReference on its way to another process."""
+    id: str
+    path: str
+    hash: Optional[str]
+    registered: bool
+
+@dataclass
+class ProtoValue:
+    """A protobuf message on its way to another process, betterproto messages do not pickle."""
+    type: str
+    data: bytes
+
+def marshal(value: Any) -> Any:
+    """Make task arguments and results picklable. May hash output files, so keep it off the event loop for results."""
+    if isinstance(value, FileReference):
+        return FileHandle(value.id, value.path, value.hash, value.registered)
+    if isinstance(value, betterproto.Message):
+        return ProtoValue(type(value).__name__, bytes(value))
+    if isinstance(value, dict):
+        return {key: marshal(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [marshal(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(marshal(item) for item in value)
+    return value
+
+def unmarshal(value: Any) -> Any:
+    if isinstance(value, FileHandle):
+        return FileReference.existing(value.id, value.path, value.hash, registered=value.registered)
+    if isinstance(value, ProtoValue):
+        return getattr(proto_tasks, value.type)().parse(value.data)
+    if isinstance(value, dict):
+        return {key: unmarshal(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unmarshal(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(unmarshal(item) for item in value)
+    return value
+
+class WorkerError(Exception):
+    """A job failed in a worker process; `error_type` names the exception raised there."""
+    def __init__(self, error_type: str, message: str, worker_traceback: str = ""):
+        super().__init__(f"{message}\n\nWorker traceback:\n{worker_traceback}" if worker_traceback else message)
+        self.error_type = error_type
+
+def split_tasks(tasks: Dict[str, type], count: int) -> List[List[str]]:
+    """
+    Task groups for `count` worker processes. Tasks with a model on the GPU
+    share the first process, so one residency manager keeps them within the
+    VRAM budget; the others are spread over the remaining processes, or over
+    all of them if no task needs the GPU or there is only one process.
+    """
+    gpu = [name for name, task_class in tasks.items() if task_class.vram_mb > 0]
+    cpu = [name for name in tasks if name not in gpu]
+    groups: List[List[str]] = [[] for _ in range(count)]
+    groups[0].extend(gpu)
+    spread = range(1, count) if gpu and count > 1 else range(count)
+    for index, name in enumerate(cpu):
+        groups[spread[index % len(spread)]].append(name)
+    return [group for group in groups if group]
+
+def gpu_processes(tasks: Dict[str, type], groups: List[List[str]]) -> List[List[str]]:
+    """
+    The GPU tasks of each process that would load any: the front process
+    (tasks in no group) first, then the worker groups. Every process keeps
+    its models within the whole VRAM budget, so more than one entry means
+    the budget can be exceeded.
+    """
+    grouped = {name for group in groups for name in group}
+    processes = [[name for name in tasks if name not in grouped]] + groups
+    holders = [[name for name in group if name in tasks and tasks[name].vram_mb > 0] for group in processes]
+    return [gpu for gpu in holders if gpu]
+
+# --- front process ---
+
+class WorkerProcess:
+    """
+    A worker process running `tasks`, as seen from the front process. Jobs
+    go out over the pipe; updates, results and errors come back on a reader
+    thread and are handed to the waiting job on the event loop.
+    """
+    def __init__(self, name: str, tasks: List[str], settings: Dict[str, Any],
+                 on_state: Callable[[Dict[str, str]], None]):
+        self.name = name
+        self.tasks = list(tasks)
+        self.settings = settings
+        self.on_state = on_state
+        self.process: Optional[subprocess.Popen] = None
+        self.conn: Optional[Connection] = None
+        self.jobs: Dict[str, asyncio.Queue] = {}
+        # the pipe each job went out on: when it closes those jobs fail, even after a restart
+        self.job_conns: Dict[str, Connection] = {}
+        self.available: Optional[List[str]] = None
+        self.stopping = False
+        self.stats = {"starts": 0, "executed": 0, "failed": 0}
+        self._send_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.conn is not None and self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        parent, child = Pipe()
+        command = [sys.executable, os.path.abspath(__file__), "--fd", str(child.fileno()), "--name", self.name,
+                   "--tasks", ",".join(self.tasks), "--settings", json.dumps(self.settings)]
+        # own session: terminal signals reach the front process only, which stops its workers
+        self.process = subprocess.Popen(command, pass_fds=(child.fileno(),), start_new_session=True)
+        child.close()
+        self.conn = parent
+        self.available = None
+        self.stopping = False
+        self.stats["starts"] += 1
+        threading.Thread(target=self._read_loop, args=(parent,), name=f"{self.name}-reader", daemon=True).start()
+        logger.info("Started %s (pid %d) for %s", self.name, self.process.pid, ", ".join(self.tasks))
+
+    def _read_loop(self, conn: Connection):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._dispatch, message)
+        self._loop.call_soon_threadsafe(self._exited, conn)
+
+    def _dispatch(self, message: tuple):
+        kind = message[0]
+        if kind == "ready":
+            self.available = message[1]
+            missing = [name for name in self.tasks if name not in self.available]
+            if missing:
+                logger.warning("%s could not load %s", self.name, ", ".join(missing))
+        elif kind == "state":
+            self.on_state(message[1])
+        elif message[1] in self.jobs:
+            self.jobs[message[1]].put_nowait(message)
+
+    def _exited(self, conn: Connection):
+        conn.close()
+        failed = [task_id for task_id, job_conn in self.job_conns.items() if job_conn is conn]
+        for task_id in failed:
+            self.jobs[task_id].put_nowait(("exited", task_id))
+        if not self.stopping and (failed or conn is self.conn):
+            logger.warning("%s exited unexpectedly, failing %d running jobs", self.name, len(failed))
+        # a late notice about a process already replaced by start() leaves the new one alone
+        if conn is self.conn:
+            self.conn = None
+            self.on_state({name: "unloaded" for name in self.tasks})
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            if self.conn is None:
+                raise WorkerError("WorkerExited", f"{self.name} is not running")
+            self.conn.send(message)
+
+    def forward(self, task_id: str, change: str):
+        """Pass a cancel, pause or resume of a job on to the worker."""
+        try:
+            self.send((change, task_id))
+        except (OSError, WorkerError):
+            pass
+
+    async def execute(self, task_name: str, task_id: str, request: Dict[str, Any], send_update: Callable,
+                      cancel_token: CancellationToken, profile: bool = False) -> Any:
+        """Run a job in the worker process, relaying its updates, and return its result."""
+        if not self.alive and not self.stopping:
+            self.start()
+        queue: asyncio.Queue = asyncio.Queue()
+        self.jobs[task_id] = queue
+        self.job_conns[task_id] = self.conn
+        try:
+            self.send(("execute", task_id, task_name, marshal(request), profile))
+            if cancel_token.paused:
+                self.forward(task_id, "pause")
+            cancel_token.subscribe(lambda change: self.forward(task_id, change))
+            while True:
+                message = await queue.get()
+                kind = message[0]
+                if kind == "update":
+                    _, _, msg, update, percent, preview = message
+                    await send_update(msg, unmarshal(update), percent=percent, preview=preview)
+                elif kind == "result":
+                    self.stats["executed"] += 1
+                    return unmarshal(message[2])
+                elif kind == "cancelled":
+                    raise TaskCancelled()
+                elif kind == "error":
+                    self.stats["failed"] += 1
+                    raise WorkerError(*message[2:])
+                elif kind == "exited":
+                    self.stats["failed"] += 1
+                    raise WorkerError("WorkerExited", f"{self.name} exited while running the task")
+        finally:
+            self.jobs.pop(task_id, None)
+            self.job_conns.pop(task_id, None)
+
+    async def stop(self, timeout: float = 10.0):
+        self.stopping = True
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self.send(("stop",))
+            await asyncio.wait_for(asyncio.to_thread(self.process.wait), timeout)
+        except (OSError, WorkerError, asyncio.TimeoutError):
+            self.process.kill()
+
+    def report(self) -> Dict:
+        return dict(
+            self.stats,
+            name=self.name,
+            pid=self.process.pid if self.process is not None else None,
+            alive=self.alive,
+            tasks=self.tasks,
+            available=self.available,
+            running=len(self.jobs),
+        )
+
+class Supervisor:
+    """Routes task types to worker processes. Without workers every task runs in the front process."""
+    def __init__(self, on_state: Callable[[Dict[str, str]], None] = lambda states: None):
+        self.workers: List[WorkerProcess] = []
+        self.routes: Dict[str, WorkerProcess] = {}
+        # passed to every worker: budgets, warmup, preload, preview and log settings
+        self.settings: Dict[str, Any] = {}
+        self.on_state = on_state
+
+    def add_worker(self, tasks: List[str]) -> WorkerProcess:
+        worker = WorkerProcess(f"worker-{len(self.workers)}", tasks, self.settings, self.on_state)
+        self.workers.append(worker)
+        for name in tasks:
+            self.routes[name] = worker
+        return worker
+
+    def worker_for(self, task_name: str) -> Optional[WorkerProcess]:
+        return self.routes.get(task_name)
+
+    async def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+    def report(self) -> List[Dict]:
+        return [worker.report() for worker in self.workers]
+
+# --- worker process ---
+
+class WorkerRuntime:
+    """A worker process: runs the jobs the front process sends, with its own residency manager."""
+    def __init__(self, conn: Connection, name: str, tasks: Dict[str, type], settings: Dict[str, Any]):
+        self.conn = conn
+        self.name = name
+        self.tasks = tasks
+        self.settings = settings
+        self.residency = ResidencyManager({"vram": settings.get("vram_budget"), "ram": settings.get("ram_budget")},
+                                          warmup=settings.get("warmup", False))
+        # the front process decides which jobs are profiled
+        self.profiler = Profiler(tasks=set(), use_torch=settings.get("profile_torch", False),
+                                 max_files=settings.get("profile_keep", 100))
+        self.tokens: Dict[str, CancellationToken] = {}
+        self.running: Set[asyncio.Task] = set()
+        self._send_lock = threading.Lock()
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def report_state(self):
+        self.send(("state", {name: self.residency.state(name) for name in self.tasks}))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        threading.Thread(target=self._read_loop, args=(loop,), name="supervisor-reader", daemon=True).start()
+        self.send(("ready", list(self.tasks)))
+        if self.settings.get("preload"):
+            self.residency.preload(self.tasks)
+            loads = list(self.residency.loading.values())
+            if loads:
+                asyncio.gather(*loads, return_exceptions=True).add_done_callback(lambda _: self.report_state())
+        self.report_state()
+        await self.stopped.wait()
+
+    def _read_loop(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            loop.call_soon_threadsafe(self.handle, message)
+        # the front process is gone
+        loop.call_soon_threadsafe(self.stopped.set)
+
+    def handle(self, message: tuple):
+        kind = message[0]
+        if kind == "execute":
+            _, task_id, task_name, request, profile = message
+            self.tokens[task_id] = CancellationToken()
+            job = asyncio.create_task(self.execute(task_id, task_name, request, self.tokens[task_id], profile))
+            self.running.add(job)
+            job.add_done_callback(self.running.discard)
+        elif kind in ("cancel", "pause", "resume"):
+            token = self.tokens.get(message[1])
+            if token is not None:
+                getattr(token, kind)()
+        elif kind == "stop":
+            self.stopped.set()
+
+    async def execute(self, task_id: str, task_name: str, request: Dict[str, Any], cancel_token: CancellationToken, profile: bool):
+        async def send_update(msg: str, update=None, percent: int = 0, preview: bytes = b""):
+            self.send(("update", task_id, msg, marshal(update), percent, preview))
+            return "success"
+
+        try:
+            task_class = self.tasks.get(task_name)
+            if task_class is None:
+                raise LookupError(f"{task_name} is not available in {self.name}")
+            extra = {}
+            if 'cancel_token' in inspect.signature(task_class.execute).parameters:
+                extra['cancel_token'] = cancel_token
+            async with self.residency.use(task_name, task_class):
+                execution = task_class.execute(**unmarshal(request), send_update=send_update, **extra)
+                if profile:
+                    execution = self.profiler.run(task_name, task_id, execution)
+                result = await execution
+            if cancel_token.cancelled:
+                raise TaskCancelled()
+            self.send(("result", task_id, await asyncio.to_thread(marshal, result)))
+        except TaskCancelled:
+            self.send(("cancelled", task_id))
+        except Exception as e:
+            logger.warning("Task %s (%s) failed: %s", task_id, task_name, e, exc_info=True)
+            self.send(("error", task_id, e.__class__.__name__, str(e), traceback.format_exc()))
+        finally:
+            self.tokens.pop(task_id, None)
+            self.report_state()
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker process of server.py's supervisor mode")
+    parser.add_argument("--fd", type=int, required=True, help="File descriptor of the pipe to the front process")
+    parser.add_argument("--name", default="worker", help="Name used in log lines")
+    parser.add_argument("--tasks", required=True, help="Comma separated task names to run")
+    parser.add_argument("--settings", default="{}", help="JSON settings from the front process")
+    args = parser.parse_args()
+
+    settings = json.loads(args.settings)
+    setup_logging(settings.get("log_level") or os.environ.get("TRASK_LOG_LEVEL", "INFO"), prefix=f"[{args.name}] ")
+    from tasks import previews
+    previews.preview_interval = settings.get("preview_interval", previews.preview_interval)
+    previews.preview_budget = settings.get("preview_budget", previews.preview_budget)
+
+    tasks = find_tasks([name for name in args.tasks.split(",") if name])
+    conn = Connection(args.fd)
+    try:
+        asyncio.run(WorkerRuntime(conn, args.name, tasks, settings).run())
+    finally:
+        shutdown_executors(wait=False)
+        conn.close()
+
+if __name__ == "__main__":
+    # through the module, so pickled FileHandle / ProtoValue name `supervisor`, not `__main__`
+    import supervisor
+    supervisor.main()
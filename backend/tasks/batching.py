@@ -0,0 +1,66 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+class MicroBatcher:
+    """
+    Collects requests that arrive close together and runs them as one batch.
+    Requests only share a batch when their keys match (e.g. image size), and a
+    batch starts once `max_batch` requests are waiting or `window` seconds
+    after the oldest one arrived. Batches run one at a time, so requests that
+    arrive while the pipeline is busy pile up into the next batch.
+
+    `run_batch(key, requests)` must return one result per request, in order.
+    """
+    def __init__(self,
+                 run_batch: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+                 max_batch: int = 4,
+                 window: float = 0.05):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.window = window
+        # key -> waiting (request, future) pairs, oldest key first
+        self.pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"requests": 0, "batches": 0, "largest_batch": 0}
+
+    async def submit(self, key: Hashable, request: Any) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(key, []).append((request, future))
+        self.stats["requests"] += 1
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+        return await future
+
+    def _take(self, key: Hashable) -> List[Tuple[Any, asyncio.Future]]:
+        waiting = self.pending.pop(key)
+        batch, rest = waiting[:self.max_batch], waiting[self.max_batch:]
+        if rest:
+            # back of the line, so one busy key cannot starve the others
+            self.pending[key] = rest
+        # callers that were cancelled while waiting drop out
+        return [(request, future) for request, future in batch if not future.done()]
+
+    async def _drain(self):
+        while self.pending:
+            key = next(iter(self.pending))
+            if len(self.pending[key]) < self.max_batch:
+                # give requests queued right behind this one a chance to join
+                await asyncio.sleep(self.window)
+            batch = self._take(key)
+            if not batch:
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            try:
+                results = await self.run_batch(key, [request for request, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Batch of {len(batch)} requests returned {len(results)} results")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
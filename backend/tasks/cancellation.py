@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from typing import Callable, Iterable, List, Optional
+
+class TaskCancelled(Exception):
+    """Raised at a checkpoint of a task whose client cancelled it."""
+
+class CancellationToken:
+    """
+    Handed to a task's execute (as `cancel_token`) so a cancelled or paused
+    job stops at its next checkpoint, e.g. between diffusion steps or
+    generated chunks. Checkpoints are `check()` on worker threads and
+    `await acheck()` on the event loop; both wait while the token is paused
+    and raise TaskCancelled once it is cancelled. Work between checkpoints
+    always runs to completion.
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._listeners: List[Callable[[str], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def subscribe(self, listener: Callable[[str], None]):
+        """Call `listener` with "cancel", "pause" or "resume" on every change, e.g. to forward it to another process."""
+        self._listeners.append(listener)
+
+    def _notify(self, change: str):
+        for listener in self._listeners:
+            listener(change)
+
+    def cancel(self):
+        self._cancelled.set()
+        # a paused job has to wake up to notice
+        self._resumed.set()
+        self._notify("cancel")
+
+    def pause(self):
+        if not self.cancelled:
+            self._resumed.clear()
+            self._notify("pause")
+
+    def resume(self):
+        self._resumed.set()
+        self._notify("resume")
+
+    def check(self):
+        """Checkpoint for blocking code: waits while paused, raises if cancelled."""
+        self._resumed.wait()
+        if self.cancelled:
+            raise TaskCancelled()
+
+    async def acheck(self):
+        """Checkpoint for code on the event loop."""
+        while self.paused:
+            await asyncio.sleep(0.1)
+        if self.cancelled:
+            raise TaskCancelled()
+
+def check_all(tokens: Iterable[Optional[CancellationToken]]):
+    """
+    Checkpoint for work shared by several jobs, e.g. one batched pipeline
+    call: it only waits while every job is paused and only stops once every
+    job is cancelled. A job without a token keeps the work going.
+    """
+    tokens = list(tokens)
+    if not tokens or any(token is None for token in tokens):
+        return
+    if len(tokens) == 1:
+        return tokens[0].check()
+    while all(token.paused for token in tokens):
+        tokens[0]._resumed.wait(0.1)
+    if all(token.cancelled for token in tokens):
+        raise TaskCancelled()
@@ -1,6 +1,9 @@
 from tasks.task import Task
 
 class Capitalize(Task):
+    concurrency = 16
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         
@@ -1,39 +1,137 @@
 import asyncio
+import hashlib
 import os
 import sys
 import uuid
 import base64
 import mimetypes
-from typing import Optional, IO, Any
+from typing import Optional, IO, Any, Iterator
 from contextlib import contextmanager
 from fastapi import WebSocket
 
 import betterproto
 
 sys.path.append(os.path.dirname((os.path.abspath(__file__))))
-from db import add_file_mapping, get_file_path
+from db import add_file_mapping, get_file_path, get_file_hash, set_file_hash, file_dir
+from log import logger
+from tasks.task import get_executor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from proto.py.tasks import File as FileProto # type: ignore
 from proto.py import websocket as wsmsg # type: ignore
 
+# Files are streamed in pieces of this size rather than read whole
+CHUNK_SIZE = 1024 * 1024
+FILES_DIR = file_dir
+TEMP_DIR = os.path.join(FILES_DIR, "tmp")
+os.makedirs(FILES_DIR, exist_ok=True)
+
+def iter_file(path: str, start: int = 0, end: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the bytes of `path` from `start` up to and including `end` (default: end of file)."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def temp_path(name: str) -> str:
+    """
+    Path of a scratch file called `name` in the temp area, for scratch that
+    outlives one call (e.g. a partial upload). Raises ValueError if `name`
+    would lead out of the temp area.
+    """
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    path = os.path.realpath(os.path.join(TEMP_DIR, name))
+    if os.path.dirname(path) != os.path.realpath(TEMP_DIR):
+        raise ValueError(f"Not a plain file name: {name}")
+    return path
+
+@contextmanager
+def temp_file(suffix: str = "") -> Iterator[str]:
+    """
+    Path for a scratch file in the temp area, removed on exit. The storage
+    manager clears whatever a crashed task leaves behind.
+    """
+    path = temp_path(f"{uuid.uuid4()}{suffix}")
+    try:
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def hash_file(path: str) -> str:
+    """Hex SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in iter_file(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def is_content_hash(value: Any) -> bool:
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+def store_content(path: str, filename: str, file_hash: str) -> str:
+    """
+    Move a fully written file into the content-addressed store and return its
+    new path. Files are named by their hash (keeping the extension, which
+    decoders may rely on), so identical content is kept on disk only once and
+    different files can never overwrite each other.
+    """
+    extension = os.path.splitext(os.path.basename(filename))[1].lower()
+    stored_path = os.path.join(FILES_DIR, f"{file_hash}{extension}")
+    if os.path.exists(stored_path):
+        os.remove(path)
+    else:
+        os.replace(path, stored_path)
+    return stored_path
+
 class FileReference:
-    def __init__(self, filename: Optional[str] = None, mode: str = 'r'):
+    """
+    Handle on a file in the files directory.
+
+    `FileReference(filename)` makes a new output file; it gets an id but is
+    only recorded in the file mapping once it is handed to a client (see
+    `register`), so intermediate files never reach the database.
+    `FileReference.existing` wraps a file that is already stored under an id,
+    e.g. an upload, without registering it again.
+    """
+    __slots__ = ("id", "filename", "mode", "file_path", "_file_object", "_hash", "_registered")
+
+    def __init__(self, filename: Optional[str] = None, mode: str = 'r', file_hash: Optional[str] = None):
         self.id = str(uuid.uuid4())
         self.filename = filename or f"{self.id}.bin"
         self.mode = mode
-        self.files_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "files"))
-        os.makedirs(self.files_dir, exist_ok=True)
-        self.file_path = os.path.join(self.files_dir, self.filename)
+        self.file_path = os.path.join(FILES_DIR, self.filename)
         self._file_object: Optional[IO[Any]] = None
+        self._hash = file_hash
+        self._registered = False
 
-        # Add the file mapping to the database
-        add_file_mapping(self.id, self.file_path)
+    @classmethod
+    def existing(cls, file_id: str, file_path: str, file_hash: Optional[str] = None, registered: bool = True) -> "FileReference":
+        """Handle on a file already stored under `file_id`, or with `registered=False` on an output not handed out yet."""
+        file = cls.__new__(cls)
+        file.id = file_id
+        file.filename = os.path.basename(file_path)
+        file.mode = 'r'
+        file.file_path = file_path
+        file._file_object = None
+        file._hash = file_hash
+        file._registered = registered
+        return file
 
     @classmethod
     def from_id(cls, file_id: str):
-        file_path = get_file_path(file_id)
-        return cls(filename=os.path.basename(file_path))
+        return cls.existing(file_id, get_file_path(file_id))
+
+    def register(self):
+        """Record the file in the file mapping so clients can fetch it by id."""
+        if not self._registered:
+            add_file_mapping(self.id, self.file_path, self.hash)
+            self._registered = True
 
     @contextmanager
     def open(self, mode: Optional[str] = None):
@@ -64,9 +162,18 @@ class FileReference:
         with self.open('rb') as f:
             return f.read(*args, **kwargs)
 
+    def iter_chunks(self, offset: int = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        return iter_file(self.file_path, offset, chunk_size=chunk_size)
+
     def write(self, content, *args, **kwargs):
+        self._hash = None
         with self.open('wb') as f:
-            return f.write(content, *args, **kwargs)
+            written = f.write(content, *args, **kwargs)
+        if self._registered:
+            # the recorded hash describes the old content
+            self._hash = hash_file(self.file_path)
+            set_file_hash(self.id, self._hash)
+        return written
 
     def to_dict(self):
         return {
@@ -76,23 +183,48 @@ class FileReference:
         }
 
     def to_proto(self):
+        self.register()
         return FileProto(
             type="file_reference",
             id=self.id,
             name=self.filename,
-            size=os.path.getsize(self.file_path),
-            hash="hash"  # Note: implement real hashing if needed
+            size=self.size,
+            hash=self.hash
         )
 
     @property
     def path(self):
         return self.file_path
+
+    @property
+    def registered(self) -> bool:
+        return self._registered
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.file_path)
+
+    @property
+    def hash(self) -> str:
+        """Hex SHA-256 of the content, computed once the file is complete and recorded in the db."""
+        if self._hash is None and self._registered:
+            self._hash = get_file_hash(self.id)
+        if self._hash is None:
+            self._hash = hash_file(self.file_path)
+            if self._registered:
+                set_file_hash(self.id, self._hash)
+        return self._hash
     
     def to_base64(self):
         with self.open('rb') as f:
             return base64.b64encode(f.read()).decode("utf-8")
         
     async def notify_client(self, websocket: WebSocket):
+        if self._hash is None and not self._registered:
+            # registering records the hash; reading a large output must not hold up the event loop
+            self._hash = await asyncio.get_running_loop().run_in_executor(get_executor(), hash_file, self.file_path)
+        # the client may fetch the file as soon as it hears about it
+        self.register()
         file_send_message = wsmsg.ServerMessage(
             file_send=wsmsg.FileSend(
                 file_id=self.id,
@@ -100,4 +232,4 @@ class FileReference:
             )
         )
         await websocket.send_bytes(bytes(file_send_message))
-        print(f"Notified client about file: {self.filename}")
+        logger.debug("Notified client about file: %s", self.filename)
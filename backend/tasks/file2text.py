@@ -3,12 +3,16 @@ from functools import wraps
 from tasks.openai_client import client
 from tasks.task import Task
 from tasks.file import FileReference
+from log import logger
 
 def noop(*args, **kwargs):
     print("Noop called", args, kwargs)
     pass
 
 class File2Text(Task):
+    concurrency = 16
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         self.add_task(self.execute, "File2Text", exclude_params=["client", "send_update"])
@@ -30,7 +34,7 @@ class File2Text(Task):
         client = client,
         send_update: Callable[[str], Awaitable[None]] = noop
     ) -> str:
-        print(f"File2Text: {file}")
+        logger.debug("File2Text: %s", file)
         
         # open file at path
         with open(file.file_path, 'rb') as f:
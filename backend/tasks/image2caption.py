@@ -1,17 +1,20 @@
 from typing import Callable, Awaitable
 from tasks.task import Task
 from tasks.file import FileReference
+from log import logger
 from tasks.openai_client import client
 import base64
 from PIL import Image
 import io
-import os
 
 def noop(*args, **kwargs):
     print("Noop called", args, kwargs)
     pass
 
 class Image2Caption(Task):
+    concurrency = 16
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         self.add_task(self.execute, "Image2Caption", exclude_params=["client", "send_update"])
@@ -27,8 +30,8 @@ class Image2Caption(Task):
         pass
 
     @staticmethod
-    def compress_image(image_path: str, max_size_kb: int = 500) -> str:
-        """Compress the image to ensure it's under the specified size."""
+    def compress_image(image_path: str, max_size_kb: int = 500) -> bytes:
+        """Compress the image to JPEG data under the specified size."""
         with Image.open(image_path) as img:
             # Convert to RGB if it's not
             if img.mode != 'RGB':
@@ -45,12 +48,8 @@ class Image2Caption(Task):
                     break
                 quality -= 5
 
-            # Save the compressed image
-            compressed_path = f"{os.path.splitext(image_path)[0]}_compressed.jpg"
-            with open(compressed_path, 'wb') as f:
-                f.write(output.getvalue())
-            
-            return compressed_path
+            # only ever sent inline, so it never needs to touch the disk
+            return output.getvalue()
 
     @classmethod
     async def execute(cls,
@@ -69,21 +68,18 @@ class Image2Caption(Task):
         :param send_update: Function to send incremental updates (excluded from protobuf)
         :return: Generated caption for the image
         """
-        print(f"Image2Caption: Processing {image.filename}")
+        logger.debug("Image2Caption: processing %s", image.filename)
 
-        # Compress the image
-        compressed_image_path = cls.compress_image(image.file_path)
-        
-        # Read the compressed image file and encode it to base64
-        with open(compressed_image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        # Compress the image and encode it to base64
+        compressed_image = await cls.run_blocking(cls.compress_image, image.file_path)
+        base64_image = base64.b64encode(compressed_image).decode('utf-8')
 
         # await send_update("Generating caption for the compressed image")
         system_prompt = "Please provide a detailed caption for this image. Do not provide any surrounding context. Only return a caption for the image."
         if focus:
             system_prompt += f" Pay particular attention to {focus}."
 
-        response = client.chat.completions.create(
+        response = await client.chat(
             model="gpt-4-vision-preview",
             messages=[
                 {
@@ -105,9 +101,6 @@ class Image2Caption(Task):
             max_tokens=tokens
         )
 
-        # Clean up the compressed image file
-        os.remove(compressed_image_path)
-
         if not response.choices[0].message.content:
             return "ERROR: No caption generated for the image."
         else:
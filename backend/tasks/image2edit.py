@@ -1,10 +1,12 @@
-from tasks.task import Task
+from tasks.task import Task, blocking
 from tasks.file import FileReference
+from tasks.previews import StepProgress, sdxl_preview, step_callback
+from tasks.cancellation import CancellationToken
 from random import randint
 import io
 import torch
 from PIL import Image
-from typing import Any
+from typing import Any, Optional
 from diffusers import AutoPipelineForImage2Image, DDPMScheduler
 from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_img2img import retrieve_timesteps
 from diffusers.schedulers.scheduling_ddim import DDIMSchedulerOutput
@@ -13,6 +15,11 @@ from functools import partial
 # https://betterze.github.io/TurboEdit/ -- thank you!
 # https://huggingface.co/spaces/turboedit/turbo_edit/tree/main
 class TurboEdit(Task):
+    vram_mb = 7000
+    ram_mb = 2000
+    load_seconds = 20
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         self.pipeline = None
@@ -33,6 +40,12 @@ class TurboEdit(Task):
         print("Unloading TurboEdit model...")
         self.pipeline = None
 
+    @classmethod
+    def warmup(self):
+        # encoding a blank image exercises the VAE, the rest of the pipeline is rebuilt per call
+        with torch.no_grad():
+            self.encode_image(Image.new("RGB", (512, 512)), self.pipeline)
+
     @staticmethod
     def encode_image(image, pipe):
         image = pipe.image_processor.preprocess(image)
@@ -164,11 +177,26 @@ class TurboEdit(Task):
                       tgt_prompt: str,
                       seed: int = 7865,
                       w1: float = 1.5,
-                      send_update: Any = None
+                      send_update: Any = None,
+                      cancel_token: Optional[CancellationToken] = None
                       ) -> FileReference:
         if self.pipeline is None:
             raise Exception("Model not loaded")
 
+        # only the last of the three latents in the batch is the edited image
+        progress = StepProgress(send_update, 4, preview=sdxl_preview, cancel_token=cancel_token)
+        return await self.edit(input_image, src_prompt, tgt_prompt, seed, w1, progress)
+
+    @classmethod
+    @blocking
+    def edit(self,
+             input_image: FileReference,
+             src_prompt: str,
+             tgt_prompt: str,
+             seed: int,
+             w1: float,
+             progress: StepProgress
+             ) -> FileReference:
         device = "cuda" if torch.cuda.is_available() else "cpu"
         generator = torch.Generator(device).manual_seed(seed)
 
@@ -224,7 +252,9 @@ class TurboEdit(Task):
             guidance_scale=0,
             generator=generator,
             denoising_start=denoising_start,
-            strength=0
+            strength=0,
+            callback_on_step_end=step_callback([None, None, progress]),
+            callback_on_step_end_tensor_inputs=["latents"],
         ).images[2]
 
         # Create a File object with a unique filename
@@ -1,2 +1,142 @@
-from openai import OpenAI
-client = OpenAI()
\ No newline at end of file
+import asyncio
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+
+from log import logger
+
+MAX_CONCURRENCY = int(os.environ.get("TRASK_OPENAI_CONCURRENCY", 32))
+MAX_RETRIES = int(os.environ.get("TRASK_OPENAI_RETRIES", 4))
+
+class PooledClient:
+    """
+    Async OpenAI client shared by every task on the worker. Requests go through
+    one pooled HTTP connection pool with bounded concurrency, are retried with
+    exponential backoff on 429/5xx/connection errors, and identical requests
+    that are already in flight share a single upstream call.
+    """
+    def __init__(self,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 timeout: float = 60.0,
+                 **client_kwargs: Any):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.client_kwargs = client_kwargs
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "coalesced": 0, "retries": 0, "failures": 0}
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # created on first use so importing a task does not require credentials
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                timeout=self.timeout,
+            )
+            # retries are handled here, not by the SDK, so they respect our concurrency limit
+            self._client = AsyncOpenAI(max_retries=0, http_client=http_client, **self.client_kwargs)
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def chat(self, **request: Any):
+        """Same arguments as `chat.completions.create`, returns the ChatCompletion."""
+        key = json.dumps(request, sort_keys=True, default=str)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        def forget(done: asyncio.Task):
+            if self._inflight.get(key) is done:
+                del self._inflight[key]
+
+        task = asyncio.create_task(self._create_with_retry(request))
+        self._inflight[key] = task
+        task.add_done_callback(forget)
+        # shielded so one cancelled caller does not cancel the call for the others sharing it
+        return await asyncio.shield(task)
+
+    def _should_retry(self, error: Exception) -> bool:
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, APIConnectionError)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _create_with_retry(self, request: Dict[str, Any]):
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    self.stats["requests"] += 1
+                    return await self.client.chat.completions.create(**request)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._should_retry(e):
+                    self.stats["failures"] += 1
+                    raise
+                delay = self._backoff(attempt, e)
+                logger.warning("OpenAI request failed (%s), retrying in %.2fs", e.__class__.__name__, delay)
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def stream_chat(self, **request: Any) -> AsyncIterator[str]:
+        """
+        Same arguments as `chat.completions.create`, yields the content of the
+        completion piece by piece as it arrives. Failures before the first
+        piece are retried like `chat`; later ones are raised, since the caller
+        has already seen part of the answer. Streams are never shared.
+        """
+        attempt = 0
+        async with self.semaphore:
+            while True:
+                started = False
+                try:
+                    self.stats["requests"] += 1
+                    stream = await self.client.chat.completions.create(stream=True, **request)
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            started = True
+                            yield chunk.choices[0].delta.content
+                    return
+                except Exception as e:
+                    if started or attempt >= self.max_retries or not self._should_retry(e):
+                        self.stats["failures"] += 1
+                        raise
+                    delay = self._backoff(attempt, e)
+                    logger.warning("OpenAI stream failed (%s), retrying in %.2fs", e.__class__.__name__, delay)
+                    self.stats["retries"] += 1
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+client = PooledClient()
@@ -0,0 +1,149 @@
+import asyncio
+import io
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+from tasks.cancellation import CancellationToken, check_all
+
+# Seconds between latent previews sent for one request (0 disables them), and the
+# most of a request's elapsed time that rendering previews may take.
+preview_interval = float(os.environ.get("TRASK_PREVIEW_INTERVAL", 0.5))
+preview_budget = float(os.environ.get("TRASK_PREVIEW_BUDGET", 0.05))
+# Progress-only updates are cheap, but a 100 step audio run should not send 100 messages
+PROGRESS_INTERVAL = 0.1
+
+# Linear latent -> RGB approximations, good enough for a thumbnail and far
+# cheaper than running the VAE decoder (factors as used by ComfyUI's previews).
+SDXL_LATENT_RGB = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_BIAS = [0.1084, -0.0175, -0.0011]
+FLUX_LATENT_RGB = [
+    [-0.0346, 0.0244, 0.0681],
+    [0.0034, 0.0210, 0.0687],
+    [0.0275, -0.0668, -0.0433],
+    [-0.0174, 0.0160, 0.0617],
+    [0.0859, 0.0721, 0.0329],
+    [0.0004, 0.0383, 0.0115],
+    [0.0405, 0.0861, 0.0915],
+    [-0.0236, -0.0185, -0.0259],
+    [-0.0245, 0.0250, 0.1180],
+    [0.1008, 0.0755, -0.0421],
+    [-0.0515, 0.0201, 0.0011],
+    [0.0428, -0.0012, -0.0036],
+    [0.0817, 0.0765, 0.0749],
+    [-0.1264, -0.0522, -0.1103],
+    [-0.0280, -0.0881, -0.0499],
+    [-0.1262, -0.0982, -0.0778],
+]
+FLUX_LATENT_BIAS = [-0.0329, -0.0718, -0.0851]
+
+def latent_preview(latent: Any, factors: List[List[float]], bias: List[float], max_size: int = 256) -> bytes:
+    """JPEG thumbnail of one (channels, height, width) latent, without the VAE."""
+    import torch
+    from PIL import Image
+
+    with torch.no_grad():
+        weights = torch.tensor(factors, dtype=torch.float32, device=latent.device)
+        offset = torch.tensor(bias, dtype=torch.float32, device=latent.device)
+        rgb = torch.einsum("chw,cr->hwr", latent.float(), weights) + offset
+        pixels = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().cpu().numpy()
+    image = Image.fromarray(pixels)
+    image.thumbnail((max_size, max_size))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=70)
+    return output.getvalue()
+
+def sdxl_preview(latent: Any) -> bytes:
+    return latent_preview(latent, SDXL_LATENT_RGB, SDXL_LATENT_BIAS)
+
+def flux_preview(width: int, height: int) -> Callable[[Any], bytes]:
+    """Preview for FLUX, whose pipeline keeps latents packed as (tokens, 64) per image."""
+    def preview(packed: Any) -> bytes:
+        rows, columns = height // 16, width // 16
+        channels = packed.shape[-1] // 4
+        latent = packed.view(rows, columns, channels, 2, 2).permute(2, 0, 3, 1, 4).reshape(channels, rows * 2, columns * 2)
+        return latent_preview(latent, FLUX_LATENT_RGB, FLUX_LATENT_BIAS)
+    return preview
+
+class StepProgress:
+    """
+    Reports the steps of a blocking pipeline run to the client through the
+    task's send_update, from whichever thread the pipeline runs on. Progress
+    goes out at most every PROGRESS_INTERVAL seconds. With a `preview`
+    function (latent -> JPEG bytes) a preview is added every
+    `preview_interval` seconds, as long as previews have taken no more than
+    `preview_budget` of the time so far. Without send_update it does nothing.
+    The step callbacks below also use it to carry the job's cancellation token.
+    """
+    def __init__(self,
+                 send_update: Optional[Callable[..., Awaitable[Any]]],
+                 total_steps: int,
+                 preview: Optional[Callable[[Any], bytes]] = None,
+                 cancel_token: Optional[CancellationToken] = None):
+        self.send_update = send_update
+        self.cancel_token = cancel_token
+        self.loop = asyncio.get_running_loop() if send_update else None
+        self.total_steps = max(1, total_steps)
+        self.preview = preview if preview_interval > 0 else None
+        self.started = time.perf_counter()
+        self.last_sent = 0.0
+        self.last_preview = self.started
+        self.preview_seconds = 0.0
+        self.previews = 0
+
+    def step(self, step: int, latent: Optional[Callable[[], Any]] = None):
+        """Report that step `step` (0-based) is done, `latent` gives its latent if a preview is wanted."""
+        if self.send_update is None or (self.cancel_token is not None and self.cancel_token.cancelled):
+            return
+        now = time.perf_counter()
+        done = min(step + 1, self.total_steps)
+        last = done == self.total_steps
+        data = b""
+        # the last step is followed by the real result
+        if (self.preview is not None and latent is not None and not last
+                and now - self.last_preview >= preview_interval
+                and self.preview_seconds <= preview_budget * (now - self.started)):
+            data = self.preview(latent())
+            self.last_preview = time.perf_counter()
+            self.preview_seconds += self.last_preview - now
+            self.previews += 1
+        if not data and not last and now - self.last_sent < PROGRESS_INTERVAL:
+            return
+        self.last_sent = now
+        percent = done * 100 // self.total_steps
+        asyncio.run_coroutine_threadsafe(
+            self.send_update(f"Step {done}/{self.total_steps}", percent=percent, preview=data),
+            self.loop,
+        )
+
+def step_callback(progresses: Sequence[Optional[StepProgress]]) -> Callable:
+    """
+    A diffusers `callback_on_step_end` that reports to one StepProgress per
+    image of the batch (None for images nobody watches), and is the
+    cancellation checkpoint between steps. Pass
+    callback_on_step_end_tensor_inputs=["latents"] along with it.
+    """
+    def callback(pipe, step: int, timestep: Any, callback_kwargs: dict) -> dict:
+        check_all(progress.cancel_token for progress in progresses if progress is not None)
+        latents = callback_kwargs.get("latents")
+        total_steps = getattr(pipe, "num_timesteps", None)
+        for index, progress in enumerate(progresses):
+            if progress is None:
+                continue
+            if total_steps:
+                progress.total_steps = total_steps
+            progress.step(step, None if latents is None else lambda index=index: latents[index])
+        return callback_kwargs
+    return callback
+
+def legacy_step_callback(progress: StepProgress) -> Callable:
+    """The same for pipelines with the older `callback(step, timestep, latents)` hook, without previews."""
+    def callback(step: int, timestep: Any, latents: Any):
+        check_all([progress.cancel_token])
+        progress.step(step)
+    return callback
@@ -0,0 +1,86 @@
+import asyncio
+import inspect
+from typing import Any, Callable, List, Optional
+
+# IncrementalUpdate.msg of updates whose result is the next piece of a streamed text result
+STREAM_MESSAGE = "stream"
+
+class TokenCoalescer:
+    """
+    Forwards generated text to the client through a task's send_update,
+    coalescing tokens into chunks: the first piece goes out at once (it is
+    what time-to-first-token measures), later ones once `max_chars` have
+    piled up or `max_delay` seconds after the oldest unsent piece. Each update
+    carries only the new text; the task result still carries all of it.
+
+    Create it on the event loop; generation running on another thread feeds
+    it through `push_threadsafe`.
+    """
+    def __init__(self, send_update: Optional[Callable[..., Any]], max_chars: int = 32, max_delay: float = 0.05):
+        self.send_update = send_update
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.loop = asyncio.get_running_loop()
+        self.parts: List[str] = []
+        self.buffer: List[str] = []
+        self.buffered = 0
+        self.sent = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.sending: Optional[asyncio.Task] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def push(self, text: str):
+        if not text:
+            return
+        self.parts.append(text)
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.sent == 0 or self.buffered >= self.max_chars:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.max_delay, self.flush)
+
+    def push_threadsafe(self, text: str):
+        self.loop.call_soon_threadsafe(self.push, text)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.buffer:
+            return
+        chunk = "".join(self.buffer)
+        self.buffer.clear()
+        self.buffered = 0
+        self.sent += 1
+        # chained so chunks reach the client in order
+        self.sending = self.loop.create_task(self._send(chunk, self.sending))
+
+    async def _send(self, chunk: str, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await previous
+        if self.send_update is None:
+            return
+        result = self.send_update(STREAM_MESSAGE, chunk)
+        if inspect.isawaitable(result):
+            await result
+
+    async def close(self) -> str:
+        """Send what is left and return the whole text."""
+        # pieces pushed from other threads may still be queued on the loop
+        await asyncio.sleep(0)
+        self.flush()
+        if self.sending is not None:
+            await self.sending
+        return self.text
+
+    def discard(self):
+        """Stop sending, e.g. once the task was cancelled and the client is not waiting for more."""
+        self.send_update = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.buffer.clear()
@@ -1,14 +1,120 @@
 from abc import ABC, abstractmethod
 from typing import Any, Callable, Awaitable, Dict, List
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import contextvars
+import functools
+import importlib
 import inspect
+import os
+import sys
+
+from tasks.batching import MicroBatcher
+from log import logger
+from profiling import current as current_profile
 
 def noop(*args, **kwargs):
     print("Noop called", args, kwargs)
 
+# Executors for blocking work, created on first use and shared by every task.
+# "thread" is the default since pipelines live in this process; "process" only
+# suits picklable, self-contained functions (e.g. pure CPU image work).
+BLOCKING_WORKERS = int(os.environ.get("TRASK_BLOCKING_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+_executors: Dict[str, Executor] = {}
+# One micro-batcher per task class that uses Task.batched()
+_batchers: Dict[type, MicroBatcher] = {}
+
+def get_executor(kind: str = "thread") -> Executor:
+    if kind not in _executors:
+        if kind == "thread":
+            _executors[kind] = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="trask-blocking")
+        elif kind == "process":
+            _executors[kind] = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+    return _executors[kind]
+
+def shutdown_executors(wait: bool = True):
+    for executor in _executors.values():
+        executor.shutdown(wait=wait, cancel_futures=True)
+    _executors.clear()
+
+def blocking(func: Callable) -> Callable[..., Awaitable]:
+    """
+    Declare a synchronous task method as blocking. Calling it returns an
+    awaitable that runs the body on the task's executor instead of the event loop.
+    Stack it under @classmethod:
+
+        @classmethod
+        @blocking
+        def generate(cls, prompt): ...
+    """
+    @functools.wraps(func)
+    async def wrapper(cls, *args, **kwargs):
+        return await cls.run_blocking(func, cls, *args, **kwargs)
+    return wrapper
+
 class Task(ABC):
+    # How many executions of this task may run at once on a worker.
+    # GPU pipelines should stay at 1; I/O bound tasks can go much higher.
+    concurrency: int = 1
+    # Which executor run_blocking / @blocking use, see get_executor.
+    blocking_executor: str = "thread"
+    # Approximate memory held while the task is loaded, in MB. Used by the
+    # residency manager to keep models within the worker's memory budget.
+    vram_mb: float = 0
+    ram_mb: float = 0
+    # Rough load() time in seconds, used by the scheduler until a load has been observed.
+    load_seconds: float = 0
+    # With max_batch > 1, concurrent executions that call batched() with the same
+    # key are collected for up to batch_window seconds and run through one
+    # run_batch() call. concurrency should be at least max_batch for this to help.
+    max_batch: int = 1
+    batch_window: float = 0.05
+    # Whether identical requests give identical results, so the server may answer
+    # repeats from its result cache. See is_cacheable for per-request exceptions.
+    cacheable: bool = False
+
     def __init__(self):
         self._proto_info: Dict[str, Dict[str, Any]] = {}
 
+    @classmethod
+    async def run_blocking(cls, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking callable (model inference, image encoding, ...) without freezing the event loop."""
+        loop = asyncio.get_running_loop()
+        if cls.blocking_executor == "process":
+            call = functools.partial(func, *args, **kwargs)
+        else:
+            # keep context variables visible inside the worker thread
+            invocation = current_profile()
+            if invocation is not None:
+                args, func = (func, *args), invocation.call
+            call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await loop.run_in_executor(get_executor(cls.blocking_executor), call)
+
+    @classmethod
+    async def batched(cls, key: Any, request: Any) -> Any:
+        """Queue `request` for the next run_batch() call with matching `key` and return its result."""
+        if cls not in _batchers:
+            _batchers[cls] = MicroBatcher(cls.run_batch, cls.max_batch, cls.batch_window)
+        return await _batchers[cls].submit(key, request)
+
+    @classmethod
+    async def run_batch(cls, key: Any, requests: List[Any]) -> List[Any]:
+        """Run a batch of requests sharing `key`, returning one result per request."""
+        raise NotImplementedError(f"{cls.__name__} does not support batching")
+
+    @classmethod
+    def is_cacheable(cls, request: Dict[str, Any]) -> bool:
+        """
+        Whether this request's result may be cached. A seed of 0 asks for a
+        random seed, so it never is; to_dict() leaves default fields out, so a
+        task taking a seed gets 0 when the request has none.
+        """
+        if 'seed' in inspect.signature(cls.execute).parameters:
+            return cls.cacheable and request.get("seed", 0) != 0
+        return cls.cacheable
+
     @classmethod
     @abstractmethod
     def load(cls) -> None:
@@ -27,9 +133,15 @@ class Task(ABC):
         """Execute the task."""
         pass
 
+    @classmethod
+    def warmup(cls) -> None:
+        """Optionally run a tiny inference after load() so lazy kernel/compile work is done before the first job. Runs on an executor thread."""
+        pass
+
     def add_task(self, func: Callable, task_name: str, exclude_params: List[str] = []):
-        if 'send_update' not in exclude_params:
-            exclude_params.append('send_update')
+        for param in ('send_update', 'cancel_token'):
+            if param not in exclude_params:
+                exclude_params.append(param)
         
         sig = inspect.signature(func)
         params_info = {}
@@ -49,11 +161,31 @@ class Task(ABC):
             'exclude_params': exclude_params
         }
         
-        print(f"Added task: {task_name} for {self.__class__.__name__}")
+        logger.debug("Added task: %s for %s", task_name, self.__class__.__name__)
 
     def get_proto_info(self):
         return self._proto_info
         
+def find_tasks(task_names: List[str] = []) -> Dict[str, type]:
+    """Task classes defined in the modules of the tasks directory by class name, only `task_names` if given."""
+    tasks_dir = os.path.dirname(os.path.abspath(__file__))
+    if tasks_dir not in sys.path:
+        sys.path.append(tasks_dir)
+    found: Dict[str, type] = {}
+    for filename in os.listdir(tasks_dir):
+        if filename.endswith('.py') and filename != '__init__.py':
+            module_name = filename[:-3]
+            try:
+                module = importlib.import_module(module_name)
+            except Exception as e:
+                logger.warning("Error loading task %s: %s", module_name, e)
+                continue
+            for name, obj in module.__dict__.items():
+                if isinstance(obj, type) and issubclass(obj, Task) and obj != Task:
+                    if not task_names or name in task_names:
+                        found[name] = obj
+    return found
+
 # Example usage:
 # class MyTask(Task):
 #     def __init__(self):
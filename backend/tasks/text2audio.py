@@ -3,12 +3,19 @@ import soundfile as sf
 from diffusers import StableAudioPipeline
 from io import BytesIO
 from random import randint
-from typing import Any
-from tasks.task import Task
+from typing import Any, Optional
+from tasks.task import Task, blocking
 from tasks.file import FileReference
+from tasks.previews import StepProgress, legacy_step_callback
+from tasks.cancellation import CancellationToken
 from uuid import uuid4
 
 class Text2Audio(Task):
+    vram_mb = 4500
+    ram_mb = 2000
+    load_seconds = 30
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         self.pipe = None
@@ -25,6 +32,10 @@ class Text2Audio(Task):
         print("Unloading Text2Audio model...")
         self.pipe = None
 
+    @classmethod
+    def warmup(self):
+        self.pipe("warmup", num_inference_steps=2, audio_end_in_s=1.0)
+
     @classmethod
     async def execute(self,
                       prompt: str,
@@ -33,7 +44,8 @@ class Text2Audio(Task):
                       num_inference_steps: int = 100,
                       num_waveforms: int = 1,
                       seed: int = 0,
-                      send_update: Any = None
+                      send_update: Any = None,
+                      cancel_token: Optional[CancellationToken] = None
                       ) -> FileReference:
         """
         Generate audio from a text prompt using the Stable Audio model.
@@ -45,26 +57,41 @@ class Text2Audio(Task):
         num_waveforms (int, optional): Number of waveforms to generate. Defaults to 1.
         seed (int, optional): Seed for the random generator. If None, a random seed will be used.
         send_update (callable, optional): A function to send progress updates. Defaults to None.
+        cancel_token (CancellationToken, optional): Stops generation between steps once cancelled.
         Returns:
         File: File object containing the generated audio in WAV format.
         """
         if self.pipe is None:
             raise Exception("Model not loaded")
 
-        # if send_update:
-        #     await send_update("Generating audio...")
-
-        generator = torch.Generator("cuda" if torch.cuda.is_available() else "cpu")
         if seed == 0:
             seed = randint(0, 2**32 - 1)
 
+        # audio latents have no cheap preview, so only progress is reported
+        progress = StepProgress(send_update, num_inference_steps, cancel_token=cancel_token)
+        return await self.generate(prompt, negative_prompt, duration, num_inference_steps, num_waveforms, seed, progress)
+
+    @classmethod
+    @blocking
+    def generate(self,
+                 prompt: str,
+                 negative_prompt: str,
+                 duration: float,
+                 num_inference_steps: int,
+                 num_waveforms: int,
+                 seed: int,
+                 progress: StepProgress
+                 ) -> FileReference:
+        generator = torch.Generator("cuda" if torch.cuda.is_available() else "cpu")
+
         audio = self.pipe(
             prompt,
             negative_prompt=negative_prompt,
             num_inference_steps=num_inference_steps,
             audio_end_in_s=duration,
             num_waveforms_per_prompt=num_waveforms,
-            generator=generator.manual_seed(seed)
+            generator=generator.manual_seed(seed),
+            callback=legacy_step_callback(progress),
         ).audios
 
         output = audio[0].T.float().cpu().numpy()
@@ -80,7 +107,4 @@ class Text2Audio(Task):
         # Write the audio data to the file
         file.write(buffer.getvalue())
 
-        # if send_update:
-        #     await send_update(f"Audio created and saved as {file.filename}")
-
         return file
\ No newline at end of file
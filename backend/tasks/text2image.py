@@ -1,5 +1,7 @@
-from tasks.task import Task
+from tasks.task import Task, blocking
 from tasks.file import FileReference
+from tasks.previews import StepProgress, flux_preview, step_callback
+from tasks.cancellation import CancellationToken
 from random import randint
 import io
 import torch
@@ -7,11 +9,21 @@ from diffusers import FluxPipeline, StableDiffusionXLPipeline, UNet2DConditionMo
 from huggingface_hub import hf_hub_download
 from safetensors.torch import load_file
 from PIL import Image
-from typing import Any
+from typing import Any, List, Optional, Tuple
 from uuid import uuid4
 from sd_embed.embedding_funcs import get_weighted_text_embeddings_flux1, get_weighted_text_embeddings_sdxl
 
 class Text2Image(Task):
+    # sequential CPU offload keeps most of FLUX in system RAM
+    vram_mb = 4000
+    ram_mb = 34000
+    load_seconds = 60
+    cacheable = True
+    # FLUX takes batched embeddings: requests of the same size share one pipeline call
+    concurrency = 2
+    max_batch = 2
+    steps = 2
+
     def __init__(self):
         super().__init__()
         self.pipe = None
@@ -29,13 +41,18 @@ class Text2Image(Task):
         print("Unloading Text2Image model...")
         self.pipe = None
 
+    @classmethod
+    def warmup(self):
+        self.pipe("warmup", guidance_scale=0.0, num_inference_steps=1, max_sequence_length=256, height=256, width=256)
+
     @classmethod
     async def execute(self,
                       prompt: str,
                       negative_prompt: str = "",
                       size: str = "1024x1024",
                       seed: int = 0,
-                      send_update: Any = None
+                      send_update: Any = None,
+                      cancel_token: Optional[CancellationToken] = None
                       ) -> FileReference:
         if self.pipe is None:
             raise Exception("Model not loaded")
@@ -43,32 +60,63 @@ class Text2Image(Task):
         if seed == 0:
             seed = randint(0, 2**32 - 1)
         
-        steps = 2
         width, height = map(int, size.split("x"))
-        generator = torch.Generator("cuda" if torch.cuda.is_available() else "cpu")
+        progress = StepProgress(send_update, self.steps, preview=flux_preview(width, height), cancel_token=cancel_token)
+
+        return await self.batched((width, height), (prompt, negative_prompt, seed, progress))
+
+    @classmethod
+    @blocking
+    def run_batch(self, size: Tuple[int, int], requests: List[Tuple[str, str, int, StepProgress]]) -> List[FileReference]:
+        width, height = size
+        device = "cuda" if torch.cuda.is_available() else "cpu"
 
         # Generate long prompt embeddings
-        prompt_embeds, pooled_prompt_embeds = get_weighted_text_embeddings_flux1(
-            pipe=self.pipe,
-            prompt=prompt,
-            neg_prompt=negative_prompt
-        )
+        embeddings = [
+            get_weighted_text_embeddings_flux1(pipe=self.pipe, prompt=prompt, neg_prompt=negative_prompt)
+            for prompt, negative_prompt, _, _ in requests
+        ]
+        seeds = [seed for _, _, seed, _ in requests]
+        progresses = [progress for _, _, _, progress in requests]
 
-        image = self.pipe(
+        # long prompts can give longer embeddings, which cannot be stacked into one batch
+        if len({prompt_embeds.shape for prompt_embeds, _ in embeddings}) == 1:
+            images = self.generate(
+                torch.cat([prompt_embeds for prompt_embeds, _ in embeddings]),
+                torch.cat([pooled for _, pooled in embeddings]),
+                width, height, seeds, progresses, device,
+            )
+        else:
+            images = [
+                self.generate(prompt_embeds, pooled, width, height, [seed], [progress], device)[0]
+                for (prompt_embeds, pooled), seed, progress in zip(embeddings, seeds, progresses)
+            ]
+
+        files = []
+        for image in images:
+            file = FileReference(f"text2image_{uuid4()}.png")
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='PNG')
+            img_byte_arr.seek(0)
+            file.write(img_byte_arr.getvalue())
+            files.append(file)
+
+        return files
+
+    @classmethod
+    def generate(self, prompt_embeds, pooled_prompt_embeds, width: int, height: int, seeds: List[int],
+                 progresses: List[StepProgress], device: str) -> List[Image.Image]:
+        # one generator per image so every request keeps its own seed
+        generators = [torch.Generator(device).manual_seed(seed) for seed in seeds]
+        return self.pipe(
             prompt_embeds=prompt_embeds,
             pooled_prompt_embeds=pooled_prompt_embeds,
             guidance_scale=2.0,
-            num_inference_steps=steps,
+            num_inference_steps=self.steps,
             max_sequence_length=256,
             height=height,
             width=width,
-            generator=generator.manual_seed(seed),
-        ).images[0]
-
-        file = FileReference(f"text2image_{uuid4()}.png")
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        file.write(img_byte_arr.getvalue())
-
-        return file
\ No newline at end of file
+            generator=generators,
+            callback_on_step_end=step_callback(progresses),
+            callback_on_step_end_tensor_inputs=["latents"],
+        ).images
@@ -1,5 +1,7 @@
-from tasks.task import Task
+from tasks.task import Task, blocking
 from tasks.file import FileReference
+from tasks.previews import StepProgress, sdxl_preview, step_callback
+from tasks.cancellation import CancellationToken
 from random import randint
 import io
 import torch
@@ -7,10 +9,19 @@ from diffusers import StableDiffusionXLPipeline, UNet2DConditionModel, EulerDisc
 from huggingface_hub import hf_hub_download
 from safetensors.torch import load_file
 from PIL import Image
-from typing import Any
+from typing import Any, List, Optional, Tuple
 from uuid import uuid4
 
 class Text2Imagedraft(Task):
+    vram_mb = 8000
+    ram_mb = 2000
+    load_seconds = 25
+    cacheable = True
+    # SDXL-Lightning takes prompt lists: requests of the same size share one pipeline call
+    concurrency = 4
+    max_batch = 4
+    steps = 4
+
     def __init__(self):
         super().__init__()
         self.pipe = None
@@ -34,12 +45,17 @@ class Text2Imagedraft(Task):
         print("Unloading Text2Imagedraft model...")
         self.pipe = None
 
+    @classmethod
+    def warmup(self):
+        self.pipe("warmup", num_inference_steps=1, guidance_scale=0, height=512, width=512)
+
     @classmethod
     async def execute(self,
                       prompt: str,
                       size: str = "1024x1024",
                       seed: int = 0,
-                      send_update: Any = None
+                      send_update: Any = None,
+                      cancel_token: Optional[CancellationToken] = None
                       ) -> FileReference:
         if self.pipe is None:
             raise Exception("Model not loaded")
@@ -48,26 +64,41 @@ class Text2Imagedraft(Task):
             seed = randint(0, 2**32 - 1)
 
         width, height = map(int, size.split("x"))
-        generator = torch.Generator("cuda" if torch.cuda.is_available() else "cpu")
+        progress = StepProgress(send_update, self.steps, preview=sdxl_preview, cancel_token=cancel_token)
+
+        return await self.batched((width, height), (prompt, seed, progress))
+
+    @classmethod
+    @blocking
+    def run_batch(self, size: Tuple[int, int], requests: List[Tuple[str, int, StepProgress]]) -> List[FileReference]:
+        width, height = size
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        # one generator per image so every request keeps its own seed
+        generators = [torch.Generator(device).manual_seed(seed) for _, seed, _ in requests]
 
-        image = self.pipe(
-            prompt,
-            num_inference_steps=4,
+        images = self.pipe(
+            [prompt for prompt, _, _ in requests],
+            num_inference_steps=self.steps,
             guidance_scale=0,
             height=height,
             width=width,
-            generator=generator.manual_seed(seed)
-        ).images[0]
+            generator=generators,
+            callback_on_step_end=step_callback([progress for _, _, progress in requests]),
+            callback_on_step_end_tensor_inputs=["latents"],
+        ).images
 
-        # Create a File object with a unique filename
-        file = FileReference(f"text2image_draft_{uuid4()}.png")
+        files = []
+        for image in images:
+            # Create a File object with a unique filename
+            file = FileReference(f"text2image_draft_{uuid4()}.png")
 
-        # Save the image to a bytes buffer
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+            # Save the image to a bytes buffer
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='PNG')
+            img_byte_arr.seek(0)
 
-        # Write the image data to the file
-        file.write(img_byte_arr.getvalue())
+            # Write the image data to the file
+            file.write(img_byte_arr.getvalue())
+            files.append(file)
 
-        return file
\ No newline at end of file
+        return files
\ No newline at end of file
@@ -1,4 +1,4 @@
-from tasks.task import Task
+from tasks.task import Task, blocking
 from tasks.file import FileReference
 from PIL import Image, ImageDraw, ImageFont
 from random import randint
@@ -6,6 +6,8 @@ import io
 from uuid import uuid4
 
 class Text2Imagefile(Task):
+    concurrency = 4
+
     def __init__(self):
         super().__init__()
         self.add_task(self.execute, "Text2Imagefile", exclude_params=["send_update"])
@@ -23,6 +25,11 @@ class Text2Imagefile(Task):
                       prompt: str,
                       send_update = None
                      ) -> FileReference:
+        return await self.render(prompt)
+
+    @classmethod
+    @blocking
+    def render(self, prompt: str) -> FileReference:
         image = Image.new('RGB', (512, 512), (randint(0, 255), randint(0, 255), randint(0, 255)))
         draw = ImageDraw.Draw(image)
         font = ImageFont.load_default()
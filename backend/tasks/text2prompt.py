@@ -1,12 +1,37 @@
-from typing import Callable, Awaitable, Literal
-from tasks.task import Task
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from typing import Callable, Awaitable, Literal, Optional
+from tasks.task import Task, blocking
+from tasks.streaming import TokenCoalescer
+from tasks.cancellation import CancellationToken, TaskCancelled
+from transformers import T5Tokenizer, T5ForConditionalGeneration, TextStreamer
 
 def noop(*args, **kwargs):
     print("Noop called", args, kwargs)
     pass
 
+class CoalescingStreamer(TextStreamer):
+    """
+    Hands decoded text from generate() on a worker thread to a TokenCoalescer,
+    and is the cancellation checkpoint between generated tokens.
+    """
+    def __init__(self, tokenizer, stream: TokenCoalescer, cancel_token: Optional[CancellationToken] = None):
+        super().__init__(tokenizer, skip_special_tokens=True)
+        self.stream = stream
+        self.cancel_token = cancel_token
+
+    def put(self, value):
+        if self.cancel_token is not None:
+            self.cancel_token.check()
+        super().put(value)
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        self.stream.push_threadsafe(text)
+
 class Text2Prompt(Task):
+    vram_mb = 500
+    ram_mb = 1000
+    load_seconds = 5
+    cacheable = True
+
     def __init__(self):
         super().__init__()
         self.tokenizer = None
@@ -25,30 +50,44 @@ class Text2Prompt(Task):
         cls.tokenizer = None
         cls.model = None
 
+    @classmethod
+    def warmup(cls):
+        input_ids = cls.tokenizer("warmup", return_tensors="pt").input_ids.to(cls.model.device)
+        cls.model.generate(input_ids, max_new_tokens=4)
+
     @classmethod
     async def execute(cls,
                       prompt: str,
                       max_new_tokens: int = 77,
-                      send_update: Callable[[str], Awaitable[Literal['success']]] = noop
+                      send_update: Callable[[str], Awaitable[Literal['success']]] = noop,
+                      cancel_token: Optional[CancellationToken] = None
                       ) -> str:
         """
         Expand a given prompt to add more detail.
         :param prompt: The input prompt to expand
         :param max_new_tokens: Maximum number of new tokens in the response
         :param send_update: Function to send incremental updates (excluded from protobuf)
+        :param cancel_token: Stops generation between tokens once cancelled (excluded from protobuf)
         :return: Expanded prompt
         """
         if cls.tokenizer is None or cls.model is None:
             raise Exception("Model not loaded")
 
-        # await send_update("Expanding prompt...")
+        stream = TokenCoalescer(send_update)
+        try:
+            expanded_prompt = await cls.expand(prompt, max_new_tokens, stream, cancel_token)
+        except TaskCancelled:
+            stream.discard()
+            raise
+        await stream.close()
+
+        return expanded_prompt
 
+    @classmethod
+    @blocking
+    def expand(cls, prompt: str, max_new_tokens: int, stream: TokenCoalescer, cancel_token: Optional[CancellationToken]) -> str:
         input_text = f"Expand the following prompt to add more detail: {prompt}"
         input_ids = cls.tokenizer(input_text, return_tensors="pt").input_ids.to(cls.model.device)
 
-        outputs = cls.model.generate(input_ids, max_new_tokens=max_new_tokens)
-        expanded_prompt = cls.tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-        # await send_update("Prompt expanded successfully")
-
-        return expanded_prompt
\ No newline at end of file
+        outputs = cls.model.generate(input_ids, max_new_tokens=max_new_tokens, streamer=CoalescingStreamer(cls.tokenizer, stream, cancel_token))
+        return cls.tokenizer.decode(outputs[0], skip_special_tokens=True)
\ No newline at end of file
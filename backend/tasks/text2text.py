@@ -1,13 +1,17 @@
-from typing import List, Literal, Tuple, Callable, Awaitable
+from typing import List, Literal, Optional, Tuple, Callable, Awaitable
 from functools import wraps
 from tasks.openai_client import client
 from tasks.task import Task
+from tasks.streaming import TokenCoalescer
+from tasks.cancellation import CancellationToken, TaskCancelled
 
 def noop(*args, **kwargs):
     print("Noop called", args, kwargs)
     pass
 
 class Text2Text(Task):
+    concurrency = 16
+
     def __init__(self):
         super().__init__()
         self.add_task(self.execute, "Text2Text", exclude_params=["client", "send_update"])
@@ -28,7 +32,8 @@ class Text2Text(Task):
         messages: List[str],
         max_tokens: int = 300,
         client = client,
-        send_update: Callable[[str], Awaitable[Literal['success']]] = noop
+        send_update: Callable[[str], Awaitable[Literal['success']]] = noop,
+        cancel_token: Optional[CancellationToken] = None
     ) -> str:
         """
         Generate text based on a given list of messages.
@@ -37,6 +42,7 @@ class Text2Text(Task):
         :param max_tokens: Maximum number of tokens in the response
         :param client: OpenAI client (excluded from protobuf)
         :param send_update: Function to send incremental updates (excluded from protobuf)
+        :param cancel_token: Stops the stream between chunks once cancelled (excluded from protobuf)
         :return: Generated text response
         """
         
@@ -46,16 +52,23 @@ class Text2Text(Task):
         for role, content in zip(roles, messages):
             formatted_messages.append({"role": role, "content": content})
         
-        print("send update!", await send_update("Generating text"))
-        
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=formatted_messages,
-            max_tokens=max_tokens,
-        )
-        
-        if not response.choices[0].message.content:
+        # the answer is streamed to the client as it is generated
+        stream = TokenCoalescer(send_update)
+        try:
+            async for piece in client.stream_chat(
+                model="gpt-4o-mini",
+                messages=formatted_messages,
+                max_tokens=max_tokens,
+            ):
+                if cancel_token is not None:
+                    await cancel_token.acheck()
+                stream.push(piece)
+        except TaskCancelled:
+            stream.discard()
+            raise
+        result = await stream.close()
+
+        if not result:
             return "ERROR: No response from the model."
         else:
-            result = response.choices[0].message.content
             return result
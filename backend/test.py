@@ -1,37 +1,39 @@
+"""
+Manual check against a running worker (python server.py): handshake, then a
+Capitalize task. For load and latency numbers use bench.py.
+"""
 import asyncio
-import websockets
-import json
+import os
+import sys
 import uuid
 
-async def test_capitalize():
-    uri = "ws://localhost:8000/ws/test-client"
+import betterproto
+import websockets
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from proto.py import tasks as proto_tasks  # type: ignore
+from proto.py import websocket as wsmsg  # type: ignore
+
+async def test_capitalize(uri: str = "ws://localhost:8000/ws/test-client"):
     async with websockets.connect(uri) as websocket:
-        # Get available tasks
-        await websocket.send(json.dumps({"type": "get_available_tasks"}))
-        response = await websocket.recv()
-        print("Available tasks:", json.loads(response))
+        await websocket.send(bytes(wsmsg.ClientMessage(handshake=wsmsg.ClientHandshake("1.0.0"))))
+        message_type, handshake = betterproto.which_one_of(wsmsg.ServerMessage().parse(await websocket.recv()), "message")
+        print("Handshake:", message_type, handshake.to_dict())
 
-        # Execute Capitalize task
         task_id = str(uuid.uuid4())
-        task_request = {
-            "type": "execute",
-            "taskId": task_id,
-            "name": "Capitalize",
-            "request": {"text": "hello, world!"}
-        }
-        await websocket.send(json.dumps(task_request))
+        request = proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text="hello, world!"))
+        await websocket.send(bytes(wsmsg.ClientMessage(execute=wsmsg.ExecuteTask(task_id=task_id, name="capitalize", request=request))))
 
         while True:
-            response = await websocket.recv()
-            data = json.loads(response)
-            if data["type"] == "incrementalUpdate":
-                print("Incremental update:", data["update"])
-            elif data["type"] == "result":
-                print("Final result:", data["result"])
+            message_type, content = betterproto.which_one_of(wsmsg.ServerMessage().parse(await websocket.recv()), "message")
+            if message_type == "incremental_update":
+                print("Incremental update:", content.to_dict())
+            elif message_type == "task_result":
+                print("Final result:", content.result.capitalize.result)
                 break
-            elif data["type"] == "error":
-                print("Error:", data["error"])
+            elif message_type == "error":
+                print("Error:", content.error)
                 break
 
 if __name__ == "__main__":
-    asyncio.get_event_loop().run_until_complete(test_capitalize())
+    asyncio.run(test_capitalize(*sys.argv[1:]))
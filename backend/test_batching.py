@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from tasks.batching import MicroBatcher
+
+def recording_batcher(**kwargs):
+    calls = []
+
+    async def run_batch(key, requests):
+        calls.append((key, list(requests)))
+        await asyncio.sleep(0.01)
+        return [f"{key}:{request}" for request in requests]
+
+    return MicroBatcher(run_batch, **kwargs), calls
+
+def test_concurrent_requests_share_a_batch():
+    async def run():
+        batcher, calls = recording_batcher(max_batch=4, window=0.05)
+        results = await asyncio.gather(*[batcher.submit("512x512", i) for i in range(4)])
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert results == ["512x512:0", "512x512:1", "512x512:2", "512x512:3"]
+    assert calls == [("512x512", [0, 1, 2, 3])]
+
+def test_only_matching_keys_are_batched():
+    async def run():
+        batcher, calls = recording_batcher(max_batch=4, window=0.05)
+        results = await asyncio.gather(*[batcher.submit("small" if i % 2 else "large", i) for i in range(6)])
+        return results, calls
+
+    results, calls = asyncio.run(run())
+    assert results == ["large:0", "small:1", "large:2", "small:3", "large:4", "small:5"]
+    assert sorted(calls) == [("large", [0, 2, 4]), ("small", [1, 3, 5])]
+
+def test_batches_are_capped_at_max_batch():
+    async def run():
+        batcher, calls = recording_batcher(max_batch=3, window=0.05)
+        await asyncio.gather(*[batcher.submit("key", i) for i in range(7)])
+        return calls
+
+    calls = asyncio.run(run())
+    assert [requests for _, requests in calls] == [[0, 1, 2], [3, 4, 5], [6]]
+
+def test_batch_failure_reaches_every_caller():
+    async def fail(key, requests):
+        raise RuntimeError("out of memory")
+
+    async def run():
+        batcher = MicroBatcher(fail, max_batch=2, window=0.01)
+        return await asyncio.gather(batcher.submit("key", 1), batcher.submit("key", 2), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
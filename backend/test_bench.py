@@ -0,0 +1,19 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bench import compare, percentile
+
+def test_percentile_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([3.0], 0.95) == 3
+    assert percentile([], 0.5) == 0
+
+def test_baseline_comparison_flags_regressions_beyond_tolerance():
+    baseline = {"scenarios": {"capitalize": {"p95_ms": 10.0, "throughput": 100.0}}}
+    within = {"scenarios": {"capitalize": {"p95_ms": 12.0, "throughput": 80.0}, "uploads": {"p95_ms": 1.0, "throughput": 1.0}}}
+    assert compare(within, baseline, 0.25) == []
+    slower = {"scenarios": {"capitalize": {"p95_ms": 13.0, "throughput": 70.0}}}
+    assert len(compare(slower, baseline, 0.25)) == 2
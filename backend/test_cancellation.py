@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from engine import ExecutionEngine
+from tasks.cancellation import CancellationToken, TaskCancelled, check_all
+
+def test_paused_checkpoint_waits_until_resumed_or_cancelled():
+    token = CancellationToken()
+    token.pause()
+    passed = []
+
+    def worker():
+        for step in range(2):
+            try:
+                token.check()
+            except TaskCancelled:
+                passed.append("cancelled")
+                return
+            passed.append(step)
+            token.pause()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    assert passed == []
+    token.resume()
+    time.sleep(0.05)
+    assert passed == [0]
+    token.cancel()
+    thread.join(1)
+    assert passed == [0, "cancelled"]
+
+def test_shared_work_stops_only_when_every_job_is_cancelled():
+    first, second = CancellationToken(), CancellationToken()
+    first.cancel()
+    check_all([first, second])
+    check_all([first, None])
+    second.cancel()
+    with pytest.raises(TaskCancelled):
+        check_all([first, second])
+
+def test_engine_tells_started_jobs_from_waiting_ones():
+    async def run():
+        engine = ExecutionEngine()
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        engine.submit("a", "Slow", job, owner="client")
+        engine.submit("b", "Slow", job, owner="client")
+        await asyncio.sleep(0.01)
+        states = engine.is_started("a"), engine.is_started("b"), engine.jobs_of("client")
+        engine.cancel("b")
+        release.set()
+        await asyncio.sleep(0.01)
+        return states, engine.jobs_of("client")
+
+    (first, second, owned), remaining = asyncio.run(run())
+    assert first and not second
+    assert owned == {"a", "b"}
+    assert remaining == set()
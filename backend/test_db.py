@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from db import DatabaseManager
+
+def open_db(tmp_path):
+    db = DatabaseManager(str(tmp_path / "id_map.db"))
+    db.setup()
+    return db
+
+def test_queued_writes_are_visible_and_batched(tmp_path):
+    db = open_db(tmp_path)
+
+    def add(thread: int):
+        for i in range(50):
+            db.add_file_mapping(f"{thread}-{i}", f"/files/{thread}-{i}.png")
+
+    threads = [threading.Thread(target=add, args=(t,)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # served from the cache even before the writer commits
+    assert db.get_file_path("3-49") == "/files/3-49.png"
+    db.flush()
+    assert db.stats["commits"] < db.stats["writes"]
+    db.close()
+
+    reopened = open_db(tmp_path)
+    assert reopened.get_file_path("0-0") == "/files/0-0.png"
+    assert reopened.stats["misses"] == 1
+    reopened.close()
+
+def test_hash_updates_reach_cache_and_disk(tmp_path):
+    db = open_db(tmp_path)
+    db.add_file_mapping("a", str(tmp_path / "id_map.db"))
+    db.set_file_hash("a", "h1")
+    assert db.get_file_hash("a") == "h1"
+    assert db.find_file_by_hash("h1") == str(tmp_path / "id_map.db")
+    db.close()
+    assert open_db(tmp_path).get_file_hash("a") == "h1"
+
+def test_failed_writes_leave_the_cache(tmp_path):
+    db = DatabaseManager(str(tmp_path / "id_map.db"), write_retries=1)
+    db.setup()
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            CREATE TRIGGER reject_bad BEFORE INSERT ON file_mapping WHEN NEW.file_id LIKE 'bad%'
+            BEGIN SELECT RAISE(ABORT, 'rejected'); END
+        """)
+    db.add_file_mapping("bad-1", "/files/bad.png")
+    db.flush()
+    assert db.stats["retries"] == 1 and db.stats["failed_writes"] == 1
+    # the mapping never reached the database, so it is not served from the cache either
+    with pytest.raises(HTTPException):
+        db.get_file_path("bad-1")
+    db.add_file_mapping("good-1", "/files/good.png")
+    db.flush()
+    db.close()
+    assert open_db(tmp_path).get_file_path("good-1") == "/files/good.png"
+
+def test_hash_index_follows_the_cache(tmp_path):
+    db = DatabaseManager(str(tmp_path / "id_map.db"), cache_size=2)
+    db.setup()
+    stored = [str(tmp_path / f"{name}.png") for name in "ab"]
+    for path in stored:
+        open(path, "wb").close()
+    db.add_file_mapping("a", stored[0], "h1")
+    db.add_file_mapping("b", stored[1], "h2")
+    db.set_file_hash("a", "h3")
+    assert db._by_hash == {"h2": {"b"}, "h3": {"a"}}
+    db.get_file_path("b")
+    db.add_file_mapping("c", stored[1], "h2")
+    # "a" fell out of the cache, its hash is found through sqlite
+    assert db._by_hash == {"h2": {"b", "c"}}
+    db.flush()
+    assert db.find_file_by_hash("h3") == stored[0]
+    assert db.find_file_by_hash("h1") is None
+    db.remove_paths([stored[1]])
+    assert "h2" not in db._by_hash
+    db.close()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db
+from tasks.file import FileReference
+
+def test_output_files_are_registered_when_returned():
+    file = FileReference("test_file_output.txt")
+    try:
+        file.write(b"hello")
+        assert db.get_file_hash(file.id) is None
+        proto = file.to_proto()
+        assert db.get_file_path(file.id) == file.path
+        assert db.get_file_hash(file.id) == proto.hash
+    finally:
+        os.remove(file.path)
+
+def test_existing_handles_keep_their_id():
+    file = FileReference("test_file_existing.txt")
+    try:
+        file.write(b"hello")
+        file.register()
+        handle = FileReference.from_id(file.id)
+        assert handle.id == file.id and handle.path == file.path
+        handle.write(b"changed")
+        assert db.get_file_hash(file.id) == handle.to_proto().hash != file.hash
+    finally:
+        os.remove(file.path)
+
+def test_notify_client_hashes_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+    import tasks.file
+
+    threads = []
+    def recording_hash_file(path):
+        threads.append(threading.current_thread())
+        return hash_file(path)
+    hash_file = tasks.file.hash_file
+    monkeypatch.setattr(tasks.file, "hash_file", recording_hash_file)
+
+    class Socket:
+        async def send_bytes(self, data):
+            pass
+
+    file = FileReference("test_file_notify.txt")
+    try:
+        file.write(b"hello")
+        asyncio.run(file.notify_client(Socket()))
+        assert threads and threads[0] is not threading.main_thread()
+        assert db.get_file_hash(file.id) == file.to_proto().hash
+        assert len(threads) == 1
+    finally:
+        os.remove(file.path)
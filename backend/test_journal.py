@@ -0,0 +1,35 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from journal import RequestJournal
+from proto.py import tasks as proto_tasks  # type: ignore
+
+def test_entries_stream_to_jsonl_with_protobuf_payloads(tmp_path):
+    journal = RequestJournal(str(tmp_path), recent=2)
+    for i in range(3):
+        request = proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text=f"text {i}"))
+        journal.record({"id": f"t{i}", "type": "Capitalize", "input": request})
+    journal.close()
+
+    with open(tmp_path / "requests.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["id"] for line in lines] == ["t0", "t1", "t2"]
+    assert lines[0]["input"] == {"capitalize": {"text": "text 0"}}
+    # the ring buffer only keeps the newest entries
+    assert [entry["id"] for entry in journal.latest()] == ["t2", "t1"]
+
+def test_journal_rotates_and_keeps_a_bounded_number_of_files(tmp_path):
+    journal = RequestJournal(str(tmp_path), max_bytes=300, backups=2)
+    for i in range(20):
+        journal.record({"id": f"t{i}", "padding": "x" * 100})
+        journal.flush()
+    journal.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["requests.1.jsonl", "requests.2.jsonl", "requests.jsonl"]
+    assert all(os.path.getsize(tmp_path / name) <= 300 for name in os.listdir(tmp_path))
+    with open(tmp_path / "requests.jsonl") as f:
+        assert json.loads(f.readlines()[-1])["id"] == "t19"
+    assert journal.report()["rotations"] > 2
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pytest
+from fastapi.testclient import TestClient
+import betterproto
+
+import server
+from tasks.task import Task, blocking
+from proto.py import tasks as proto_tasks  # type: ignore
+from proto.py import websocket as wsmsg  # type: ignore
+
+# files, mapping and upload state live in a temporary directory and nothing is journaled, see conftest.py
+pytestmark = pytest.mark.usefixtures("isolated_server")
+
+TASK_SECONDS = 2.0
+MAX_DOWNLOAD_LATENCY = 0.25
+
+class BusyCapitalize(Task):
+    """Capitalize, but it burns CPU for TASK_SECONDS first, like a model call would."""
+
+    @classmethod
+    def load(cls):
+        pass
+
+    @classmethod
+    def unload(cls):
+        pass
+
+    @classmethod
+    async def execute(cls, text: str, send_update=None) -> str:
+        return await cls.burn(text)
+
+    @classmethod
+    @blocking
+    def burn(cls, text: str) -> str:
+        deadline = time.perf_counter() + TASK_SECONDS
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+        return text.upper()
+
+def receive(websocket):
+    return betterproto.which_one_of(wsmsg.ServerMessage().parse(websocket.receive_bytes()), "message")
+
+def test_download_stays_fast_during_blocking_task(monkeypatch):
+    monkeypatch.setitem(server.TASKS, "Capitalize", BusyCapitalize)
+    file_id = "latency"
+
+    with TestClient(server.app) as client:
+        upload = client.post(f"/api/upload/{file_id}", files={"file": (f"{file_id}.bin", os.urandom(64 * 1024))})
+        assert upload.status_code == 200
+
+        with client.websocket_connect("/ws/latency-test") as websocket:
+            websocket.send_bytes(bytes(wsmsg.ClientMessage(handshake=wsmsg.ClientHandshake("0.0.0"))))
+            assert receive(websocket)[0] == "handshake"
+            assert receive(websocket)[0] == "request_available_tasks"
+
+            websocket.send_bytes(bytes(wsmsg.ClientMessage(execute=wsmsg.ExecuteTask(
+                task_id="busy",
+                name="capitalize",
+                request=proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text="still responsive"))
+            ))))
+
+            latencies = []
+            started = time.perf_counter()
+            while time.perf_counter() - started < TASK_SECONDS:
+                request_started = time.perf_counter()
+                download = client.get(f"/api/download/{file_id}")
+                latencies.append(time.perf_counter() - request_started)
+                assert download.status_code == 200
+
+            message_type, result = receive(websocket)
+            assert message_type == "task_result"
+            assert result.result.capitalize.result == "STILL RESPONSIVE"
+
+    assert len(latencies) > 5
+    assert max(latencies) < MAX_DOWNLOAD_LATENCY, f"max download latency {max(latencies) * 1000:.1f}ms during the task"
+
+def test_handshake_advertises_worker_without_delay(monkeypatch):
+    monkeypatch.setitem(server.TASKS, "Capitalize", BusyCapitalize)
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws/handshake-test") as websocket:
+            started = time.perf_counter()
+            websocket.send_bytes(bytes(wsmsg.ClientMessage(handshake=wsmsg.ClientHandshake(server.PROTOCOL_VERSION))))
+            message_type, handshake = receive(websocket)
+            elapsed = time.perf_counter() - started
+
+            assert message_type == "handshake"
+            assert handshake.capacity > 0
+            assert "capitalize" in [task.name for task in handshake.tasks]
+
+            # no RequestAvailableTasks round-trip: tasks can be offered right away
+            websocket.send_bytes(bytes(wsmsg.ClientMessage(available_tasks=wsmsg.AvailableTasks(tasks=[wsmsg.Task(
+                id="offered",
+                name="capitalize",
+                request=proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text="hi"))
+            )]))))
+            message_type, accepted = receive(websocket)
+            assert message_type == "accept_task"
+            assert accepted.task_ids == ["offered"]
+
+    assert elapsed < MAX_DOWNLOAD_LATENCY
+
+def test_one_round_accepts_tasks_up_to_capacity(monkeypatch):
+    monkeypatch.setitem(server.TASKS, "Capitalize", BusyCapitalize)
+    monkeypatch.setitem(server.engine.limits, "Capitalize", 3)
+    monkeypatch.setattr(server, "max_accept", 3)
+
+    def offer(task_ids):
+        return bytes(wsmsg.ClientMessage(available_tasks=wsmsg.AvailableTasks(tasks=[wsmsg.Task(
+            id=task_id,
+            name="capitalize",
+            request=proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text=task_id))
+        ) for task_id in task_ids])))
+
+    with TestClient(server.app) as client:
+        with client.websocket_connect("/ws/capacity-test") as websocket:
+            websocket.send_bytes(bytes(wsmsg.ClientMessage(handshake=wsmsg.ClientHandshake(server.PROTOCOL_VERSION))))
+            message_type, handshake = receive(websocket)
+            assert message_type == "handshake"
+            # 3 execution slots plus one job queued ahead, capped at max_accept
+            assert handshake.capacity == 3
+
+            offered = [f"task-{i}" for i in range(6)]
+            websocket.send_bytes(offer(offered))
+            message_type, accepted = receive(websocket)
+            assert message_type == "accept_task"
+            assert accepted.task_ids == offered[:3]
+            assert server.scheduler.capacity(server.max_accept) == 1
+
+            # the next round only fills the slot that is left
+            websocket.send_bytes(offer(offered[3:]))
+            message_type, accepted = receive(websocket)
+            assert message_type == "accept_task"
+            assert accepted.task_ids == offered[3:4]
+            assert server.scheduler.capacity(server.max_accept) == 0
+
+    assert not server.scheduler.accepted
@@ -0,0 +1,42 @@
+import io
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from log import Payload, logger, setup_logging, stop_logging, summarize
+from proto.py import websocket as wsmsg  # type: ignore
+
+def test_summary_keeps_set_fields_and_bounds_size():
+    message = wsmsg.ServerMessage(incremental_update=wsmsg.IncrementalUpdate(
+        task_id="t1", msg="x" * 500, percent=40, preview=b"\xff" * 4096
+    ))
+    summary = summarize(message, max_string=10)
+    assert list(summary) == ["incremental_update"]
+    update = summary["incremental_update"]
+    assert update["task_id"] == "t1"
+    assert update["msg"] == "xxxxxxxxxx... (+490 chars)"
+    assert update["preview"] == "<4096 bytes>"
+    assert "update" not in update
+    assert summarize(list(range(15)), max_items=3) == [0, 1, 2, "... (+12 items)"]
+
+class Counted:
+    serialized = 0
+
+    def __repr__(self):
+        Counted.serialized += 1
+        return "counted"
+
+def test_payloads_are_only_serialized_when_emitted():
+    output = io.StringIO()
+    setup_logging("INFO", stream=output)
+    try:
+        logger.debug("Skipped %s", Payload(Counted()))
+        logger.info("Kept %s", Payload({"value": Counted()}))
+    finally:
+        stop_logging()
+    assert Counted.serialized == 1
+    assert 'Kept {"value": "counted"}' in output.getvalue()
+    assert "Skipped" not in output.getvalue()
+    assert logger.getEffectiveLevel() == logging.INFO
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from metrics import Registry
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    stages = registry.histogram("stage_seconds", "Stage time", ("task", "stage"), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        stages.observe(value, task="Text2Image", stage="execute")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP stage_seconds Stage time", "# TYPE stage_seconds histogram"]
+    assert 'stage_seconds_bucket{task="Text2Image",stage="execute",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{task="Text2Image",stage="execute",le="1"} 3' in lines
+    assert 'stage_seconds_bucket{task="Text2Image",stage="execute",le="+Inf"} 4' in lines
+    assert 'stage_seconds_sum{task="Text2Image",stage="execute"} 4.25' in lines
+    assert 'stage_seconds_count{task="Text2Image",stage="execute"} 4' in lines
+
+def test_counters_and_gauges():
+    registry = Registry()
+    errors = registry.counter("errors_total", "Errors", ("task", "error"))
+    errors.inc(task="Text2Text", error="TimeoutError")
+    errors.inc(2, task="Text2Text", error="TimeoutError")
+    registry.gauge("queued", "Queued", ("task",), lambda: {("Text2Text",): 3})
+
+    text = registry.render()
+    assert 'errors_total{task="Text2Text",error="TimeoutError"} 3' in text
+    assert 'queued{task="Text2Text"} 3' in text
+    assert errors.get(task="Text2Text", error="TimeoutError") == 3
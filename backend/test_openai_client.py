@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from tasks.openai_client import PooledClient
+from tasks.streaming import TokenCoalescer
+
+STUB_DELAY = 0.2
+STREAM_DELAY = 0.02
+
+class StubOpenAI(BaseHTTPRequestHandler):
+    """Answers chat completions by echoing the last message; "fail N" prompts get N 429s first."""
+    lock = threading.Lock()
+    requests = 0
+    active = 0
+    max_active = 0
+    failures = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        cls = type(self)
+        with cls.lock:
+            cls.requests += 1
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(STUB_DELAY)
+            if body.get("stream"):
+                return self.stream(body["model"], prompt.upper().split(" "))
+            if prompt.startswith("fail"):
+                with cls.lock:
+                    remaining = cls.failures.setdefault(prompt, int(prompt.split()[1]))
+                    cls.failures[prompt] -= 1
+                if remaining > 0:
+                    return self.reply(429, {"error": {"message": "rate limited", "type": "rate_limit"}})
+            self.reply(200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": prompt.upper()}}],
+            })
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def stream(self, model, words):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(STREAM_DELAY)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def stub_server():
+    handler = type("Handler", (StubOpenAI,), {"requests": 0, "active": 0, "max_active": 0, "failures": {}})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, handler
+
+def make_client(httpd, **kwargs):
+    return PooledClient(base_url=f"http://127.0.0.1:{httpd.server_port}/v1", api_key="test", backoff_base=0.01, **kwargs)
+
+def chat(client, prompt):
+    return client.chat(model="stub", messages=[{"role": "user", "content": prompt}], max_tokens=10)
+
+def test_identical_requests_are_coalesced():
+    httpd, handler = stub_server()
+
+    async def run():
+        client = make_client(httpd)
+        results = await asyncio.gather(*[chat(client, "same prompt") for _ in range(10)])
+        await client.close()
+        return client, results
+
+    client, results = asyncio.run(run())
+    httpd.shutdown()
+    assert handler.requests == 1
+    assert client.stats["coalesced"] == 9
+    assert {r.choices[0].message.content for r in results} == {"SAME PROMPT"}
+
+def test_rate_limited_requests_are_retried():
+    httpd, handler = stub_server()
+
+    async def run():
+        client = make_client(httpd)
+        result = await chat(client, "fail 2")
+        await client.close()
+        return client, result
+
+    client, result = asyncio.run(run())
+    httpd.shutdown()
+    assert result.choices[0].message.content == "FAIL 2"
+    assert handler.requests == 3
+    assert client.stats["retries"] == 2
+
+def test_concurrency_is_bounded():
+    httpd, handler = stub_server()
+
+    async def run():
+        client = make_client(httpd, max_concurrency=5)
+        started = time.perf_counter()
+        await asyncio.gather(*[chat(client, f"prompt {i}") for i in range(20)])
+        elapsed = time.perf_counter() - started
+        await client.close()
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    httpd.shutdown()
+    assert handler.requests == 20
+    assert handler.max_active == 5
+    # 20 calls, 5 at a time: about 4 rounds, far from the 20 rounds of serialized calls
+    assert elapsed < 10 * STUB_DELAY
+
+def test_streamed_tokens_arrive_coalesced_before_the_end():
+    httpd, handler = stub_server()
+    prompt = " ".join(f"word{i}" for i in range(40))
+
+    async def run():
+        client = make_client(httpd)
+        updates = []
+        started = time.perf_counter()
+
+        async def send_update(msg, update=None):
+            updates.append((time.perf_counter() - started, update))
+
+        stream = TokenCoalescer(send_update, max_chars=32, max_delay=0.05)
+        async for piece in client.stream_chat(model="stub", messages=[{"role": "user", "content": prompt}]):
+            stream.push(piece)
+        text = await stream.close()
+        await client.close()
+        return updates, text, time.perf_counter() - started
+
+    updates, text, total = asyncio.run(run())
+    httpd.shutdown()
+    assert text == prompt.upper()
+    assert "".join(update for _, update in updates) == text
+    # the first token goes out alone and long before the stream ends
+    assert updates[0][1] == "WORD0"
+    assert updates[0][0] < total / 2
+    assert 2 < len(updates) < 40
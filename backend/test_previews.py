@@ -0,0 +1,47 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from tasks import previews
+from tasks.previews import StepProgress
+
+def run_steps(total_steps: int, step_seconds: float, preview_seconds: float):
+    updates = []
+
+    async def send_update(msg, update=None, percent=0, preview=b""):
+        updates.append((percent, preview))
+
+    def preview(latent):
+        time.sleep(preview_seconds)
+        return b"jpeg"
+
+    async def main():
+        progress = StepProgress(send_update, total_steps, preview=preview)
+
+        def pipeline():
+            for step in range(total_steps):
+                time.sleep(step_seconds)
+                progress.step(step, lambda: None)
+
+        await asyncio.to_thread(pipeline)
+        await asyncio.sleep(0.05)
+        return progress
+
+    return asyncio.run(main()), updates
+
+def test_progress_is_throttled_and_ends_at_100(monkeypatch):
+    monkeypatch.setattr(previews, "preview_interval", 0.05)
+    progress, updates = run_steps(total_steps=40, step_seconds=0.01, preview_seconds=0)
+    assert updates[-1] == (100, b"")
+    assert len(updates) < 40
+    assert progress.previews > 0
+
+def test_previews_stay_within_budget(monkeypatch):
+    monkeypatch.setattr(previews, "preview_interval", 0.01)
+    monkeypatch.setattr(previews, "preview_budget", 0.1)
+    progress, _ = run_steps(total_steps=20, step_seconds=0.01, preview_seconds=0.02)
+    elapsed = time.perf_counter() - progress.started
+    # a preview may start just under budget, so allow one over
+    assert progress.preview_seconds <= 0.1 * elapsed + 0.02
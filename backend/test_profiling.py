@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from profiling import Profiler
+from tasks.task import Task, blocking
+
+class Slow(Task):
+    @classmethod
+    def load(cls):
+        pass
+
+    @classmethod
+    def unload(cls):
+        pass
+
+    @classmethod
+    async def execute(cls, n: int) -> int:
+        await asyncio.sleep(0)
+        return await cls.crunch(n)
+
+    @classmethod
+    @blocking
+    def crunch(cls, n: int) -> int:
+        return sum(i * i for i in range(n))
+
+def test_profile_covers_blocking_calls_and_directory_stays_bounded(tmp_path):
+    profiler = Profiler(directory=str(tmp_path), tasks={"Slow"}, max_files=4)
+
+    async def run():
+        results = []
+        for i in range(3):
+            results.append(await profiler.run("Slow", f"job/{i}", Slow.execute(10000)))
+        return results
+
+    assert asyncio.run(run()) == [sum(i * i for i in range(10000))] * 3
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 4
+    summaries = [name for name in files if name.endswith(".txt")]
+    assert summaries and all("_Slow_job_" in name for name in files)
+    with open(tmp_path / summaries[-1]) as f:
+        assert "crunch" in f.read()
+    assert profiler.stats["profiled"] == 3
+
+def test_overlapping_executions_are_profiled_one_at_a_time(tmp_path):
+    profiler = Profiler(directory=str(tmp_path), tasks={"Slow"})
+
+    async def run():
+        return await asyncio.gather(*[profiler.run("Slow", f"job-{i}", Slow.execute(200000)) for i in range(2)])
+
+    assert asyncio.run(run()) == [sum(i * i for i in range(200000))] * 2
+    assert (profiler.stats["profiled"], profiler.stats["skipped"]) == (1, 1)
+    summaries = [name for name in os.listdir(tmp_path) if name.endswith(".txt")]
+    assert len(summaries) == 1 and "_Slow_job-0" in summaries[0]
+
+def test_profiling_is_per_task_type():
+    profiler = Profiler(tasks=set())
+    profiler.set("Text2Image", True)
+    assert profiler.enabled("Text2Image") and not profiler.enabled("Text2Text")
+    profiler.set("*", True)
+    assert profiler.enabled("Text2Text")
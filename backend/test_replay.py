@@ -0,0 +1,34 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from replay import FileMapper, build_request, load_trace, stub_durations
+
+def test_trace_merges_journal_and_old_dumps(tmp_path):
+    journal = tmp_path / "requests.jsonl"
+    journal.write_text("\n".join(json.dumps(entry) for entry in [
+        {"time": "2026-01-02T10:00:05", "client": "a", "type": "Text2image", "input": {"text2image": {"prompt": "cat"}}, "seconds": 4.0},
+        {"time": "2026-01-02T10:00:06", "client": "a", "type": "Text2image", "input": {"text2image": {"prompt": "cat"}}, "seconds": 0.01, "cached": True},
+    ]) + "\n")
+    dump = tmp_path / "20260101_100000_logs.json"
+    dump.write_text(json.dumps([
+        {"time": "2026-01-02 10:00:00", "type": "Capitalize", "input": {"capitalize": {"text": "hi"}}},
+        {"time": "2026-01-02 10:00:01", "type": "File2text", "input": {"file2text": {"file": "<tasks.file.FileReference object at 0x7f>"}}},
+    ]))
+
+    trace, skipped = load_trace([str(journal), str(dump)], max_gap=2)
+    assert skipped == 1
+    assert [(entry.task, entry.offset, entry.client) for entry in trace] == [
+        ("Capitalize", 0.0, "replay"), ("Text2Image", 2.0, "a"), ("Text2Image", 3.0, "a")]
+    assert stub_durations(trace, ["Capitalize"]) == {"Text2Image": [4.0]}
+
+def test_recorded_files_are_replaced_consistently():
+    mapper = FileMapper()
+    recorded = {"file2text": {"file": {"type": "file_reference", "id": "f1", "name": "a.txt", "size": "1000", "hash": "x"}}}
+    first, second = {}, {}
+    request = mapper.rewrite(recorded, first)
+    mapper.rewrite(recorded, second)
+    assert first == second and len(next(iter(first.values()))) == 1000
+    file = build_request(request).file2text.file
+    assert file.id in first and file.id != "f1" and file.size == 1000
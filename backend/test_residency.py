@@ -0,0 +1,139 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pytest
+
+from residency import ResidencyManager
+from tasks.task import Task
+
+def stub_task(name: str, events: list, vram_mb: float = 0, load_error: Exception = None):
+    """A Task whose load/warmup/unload only record themselves in `events`."""
+    failures = [load_error] if load_error else []
+
+    class Stub(Task):
+        @classmethod
+        def load(cls):
+            if failures:
+                raise failures.pop()
+            time.sleep(0.01)
+            events.append(("load", name))
+
+        @classmethod
+        def warmup(cls):
+            events.append(("warmup", name))
+
+        @classmethod
+        def unload(cls):
+            events.append(("unload", name))
+
+        @classmethod
+        async def execute(cls, **kwargs):
+            return name
+
+    Stub.vram_mb = vram_mb
+    Stub.__name__ = name
+    return Stub
+
+async def run(residency: ResidencyManager, name: str, task_class):
+    async with residency.use(name, task_class):
+        pass
+
+def test_least_recently_used_model_is_evicted_within_budget():
+    events = []
+    a, b, c = (stub_task(name, events, vram_mb=4) for name in "ABC")
+    residency = ResidencyManager({"vram": 10})
+
+    async def scenario():
+        for name, task_class in (("A", a), ("B", b), ("A", a), ("C", c)):
+            await run(residency, name, task_class)
+
+    asyncio.run(scenario())
+    assert list(residency.resident) == ["A", "C"]
+    assert ("unload", "B") in events and ("unload", "A") not in events
+    assert residency.usage()["vram"] <= 10
+    assert residency.stats["B"]["evictions"] == 1
+
+def test_models_in_use_are_not_evicted():
+    events = []
+    a, b = stub_task("A", events, vram_mb=6), stub_task("B", events, vram_mb=6)
+    residency = ResidencyManager({"vram": 10})
+
+    async def scenario():
+        async with residency.use("A", a):
+            await run(residency, "B", b)
+        return list(residency.resident)
+
+    # B is loaded over budget rather than unloading the executing A
+    assert asyncio.run(scenario()) == ["A", "B"]
+    assert ("unload", "A") not in events
+
+def test_cuda_error_on_load_unloads_only_the_oldest_idle_model():
+    events = []
+    a, b = stub_task("A", events), stub_task("B", events)
+    c = stub_task("C", events, load_error=RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    residency = ResidencyManager()
+
+    async def scenario():
+        for name, task_class in (("A", a), ("B", b), ("C", c)):
+            await run(residency, name, task_class)
+
+    asyncio.run(scenario())
+    assert [event for event in events if event[0] == "unload"] == [("unload", "A")]
+    assert list(residency.resident) == ["B", "C"]
+
+def test_other_load_errors_are_not_retried():
+    events = []
+    a, b = stub_task("A", events), stub_task("B", events, load_error=ValueError("bad weights"))
+    residency = ResidencyManager()
+
+    async def scenario():
+        await run(residency, "A", a)
+        await run(residency, "B", b)
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
+    assert list(residency.resident) == ["A"]
+    assert ("unload", "A") not in events
+
+def test_hit_miss_and_load_time_counters():
+    events = []
+    a = stub_task("A", events)
+    residency = ResidencyManager()
+
+    async def scenario():
+        for _ in range(3):
+            await run(residency, "A", a)
+
+    asyncio.run(scenario())
+    stats = residency.report()["tasks"]["A"]
+    assert (stats["misses"], stats["hits"], stats["loads"]) == (1, 2, 1)
+    assert stats["load_time_total"] >= 0.01 and stats["last_load_time"] == stats["load_time_total"]
+    assert (stats["cold_runs"], stats["warm_runs"]) == (1, 2)
+    assert stats["state"] == "ready"
+
+def test_prefetch_skips_models_that_do_not_fit():
+    events = []
+    a, b, c = stub_task("A", events, vram_mb=8), stub_task("B", events, vram_mb=4), stub_task("C", events, vram_mb=2)
+    residency = ResidencyManager({"vram": 10})
+
+    async def scenario():
+        await run(residency, "A", a)
+        assert not residency.prefetch("B", b)
+        assert residency.prefetch("C", c)
+        await residency.loading["C"]
+
+    asyncio.run(scenario())
+    assert residency.state("B") == "unloaded"
+    assert list(residency.resident) == ["A", "C"]
+    assert ("unload", "A") not in events
+
+@pytest.mark.parametrize("warmup", [True, False])
+def test_warmup_runs_after_load(warmup):
+    events = []
+    a = stub_task("A", events)
+    residency = ResidencyManager(warmup=warmup)
+    asyncio.run(run(residency, "A", a))
+    assert events == ([("load", "A"), ("warmup", "A")] if warmup else [("load", "A")])
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from result_cache import ResultCache
+
+def file_ref(file_id):
+    return {"type": "file_reference", "id": file_id, "name": f"{file_id}.png", "size": "10", "hash": "ignored"}
+
+def test_key_depends_on_file_content_not_file_id():
+    same_a = ResultCache.key("TurboEdit", {"input_image": file_ref("a"), "seed": 5}, {"a": "h1"})
+    same_b = ResultCache.key("TurboEdit", {"input_image": file_ref("b"), "seed": 5}, {"b": "h1"})
+    other = ResultCache.key("TurboEdit", {"input_image": file_ref("a"), "seed": 5}, {"a": "h2"})
+    assert same_a == same_b
+    assert same_a != other
+    assert same_a != ResultCache.key("TurboEdit", {"input_image": file_ref("a"), "seed": 6}, {"a": "h1"})
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for key in ("one", "two"):
+        cache.put(key, "Capitalize", b"result", {})
+    # room for two entries, not three
+    cache.max_bytes = cache.size() * 5 // 4
+    assert cache.get("one") == b"result"
+    cache.put("three", "Capitalize", b"result", {})
+    assert cache.get("two") is None
+    assert cache.get("one") is not None
+    assert cache.stats["evictions"] == 1
+
+def test_expired_entries_miss(tmp_path):
+    cache = ResultCache(str(tmp_path), ttl=0.05)
+    cache.put("key", "Capitalize", b"result", {})
+    assert cache.get("key") == b"result"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert cache.stats["expired"] == 1
+
+def test_entries_with_missing_output_files_miss(tmp_path):
+    present = {"kept"}
+    cache = ResultCache(str(tmp_path), file_exists=lambda file_id: file_id in present)
+    cache.put("key", "Text2Imagedraft", b"result", {"text2imagedraft": {"result": file_ref("kept")}})
+    assert cache.get("key") == b"result"
+    present.clear()
+    assert cache.get("key") is None
+
+def test_index_survives_restart(tmp_path):
+    ResultCache(str(tmp_path)).put("key", "Capitalize", b"result", {})
+    reopened = ResultCache(str(tmp_path))
+    assert reopened.get("key") == b"result"
+    assert reopened.report()["hit_rate"] == 1.0
+
+def test_random_seed_requests_are_not_cacheable():
+    from tasks.task import Task
+    from proto.py import tasks as proto_tasks  # type: ignore
+
+    class Seeded(Task):
+        cacheable = True
+        load = unload = classmethod(lambda cls: None)
+
+        @classmethod
+        async def execute(cls, prompt: str, size: str = "512x512", seed: int = 0, send_update=None):
+            return prompt
+
+    class Unseeded(Seeded):
+        @classmethod
+        async def execute(cls, text: str, send_update=None):
+            return text
+
+    def request(seed):
+        return proto_tasks.TaskRequest(text2imagedraft=proto_tasks.Text2imagedraftRequest(prompt="a", size="512x512", seed=seed)).to_dict()["text2imagedraft"]
+
+    assert "seed" not in request(0)
+    assert not Seeded.is_cacheable(request(0))
+    assert Seeded.is_cacheable(request(7))
+    assert Unseeded.is_cacheable(proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text="a")).to_dict()["capitalize"])
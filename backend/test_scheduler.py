@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from engine import ExecutionEngine
+from journal import RequestJournal
+from residency import ResidencyManager
+from scheduler import SimulatedTask, TaskScheduler, read_trace
+
+def make_scheduler(files_present=()):
+    tasks = {name: SimulatedTask(name, exec_seconds=1.0, load_seconds=20.0, vram_mb=0) for name in ("Fast", "Slow", "Cold")}
+    residency = ResidencyManager()
+    for name in ("Fast", "Slow"):
+        residency.resident[name] = tasks[name]
+    present = set(files_present)
+    return TaskScheduler(tasks, residency, ExecutionEngine(), lambda: present, lambda name: name)
+
+def offer(task_id: str, name: str, file_id: str = "", size: int = 0):
+    request = {"image": {"type": "file_reference", "id": file_id, "size": str(size)}} if file_id else {}
+    return {"id": task_id, "name": name, "request": {name.lower(): request}}
+
+def test_resident_models_are_preferred():
+    scheduler = make_scheduler()
+    decision = scheduler.select([offer("cold", "Cold"), offer("warm", "Fast")])
+    assert decision.task["id"] == "warm"
+    costs = {candidate["id"]: candidate["costs"] for candidate in decision.candidates}
+    assert costs["cold"]["load"] == 20.0 and costs["warm"]["load"] == 0.0
+
+def test_tasks_with_inputs_present_are_preferred():
+    scheduler = make_scheduler(files_present={"here"})
+    decision = scheduler.select([offer("upload", "Fast", "missing", 100 * 1024 * 1024), offer("local", "Fast", "here", 100 * 1024 * 1024)])
+    assert decision.task["id"] == "local"
+    assert decision.candidates[1]["costs"]["upload"] > 0
+
+def test_short_observed_executions_are_preferred():
+    scheduler = make_scheduler()
+    scheduler.history.record_execution("Slow", 8.0)
+    scheduler.history.record_execution("Fast", 0.5)
+    decision = scheduler.select([offer("slow", "Slow"), offer("fast", "Fast")])
+    assert decision.task["id"] == "fast"
+
+    explanation = decision.explain()
+    assert explanation.splitlines()[0] == "picked Fast (fast)"
+    assert "Slow (slow): queue=0.00s, load=0.00s, upload=0.00s, exec=8.00s" in explanation
+    assert scheduler.select([offer("unknown", "Other")]).explain() == "no runnable task offered"
+
+def test_recorded_rounds_read_back_as_a_trace(tmp_path):
+    rounds = RequestJournal(str(tmp_path), filename="rounds.jsonl")
+    rounds.record({"time": "2026-01-01T12:00:00", "client": "a", "tasks": [offer("1", "Fast")]})
+    rounds.record({"time": "2026-01-01T12:00:02.5", "client": "a", "tasks": [offer("2", "Slow")]})
+    rounds.close()
+
+    trace = read_trace(os.path.join(tmp_path, "rounds.jsonl"))
+    assert [round_["tasks"][0]["id"] for round_ in trace] == ["1", "2"]
+    assert trace[1]["time"] - trace[0]["time"] == 2.5
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import server
+from protobuf_generator import adapt_name
+from scheduler import TaskScheduler
+from tasks.task import Task
+from proto.py import tasks as proto_tasks  # type: ignore
+
+class StubCapitalize(Task):
+    @classmethod
+    def load(cls):
+        pass
+
+    @classmethod
+    def unload(cls):
+        pass
+
+    @classmethod
+    async def execute(cls, text: str, send_update=None) -> str:
+        return text.upper()
+
+def offer(task_id: str):
+    request = proto_tasks.TaskRequest(capitalize=proto_tasks.CapitalizeRequest(text=task_id))
+    return {"id": task_id, "name": "capitalize", "request": request.to_dict()}
+
+def use_fresh_scheduler(monkeypatch) -> server.ResidencyManager:
+    """A residency manager and scheduler without what earlier tests loaded or observed."""
+    residency = server.ResidencyManager()
+    monkeypatch.setattr(server, "residency", residency)
+    monkeypatch.setattr(server, "scheduler", TaskScheduler(server.TASKS, residency, server.engine, lambda: {}, adapt_name))
+    return residency
+
+def test_tasks_of_worker_processes_are_not_prefetched_here(monkeypatch):
+    monkeypatch.setitem(server.TASKS, "Capitalize", StubCapitalize)
+    residency = use_fresh_scheduler(monkeypatch)
+    monkeypatch.setattr(server.supervisor, "routes", {"Capitalize": object()})
+    # a worker that just started reports its models as unloaded
+    server.residency.external["Capitalize"] = "unloaded"
+
+    async def scenario():
+        server.select_tasks([offer("owned")])
+        return list(residency.loading) + list(residency.resident)
+
+    assert asyncio.run(scenario()) == []
+
+class StubText2Text(StubCapitalize):
+    @classmethod
+    async def execute(cls, messages=None, roles=None, max_tokens: int = 0, send_update=None) -> str:
+        return ""
+
+def test_only_accepted_tasks_are_prefetched(monkeypatch):
+    monkeypatch.setitem(server.TASKS, "Capitalize", StubCapitalize)
+    monkeypatch.setitem(server.TASKS, "Text2Text", StubText2Text)
+    residency = use_fresh_scheduler(monkeypatch)
+    monkeypatch.setattr(server, "max_accept", 1)
+    text2text = proto_tasks.TaskRequest(text2text=proto_tasks.Text2textRequest(messages=["hi"]))
+
+    async def scenario():
+        selected = server.select_tasks([offer("picked"), {"id": "offered", "name": "text2text", "request": text2text.to_dict()}])
+        return [task["id"] for task in selected], list(residency.loading)
+
+    assert asyncio.run(scenario()) == (["picked"], ["Capitalize"])
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import db
+from storage import StorageManager
+
+def make_file(directory, name: str, age: float, size: int = 100) -> str:
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    then = time.time() - age
+    os.utime(path, (then, then))
+    return path
+
+def test_least_recently_used_files_go_first_over_quota(tmp_path):
+    oldest = make_file(tmp_path, "oldest.png", age=300)
+    in_use = make_file(tmp_path, "in_use.png", age=200)
+    newer = make_file(tmp_path, "newer.png", age=100)
+    fresh = make_file(tmp_path, "fresh.png", age=0)
+    db.add_file_mapping("storage-test-oldest", oldest)
+    removed = []
+    storage = StorageManager(str(tmp_path), max_bytes=250, max_age=None, min_age=50, on_remove=removed.extend)
+    storage.acquire([in_use])
+    # acquiring counts as a use, age it again to check that references alone protect it
+    then = time.time() - 200
+    os.utime(in_use, (then, then))
+
+    storage.collect()
+    # fresh is too young, in_use is in use, and the quota is met once two are gone
+    assert removed == [oldest, newer]
+    assert os.path.exists(in_use) and os.path.exists(fresh)
+    with pytest.raises(HTTPException):
+        db.get_file_path("storage-test-oldest")
+    storage.release([in_use])
+    assert storage.report()["in_use"] == 0
+
+def test_expired_files_are_removed(tmp_path):
+    old = make_file(tmp_path, "old.png", age=7200)
+    recent = make_file(tmp_path, "recent.png", age=100)
+    storage = StorageManager(str(tmp_path), max_bytes=None, max_age=3600, min_age=0)
+    storage.collect()
+    assert not os.path.exists(old) and os.path.exists(recent)
+
+def test_background_collection_reports_removals_on_the_loop(tmp_path):
+    old = make_file(tmp_path, "old.png", age=7200)
+    calls = []
+    storage = StorageManager(str(tmp_path), max_bytes=None, max_age=3600, min_age=0, interval=3600,
+                             on_remove=lambda paths: calls.append((threading.current_thread(), paths)))
+
+    async def scenario():
+        collector = asyncio.create_task(storage.run())
+        while not calls:
+            await asyncio.sleep(0.01)
+        collector.cancel()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    # collected in a worker thread, reported on the loop's
+    assert calls == [(threading.main_thread(), [old])]
+    assert not os.path.exists(old)
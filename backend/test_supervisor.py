@@ -0,0 +1,97 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from supervisor import Supervisor, WorkerError, gpu_processes, marshal, split_tasks, unmarshal
+from tasks.cancellation import CancellationToken
+from tasks.file import FileReference
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from proto.py import tasks as proto_tasks  # type: ignore
+
+class Model:
+    def __init__(self, vram_mb: float):
+        self.vram_mb = vram_mb
+
+def test_values_cross_processes_as_handles():
+    output = FileReference("supervisor_test.bin")
+    output.write(b"result")
+    try:
+        value = unmarshal(marshal({"files": [output], "update": proto_tasks.Text2textResponse(result="partial")}))
+        file = value["files"][0]
+        assert (file.id, file.path, file.hash, file.registered) == (output.id, output.path, output.hash, False)
+        assert value["update"].result == "partial"
+    finally:
+        os.remove(output.path)
+
+def test_gpu_tasks_share_the_first_worker():
+    tasks = {"Text2Image": Model(4000), "Text2Audio": Model(4500), "Capitalize": Model(0), "File2Text": Model(0), "Text2Text": Model(0)}
+    assert split_tasks(tasks, 3) == [["Text2Image", "Text2Audio"], ["Capitalize", "Text2Text"], ["File2Text"]]
+    assert split_tasks(tasks, 1) == [["Text2Image", "Text2Audio", "Capitalize", "File2Text", "Text2Text"]]
+
+def test_gpu_tasks_spread_over_processes_are_found():
+    tasks = {"Text2Image": Model(4000), "Text2Audio": Model(4500), "Capitalize": Model(0)}
+    assert gpu_processes(tasks, split_tasks(tasks, 2)) == [["Text2Image", "Text2Audio"]]
+    assert gpu_processes(tasks, []) == [["Text2Image", "Text2Audio"]]
+    # the front process keeps Text2Audio while a worker loads Text2Image
+    assert gpu_processes(tasks, [["Text2Image"]]) == [["Text2Audio"], ["Text2Image"]]
+    assert gpu_processes(tasks, [["Text2Image"], ["Text2Audio", "Capitalize"]]) == [["Text2Image"], ["Text2Audio"]]
+
+def test_jobs_run_in_the_worker_process():
+    states = {}
+    supervisor = Supervisor(on_state=states.update)
+    worker = supervisor.add_worker(["Capitalize"])
+
+    async def run():
+        await supervisor.start()
+        try:
+            updates = []
+            async def send_update(msg, update=None, percent=0, preview=b""):
+                updates.append(msg)
+            result = await worker.execute("Capitalize", "job-1", {"text": "hello"}, send_update, CancellationToken())
+            return result, worker.process.pid
+        finally:
+            await supervisor.stop()
+
+    result, pid = asyncio.run(run())
+    assert result == "HELLO" and pid != os.getpid()
+    assert states["Capitalize"] == "unloaded"  # the stopped worker took its model along
+    assert worker.report()["executed"] == 1
+
+def test_restart_fails_the_jobs_of_the_replaced_process():
+    supervisor = Supervisor()
+    worker = supervisor.add_worker(["Capitalize"])
+    send = worker.send
+
+    def send_except_old_job(message):
+        # the old job stays "running": its request never reaches the worker
+        if message[:2] != ("execute", "job-old"):
+            send(message)
+
+    async def nothing(*args, **kwargs):
+        pass
+
+    async def run():
+        await supervisor.start()
+        try:
+            worker.send = send_except_old_job
+            old_job = asyncio.create_task(worker.execute("Capitalize", "job-old", {"text": "old"}, nothing, CancellationToken()))
+            await asyncio.sleep(0)
+            # the worker dies and is restarted, as execute() does, before the loop hears about the exit
+            worker.process.kill()
+            worker.process.wait()
+            worker.start()
+            new_job = asyncio.create_task(worker.execute("Capitalize", "job-new", {"text": "new"}, nothing, CancellationToken()))
+            try:
+                await asyncio.wait_for(old_job, 10)
+            except WorkerError as e:
+                error = e
+            return error, await asyncio.wait_for(new_job, 30)
+        finally:
+            await supervisor.stop()
+
+    error, result = asyncio.run(run())
+    assert error.error_type == "WorkerExited"
+    assert result == "NEW"
+    assert worker.report()["starts"] == 2
@@ -0,0 +1,90 @@
+import asyncio
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import server
+import tasks.file
+from proto.py import websocket as wsmsg  # type: ignore
+
+# files, mapping and upload state live in a temporary directory, see conftest.py
+pytestmark = pytest.mark.usefixtures("isolated_server")
+
+@pytest.mark.parametrize("file_id", ["../escaped", "../../tmp/escaped", "nested/escaped", "/tmp/escaped"])
+def test_partial_upload_path_stays_in_file_dir(file_id):
+    with pytest.raises(HTTPException):
+        server.partial_upload_path(file_id)
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(wsmsg.ServerMessage().parse(data))
+
+def test_only_requested_chunks_are_written():
+    file_id = "requested"
+    websocket = RecordingSocket()
+    chunk = lambda chunk_id: wsmsg.FileChunk(file_id=chunk_id, name="x.bin", offset=0, data=b"data", size=4)
+
+    asyncio.run(server.receive_file_chunk(websocket, "upload-test", chunk(file_id)))
+    assert not os.path.exists(server.partial_upload_path(file_id))
+    assert file_id not in server.available_files
+
+    server.requested_files["upload-test"] = {file_id}
+    asyncio.run(server.receive_file_chunk(websocket, "upload-test", chunk(file_id)))
+    assert file_id in server.available_files
+    assert server.get_file_path(file_id) == os.path.join(tasks.file.FILES_DIR, f"{server.get_file_hash(file_id)}.bin")
+    assert not os.path.exists(server.partial_upload_path(file_id))
+    assert websocket.sent == []
+
+def test_concurrent_jobs_share_one_file_request():
+    file_id = "shared"
+    websocket = RecordingSocket()
+
+    async def scenario():
+        await server.request_files(websocket, "upload-test", [file_id])
+        await server.request_files(websocket, "upload-test", [file_id])
+        waiters = [asyncio.create_task(server.wait_for_file_uploads([file_id], timeout=1.0)) for _ in range(2)]
+        await server.receive_file_chunk(websocket, "upload-test", wsmsg.FileChunk(file_id=file_id, name="x.bin", offset=0, data=b"data", size=4))
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+    assert [message.file_request.file_id for message in websocket.sent] == [file_id]
+
+def test_upload_wait_resets_on_each_chunk():
+    file_id = "slow"
+    server.requested_files["upload-test"] = {file_id}
+
+    async def trickle():
+        # 5 chunks 0.1s apart take longer than the timeout, but none of the gaps does
+        for offset in range(5):
+            await asyncio.sleep(0.1)
+            await server.receive_file_chunk(RecordingSocket(), "upload-test", wsmsg.FileChunk(file_id=file_id, name="x.bin", offset=offset, data=b"x", size=5))
+
+    async def scenario():
+        sender = asyncio.create_task(trickle())
+        await server.wait_for_file_uploads([file_id], timeout=0.3)
+        await sender
+
+    asyncio.run(scenario())
+    assert file_id in server.available_files
+
+def test_upload_wait_times_out_when_idle():
+    file_id = "stalled"
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(server.wait_for_file_uploads([file_id], timeout=0.1))
+    assert raised.value.status_code == 408
+    # the next job asks again instead of waiting on the stalled request
+    assert file_id not in server.file_upload_events
+
+def test_http_uploads_leave_no_scratch_files():
+    upload = UploadFile(file=io.BytesIO(b"uploaded"), filename="x.bin")
+    asyncio.run(server.upload_file("http-upload", upload))
+    assert "http-upload" in server.available_files
+    assert os.path.exists(server.get_file_path("http-upload"))
+    assert os.listdir(tasks.file.TEMP_DIR) == []
@@ -17,6 +17,8 @@ class ClientMessage(betterproto.Message):
     pause: "Pause" = betterproto.message_field(5, group="message")
     resume: "Resume" = betterproto.message_field(6, group="message")
     handshake: "ClientHandshake" = betterproto.message_field(7, group="message")
+    file_chunk: "FileChunk" = betterproto.message_field(8, group="message")
+    cancel: "Cancel" = betterproto.message_field(9, group="message")
 
 
 @dataclass
@@ -39,6 +41,7 @@ class ServerMessage(betterproto.Message):
 @dataclass
 class RequestAvailableTasks(betterproto.Message):
     client_id: str = betterproto.string_field(1)
+    capacity: int = betterproto.int32_field(2)
 
 
 @dataclass
@@ -70,6 +73,11 @@ class Resume(betterproto.Message):
     pass
 
 
+@dataclass
+class Cancel(betterproto.Message):
+    task_id: str = betterproto.string_field(1)
+
+
 @dataclass
 class ClientHandshake(betterproto.Message):
     version: str = betterproto.string_field(1)
@@ -78,11 +86,21 @@ class ClientHandshake(betterproto.Message):
 @dataclass
 class ServerHandshake(betterproto.Message):
     version: str = betterproto.string_field(1)
+    capacity: int = betterproto.int32_field(2)
+    tasks: List["WorkerTask"] = betterproto.message_field(3)
+
+
+@dataclass
+class WorkerTask(betterproto.Message):
+    name: str = betterproto.string_field(1)
+    concurrency: int = betterproto.int32_field(2)
+    loaded: bool = betterproto.bool_field(3)
 
 
 @dataclass
 class AcceptTask(betterproto.Message):
     task_id: str = betterproto.string_field(1)
+    task_ids: List[str] = betterproto.string_field(2)
 
 
 @dataclass
@@ -101,6 +119,8 @@ class IncrementalUpdate(betterproto.Message):
     task_id: str = betterproto.string_field(1)
     msg: str = betterproto.string_field(2)
     update: TaskResponse = betterproto.message_field(3)
+    percent: int = betterproto.int32_field(4)
+    preview: bytes = betterproto.bytes_field(5)
 
 
 @dataclass
@@ -112,6 +132,16 @@ class ErrorResponse(betterproto.Message):
 @dataclass
 class FileRequest(betterproto.Message):
     file_id: str = betterproto.string_field(1)
+    offset: int = betterproto.int64_field(2)
+
+
+@dataclass
+class FileChunk(betterproto.Message):
+    file_id: str = betterproto.string_field(1)
+    name: str = betterproto.string_field(2)
+    offset: int = betterproto.int64_field(3)
+    data: bytes = betterproto.bytes_field(4)
+    size: int = betterproto.int64_field(5)
 
 
 @dataclass
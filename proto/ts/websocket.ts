@@ -5,6 +5,7 @@
 // source: websocket.proto
 
 /* eslint-disable */
+import Long from "long";
 import _m0 from "protobufjs/minimal";
 import { TaskRequest, TaskResponse } from "./tasks";
 
@@ -20,6 +21,10 @@ export interface ClientMessage {
 	pause?: Pause | undefined;
 	resume?: Resume | undefined;
 	handshake?: ClientHandshake | undefined;
+	/** client streams a requested file in chunks */
+	fileChunk?: FileChunk | undefined;
+	/** client no longer wants the result of a task */
+	cancel?: Cancel | undefined;
 }
 
 export interface ServerMessage {
@@ -36,6 +41,8 @@ export interface ServerMessage {
 
 export interface RequestAvailableTasks {
 	clientId: string;
+	/** how many more tasks the worker can accept right now */
+	capacity: number;
 }
 
 export interface AvailableTasks {
@@ -58,16 +65,35 @@ export interface Pause {}
 
 export interface Resume {}
 
+export interface Cancel {
+	taskId: string;
+}
+
 export interface ClientHandshake {
 	version: string;
 }
 
 export interface ServerHandshake {
 	version: string;
+	/** tasks the worker accepts right away, as in RequestAvailableTasks */
+	capacity: number;
+	/** task types the worker runs */
+	tasks: WorkerTask[];
+}
+
+export interface WorkerTask {
+	/** as in ExecuteTask.name */
+	name: string;
+	/** jobs of this type run at once */
+	concurrency: number;
+	/** model is resident, so no cold start */
+	loaded: boolean;
 }
 
 export interface AcceptTask {
+	/** first accepted task, kept for clients that only read one */
 	taskId: string;
+	taskIds: string[];
 }
 
 export interface NoTaskAvailable {}
@@ -81,6 +107,10 @@ export interface IncrementalUpdate {
 	taskId: string;
 	msg: string;
 	update: TaskResponse | undefined;
+	/** progress of the task, 0-100 */
+	percent: number;
+	/** low resolution JPEG preview of the output so far, if any */
+	preview: Uint8Array;
 }
 
 export interface ErrorResponse {
@@ -90,6 +120,19 @@ export interface ErrorResponse {
 
 export interface FileRequest {
 	fileId: string;
+	/** bytes of the file already received, send from here */
+	offset: number;
+}
+
+export interface FileChunk {
+	fileId: string;
+	/** file name to store under */
+	name: string;
+	/** position of data in the file */
+	offset: number;
+	data: Uint8Array;
+	/** total file size, the upload is complete once offset + len(data) reaches it */
+	size: number;
 }
 
 export interface FileReceive {
@@ -98,13 +141,13 @@ export interface FileReceive {
 
 export interface FileResponse {
 	fileId: string;
-	/** base64 encoded file content */
+	/** base64 encoded file content, deprecated: use FileChunk */
 	content: string;
 }
 
 export interface FileSend {
 	fileId: string;
-	/** base64 encoded file content */
+	/** unused: clients download the file from /api/download/{file_id}, which supports ranges */
 	content: string;
 }
 
@@ -117,6 +160,8 @@ function createBaseClientMessage(): ClientMessage {
 		pause: undefined,
 		resume: undefined,
 		handshake: undefined,
+		fileChunk: undefined,
+		cancel: undefined,
 	};
 }
 
@@ -161,6 +206,15 @@ export const ClientMessage = {
 				writer.uint32(58).fork(),
 			).ldelim();
 		}
+		if (message.fileChunk !== undefined) {
+			FileChunk.encode(
+				message.fileChunk,
+				writer.uint32(66).fork(),
+			).ldelim();
+		}
+		if (message.cancel !== undefined) {
+			Cancel.encode(message.cancel, writer.uint32(74).fork()).ldelim();
+		}
 		return writer;
 	},
 
@@ -236,6 +290,23 @@ export const ClientMessage = {
 						reader.uint32(),
 					);
 					continue;
+				case 8:
+					if (tag !== 66) {
+						break;
+					}
+
+					message.fileChunk = FileChunk.decode(
+						reader,
+						reader.uint32(),
+					);
+					continue;
+				case 9:
+					if (tag !== 74) {
+						break;
+					}
+
+					message.cancel = Cancel.decode(reader, reader.uint32());
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -268,6 +339,12 @@ export const ClientMessage = {
 			handshake: isSet(object.handshake)
 				? ClientHandshake.fromJSON(object.handshake)
 				: undefined,
+			fileChunk: isSet(object.fileChunk)
+				? FileChunk.fromJSON(object.fileChunk)
+				: undefined,
+			cancel: isSet(object.cancel)
+				? Cancel.fromJSON(object.cancel)
+				: undefined,
 		};
 	},
 
@@ -294,6 +371,12 @@ export const ClientMessage = {
 		if (message.handshake !== undefined) {
 			obj.handshake = ClientHandshake.toJSON(message.handshake);
 		}
+		if (message.fileChunk !== undefined) {
+			obj.fileChunk = FileChunk.toJSON(message.fileChunk);
+		}
+		if (message.cancel !== undefined) {
+			obj.cancel = Cancel.toJSON(message.cancel);
+		}
 		return obj;
 	},
 
@@ -335,6 +418,14 @@ export const ClientMessage = {
 			object.handshake !== undefined && object.handshake !== null
 				? ClientHandshake.fromPartial(object.handshake)
 				: undefined;
+		message.fileChunk =
+			object.fileChunk !== undefined && object.fileChunk !== null
+				? FileChunk.fromPartial(object.fileChunk)
+				: undefined;
+		message.cancel =
+			object.cancel !== undefined && object.cancel !== null
+				? Cancel.fromPartial(object.cancel)
+				: undefined;
 		return message;
 	},
 };
@@ -642,7 +733,7 @@ export const ServerMessage = {
 };
 
 function createBaseRequestAvailableTasks(): RequestAvailableTasks {
-	return { clientId: "" };
+	return { clientId: "", capacity: 0 };
 }
 
 export const RequestAvailableTasks = {
@@ -653,6 +744,9 @@ export const RequestAvailableTasks = {
 		if (message.clientId !== "") {
 			writer.uint32(10).string(message.clientId);
 		}
+		if (message.capacity !== 0) {
+			writer.uint32(16).int32(message.capacity);
+		}
 		return writer;
 	},
 
@@ -674,6 +768,13 @@ export const RequestAvailableTasks = {
 
 					message.clientId = reader.string();
 					continue;
+				case 2:
+					if (tag !== 16) {
+						break;
+					}
+
+					message.capacity = reader.int32();
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -688,6 +789,9 @@ export const RequestAvailableTasks = {
 			clientId: isSet(object.clientId)
 				? globalThis.String(object.clientId)
 				: "",
+			capacity: isSet(object.capacity)
+				? globalThis.Number(object.capacity)
+				: 0,
 		};
 	},
 
@@ -696,6 +800,9 @@ export const RequestAvailableTasks = {
 		if (message.clientId !== "") {
 			obj.clientId = message.clientId;
 		}
+		if (message.capacity !== 0) {
+			obj.capacity = Math.round(message.capacity);
+		}
 		return obj;
 	},
 
@@ -709,6 +816,7 @@ export const RequestAvailableTasks = {
 	): RequestAvailableTasks {
 		const message = createBaseRequestAvailableTasks();
 		message.clientId = object.clientId ?? "";
+		message.capacity = object.capacity ?? 0;
 		return message;
 	},
 };
@@ -1084,6 +1192,71 @@ export const Resume = {
 	},
 };
 
+function createBaseCancel(): Cancel {
+	return { taskId: "" };
+}
+
+export const Cancel = {
+	encode(
+		message: Cancel,
+		writer: _m0.Writer = _m0.Writer.create(),
+	): _m0.Writer {
+		if (message.taskId !== "") {
+			writer.uint32(10).string(message.taskId);
+		}
+		return writer;
+	},
+
+	decode(input: _m0.Reader | Uint8Array, length?: number): Cancel {
+		const reader =
+			input instanceof _m0.Reader ? input : _m0.Reader.create(input);
+		let end = length === undefined ? reader.len : reader.pos + length;
+		const message = createBaseCancel();
+		while (reader.pos < end) {
+			const tag = reader.uint32();
+			switch (tag >>> 3) {
+				case 1:
+					if (tag !== 10) {
+						break;
+					}
+
+					message.taskId = reader.string();
+					continue;
+			}
+			if ((tag & 7) === 4 || tag === 0) {
+				break;
+			}
+			reader.skipType(tag & 7);
+		}
+		return message;
+	},
+
+	fromJSON(object: any): Cancel {
+		return {
+			taskId: isSet(object.taskId)
+				? globalThis.String(object.taskId)
+				: "",
+		};
+	},
+
+	toJSON(message: Cancel): unknown {
+		const obj: any = {};
+		if (message.taskId !== "") {
+			obj.taskId = message.taskId;
+		}
+		return obj;
+	},
+
+	create<I extends Exact<DeepPartial<Cancel>, I>>(base?: I): Cancel {
+		return Cancel.fromPartial(base ?? ({} as any));
+	},
+	fromPartial<I extends Exact<DeepPartial<Cancel>, I>>(object: I): Cancel {
+		const message = createBaseCancel();
+		message.taskId = object.taskId ?? "";
+		return message;
+	},
+};
+
 function createBaseClientHandshake(): ClientHandshake {
 	return { version: "" };
 }
@@ -1154,7 +1327,7 @@ export const ClientHandshake = {
 };
 
 function createBaseServerHandshake(): ServerHandshake {
-	return { version: "" };
+	return { version: "", capacity: 0, tasks: [] };
 }
 
 export const ServerHandshake = {
@@ -1165,6 +1338,12 @@ export const ServerHandshake = {
 		if (message.version !== "") {
 			writer.uint32(10).string(message.version);
 		}
+		if (message.capacity !== 0) {
+			writer.uint32(16).int32(message.capacity);
+		}
+		for (const v of message.tasks) {
+			WorkerTask.encode(v!, writer.uint32(26).fork()).ldelim();
+		}
 		return writer;
 	},
 
@@ -1183,6 +1362,22 @@ export const ServerHandshake = {
 
 					message.version = reader.string();
 					continue;
+				case 2:
+					if (tag !== 16) {
+						break;
+					}
+
+					message.capacity = reader.int32();
+					continue;
+				case 3:
+					if (tag !== 26) {
+						break;
+					}
+
+					message.tasks.push(
+						WorkerTask.decode(reader, reader.uint32()),
+					);
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -1197,6 +1392,12 @@ export const ServerHandshake = {
 			version: isSet(object.version)
 				? globalThis.String(object.version)
 				: "",
+			capacity: isSet(object.capacity)
+				? globalThis.Number(object.capacity)
+				: 0,
+			tasks: globalThis.Array.isArray(object?.tasks)
+				? object.tasks.map((e: any) => WorkerTask.fromJSON(e))
+				: [],
 		};
 	},
 
@@ -1205,6 +1406,12 @@ export const ServerHandshake = {
 		if (message.version !== "") {
 			obj.version = message.version;
 		}
+		if (message.capacity !== 0) {
+			obj.capacity = Math.round(message.capacity);
+		}
+		if (message.tasks?.length) {
+			obj.tasks = message.tasks.map((e) => WorkerTask.toJSON(e));
+		}
 		return obj;
 	},
 
@@ -1218,12 +1425,114 @@ export const ServerHandshake = {
 	): ServerHandshake {
 		const message = createBaseServerHandshake();
 		message.version = object.version ?? "";
+		message.capacity = object.capacity ?? 0;
+		message.tasks =
+			object.tasks?.map((e) => WorkerTask.fromPartial(e)) || [];
+		return message;
+	},
+};
+
+function createBaseWorkerTask(): WorkerTask {
+	return { name: "", concurrency: 0, loaded: false };
+}
+
+export const WorkerTask = {
+	encode(
+		message: WorkerTask,
+		writer: _m0.Writer = _m0.Writer.create(),
+	): _m0.Writer {
+		if (message.name !== "") {
+			writer.uint32(10).string(message.name);
+		}
+		if (message.concurrency !== 0) {
+			writer.uint32(16).int32(message.concurrency);
+		}
+		if (message.loaded === true) {
+			writer.uint32(24).bool(message.loaded);
+		}
+		return writer;
+	},
+
+	decode(input: _m0.Reader | Uint8Array, length?: number): WorkerTask {
+		const reader =
+			input instanceof _m0.Reader ? input : _m0.Reader.create(input);
+		let end = length === undefined ? reader.len : reader.pos + length;
+		const message = createBaseWorkerTask();
+		while (reader.pos < end) {
+			const tag = reader.uint32();
+			switch (tag >>> 3) {
+				case 1:
+					if (tag !== 10) {
+						break;
+					}
+
+					message.name = reader.string();
+					continue;
+				case 2:
+					if (tag !== 16) {
+						break;
+					}
+
+					message.concurrency = reader.int32();
+					continue;
+				case 3:
+					if (tag !== 24) {
+						break;
+					}
+
+					message.loaded = reader.bool();
+					continue;
+			}
+			if ((tag & 7) === 4 || tag === 0) {
+				break;
+			}
+			reader.skipType(tag & 7);
+		}
+		return message;
+	},
+
+	fromJSON(object: any): WorkerTask {
+		return {
+			name: isSet(object.name) ? globalThis.String(object.name) : "",
+			concurrency: isSet(object.concurrency)
+				? globalThis.Number(object.concurrency)
+				: 0,
+			loaded: isSet(object.loaded)
+				? globalThis.Boolean(object.loaded)
+				: false,
+		};
+	},
+
+	toJSON(message: WorkerTask): unknown {
+		const obj: any = {};
+		if (message.name !== "") {
+			obj.name = message.name;
+		}
+		if (message.concurrency !== 0) {
+			obj.concurrency = Math.round(message.concurrency);
+		}
+		if (message.loaded === true) {
+			obj.loaded = message.loaded;
+		}
+		return obj;
+	},
+
+	create<I extends Exact<DeepPartial<WorkerTask>, I>>(base?: I): WorkerTask {
+		return WorkerTask.fromPartial(base ?? ({} as any));
+	},
+	fromPartial<I extends Exact<DeepPartial<WorkerTask>, I>>(
+		object: I,
+	): WorkerTask {
+		const message = createBaseWorkerTask();
+		message.name = object.name ?? "";
+		message.concurrency = object.concurrency ?? 0;
+		message.loaded = object.loaded ?? false;
 		return message;
 	},
 };
 
 function createBaseAcceptTask(): AcceptTask {
-	return { taskId: "" };
+	return { taskId: "", taskIds: [] };
 }
 
 export const AcceptTask = {
@@ -1234,6 +1543,9 @@ export const AcceptTask = {
 		if (message.taskId !== "") {
 			writer.uint32(10).string(message.taskId);
 		}
+		for (const v of message.taskIds) {
+			writer.uint32(18).string(v!);
+		}
 		return writer;
 	},
 
@@ -1252,6 +1564,13 @@ export const AcceptTask = {
 
 					message.taskId = reader.string();
 					continue;
+				case 2:
+					if (tag !== 18) {
+						break;
+					}
+
+					message.taskIds.push(reader.string());
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -1266,6 +1585,9 @@ export const AcceptTask = {
 			taskId: isSet(object.taskId)
 				? globalThis.String(object.taskId)
 				: "",
+			taskIds: globalThis.Array.isArray(object?.taskIds)
+				? object.taskIds.map((e: any) => globalThis.String(e))
+				: [],
 		};
 	},
 
@@ -1274,6 +1596,9 @@ export const AcceptTask = {
 		if (message.taskId !== "") {
 			obj.taskId = message.taskId;
 		}
+		if (message.taskIds?.length) {
+			obj.taskIds = message.taskIds;
+		}
 		return obj;
 	},
 
@@ -1285,6 +1610,7 @@ export const AcceptTask = {
 	): AcceptTask {
 		const message = createBaseAcceptTask();
 		message.taskId = object.taskId ?? "";
+		message.taskIds = object.taskIds?.map((e) => e) || [];
 		return message;
 	},
 };
@@ -1434,7 +1760,13 @@ export const TaskResult = {
 };
 
 function createBaseIncrementalUpdate(): IncrementalUpdate {
-	return { taskId: "", msg: "", update: undefined };
+	return {
+		taskId: "",
+		msg: "",
+		update: undefined,
+		percent: 0,
+		preview: new Uint8Array(0),
+	};
 }
 
 export const IncrementalUpdate = {
@@ -1454,6 +1786,12 @@ export const IncrementalUpdate = {
 				writer.uint32(26).fork(),
 			).ldelim();
 		}
+		if (message.percent !== 0) {
+			writer.uint32(32).int32(message.percent);
+		}
+		if (message.preview.length !== 0) {
+			writer.uint32(42).bytes(message.preview);
+		}
 		return writer;
 	},
 
@@ -1489,6 +1827,20 @@ export const IncrementalUpdate = {
 						reader.uint32(),
 					);
 					continue;
+				case 4:
+					if (tag !== 32) {
+						break;
+					}
+
+					message.percent = reader.int32();
+					continue;
+				case 5:
+					if (tag !== 42) {
+						break;
+					}
+
+					message.preview = reader.bytes();
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -1507,6 +1859,12 @@ export const IncrementalUpdate = {
 			update: isSet(object.update)
 				? TaskResponse.fromJSON(object.update)
 				: undefined,
+			percent: isSet(object.percent)
+				? globalThis.Number(object.percent)
+				: 0,
+			preview: isSet(object.preview)
+				? bytesFromBase64(object.preview)
+				: new Uint8Array(0),
 		};
 	},
 
@@ -1521,6 +1879,12 @@ export const IncrementalUpdate = {
 		if (message.update !== undefined) {
 			obj.update = TaskResponse.toJSON(message.update);
 		}
+		if (message.percent !== 0) {
+			obj.percent = Math.round(message.percent);
+		}
+		if (message.preview.length !== 0) {
+			obj.preview = base64FromBytes(message.preview);
+		}
 		return obj;
 	},
 
@@ -1539,6 +1903,8 @@ export const IncrementalUpdate = {
 			object.update !== undefined && object.update !== null
 				? TaskResponse.fromPartial(object.update)
 				: undefined;
+		message.percent = object.percent ?? 0;
+		message.preview = object.preview ?? new Uint8Array(0);
 		return message;
 	},
 };
@@ -1628,7 +1994,7 @@ export const ErrorResponse = {
 };
 
 function createBaseFileRequest(): FileRequest {
-	return { fileId: "" };
+	return { fileId: "", offset: 0 };
 }
 
 export const FileRequest = {
@@ -1639,6 +2005,9 @@ export const FileRequest = {
 		if (message.fileId !== "") {
 			writer.uint32(10).string(message.fileId);
 		}
+		if (message.offset !== 0) {
+			writer.uint32(16).int64(message.offset);
+		}
 		return writer;
 	},
 
@@ -1657,6 +2026,13 @@ export const FileRequest = {
 
 					message.fileId = reader.string();
 					continue;
+				case 2:
+					if (tag !== 16) {
+						break;
+					}
+
+					message.offset = longToNumber(reader.int64() as Long);
+					continue;
 			}
 			if ((tag & 7) === 4 || tag === 0) {
 				break;
@@ -1671,6 +2047,7 @@ export const FileRequest = {
 			fileId: isSet(object.fileId)
 				? globalThis.String(object.fileId)
 				: "",
+			offset: isSet(object.offset) ? globalThis.Number(object.offset) : 0,
 		};
 	},
 
@@ -1679,6 +2056,9 @@ export const FileRequest = {
 		if (message.fileId !== "") {
 			obj.fileId = message.fileId;
 		}
+		if (message.offset !== 0) {
+			obj.offset = Math.round(message.offset);
+		}
 		return obj;
 	},
 
@@ -1692,6 +2072,136 @@ export const FileRequest = {
 	): FileRequest {
 		const message = createBaseFileRequest();
 		message.fileId = object.fileId ?? "";
+		message.offset = object.offset ?? 0;
+		return message;
+	},
+};
+
+function createBaseFileChunk(): FileChunk {
+	return { fileId: "", name: "", offset: 0, data: new Uint8Array(0), size: 0 };
+}
+
+export const FileChunk = {
+	encode(
+		message: FileChunk,
+		writer: _m0.Writer = _m0.Writer.create(),
+	): _m0.Writer {
+		if (message.fileId !== "") {
+			writer.uint32(10).string(message.fileId);
+		}
+		if (message.name !== "") {
+			writer.uint32(18).string(message.name);
+		}
+		if (message.offset !== 0) {
+			writer.uint32(24).int64(message.offset);
+		}
+		if (message.data.length !== 0) {
+			writer.uint32(34).bytes(message.data);
+		}
+		if (message.size !== 0) {
+			writer.uint32(40).int64(message.size);
+		}
+		return writer;
+	},
+
+	decode(input: _m0.Reader | Uint8Array, length?: number): FileChunk {
+		const reader =
+			input instanceof _m0.Reader ? input : _m0.Reader.create(input);
+		let end = length === undefined ? reader.len : reader.pos + length;
+		const message = createBaseFileChunk();
+		while (reader.pos < end) {
+			const tag = reader.uint32();
+			switch (tag >>> 3) {
+				case 1:
+					if (tag !== 10) {
+						break;
+					}
+
+					message.fileId = reader.string();
+					continue;
+				case 2:
+					if (tag !== 18) {
+						break;
+					}
+
+					message.name = reader.string();
+					continue;
+				case 3:
+					if (tag !== 24) {
+						break;
+					}
+
+					message.offset = longToNumber(reader.int64() as Long);
+					continue;
+				case 4:
+					if (tag !== 34) {
+						break;
+					}
+
+					message.data = reader.bytes();
+					continue;
+				case 5:
+					if (tag !== 40) {
+						break;
+					}
+
+					message.size = longToNumber(reader.int64() as Long);
+					continue;
+			}
+			if ((tag & 7) === 4 || tag === 0) {
+				break;
+			}
+			reader.skipType(tag & 7);
+		}
+		return message;
+	},
+
+	fromJSON(object: any): FileChunk {
+		return {
+			fileId: isSet(object.fileId)
+				? globalThis.String(object.fileId)
+				: "",
+			name: isSet(object.name) ? globalThis.String(object.name) : "",
+			offset: isSet(object.offset) ? globalThis.Number(object.offset) : 0,
+			data: isSet(object.data)
+				? bytesFromBase64(object.data)
+				: new Uint8Array(0),
+			size: isSet(object.size) ? globalThis.Number(object.size) : 0,
+		};
+	},
+
+	toJSON(message: FileChunk): unknown {
+		const obj: any = {};
+		if (message.fileId !== "") {
+			obj.fileId = message.fileId;
+		}
+		if (message.name !== "") {
+			obj.name = message.name;
+		}
+		if (message.offset !== 0) {
+			obj.offset = Math.round(message.offset);
+		}
+		if (message.data.length !== 0) {
+			obj.data = base64FromBytes(message.data);
+		}
+		if (message.size !== 0) {
+			obj.size = Math.round(message.size);
+		}
+		return obj;
+	},
+
+	create<I extends Exact<DeepPartial<FileChunk>, I>>(base?: I): FileChunk {
+		return FileChunk.fromPartial(base ?? ({} as any));
+	},
+	fromPartial<I extends Exact<DeepPartial<FileChunk>, I>>(
+		object: I,
+	): FileChunk {
+		const message = createBaseFileChunk();
+		message.fileId = object.fileId ?? "";
+		message.name = object.name ?? "";
+		message.offset = object.offset ?? 0;
+		message.data = object.data ?? new Uint8Array(0);
+		message.size = object.size ?? 0;
 		return message;
 	},
 };
@@ -1935,6 +2445,31 @@ export const FileSend = {
 	},
 };
 
+function bytesFromBase64(b64: string): Uint8Array {
+	if ((globalThis as any).Buffer) {
+		return Uint8Array.from(globalThis.Buffer.from(b64, "base64"));
+	} else {
+		const bin = globalThis.atob(b64);
+		const arr = new Uint8Array(bin.length);
+		for (let i = 0; i < bin.length; ++i) {
+			arr[i] = bin.charCodeAt(i);
+		}
+		return arr;
+	}
+}
+
+function base64FromBytes(arr: Uint8Array): string {
+	if ((globalThis as any).Buffer) {
+		return globalThis.Buffer.from(arr).toString("base64");
+	} else {
+		const bin: string[] = [];
+		arr.forEach((byte) => {
+			bin.push(globalThis.String.fromCharCode(byte));
+		});
+		return globalThis.btoa(bin.join(""));
+	}
+}
+
 type Builtin =
 	| Date
 	| Function
@@ -1961,6 +2496,25 @@ export type Exact<P, I extends P> = P extends Builtin
 			[K in Exclude<keyof I, KeysOfUnion<P>>]: never;
 		};
 
+function longToNumber(long: Long): number {
+	if (long.gt(globalThis.Number.MAX_SAFE_INTEGER)) {
+		throw new globalThis.Error(
+			"Value is larger than Number.MAX_SAFE_INTEGER",
+		);
+	}
+	if (long.lt(globalThis.Number.MIN_SAFE_INTEGER)) {
+		throw new globalThis.Error(
+			"Value is smaller than Number.MIN_SAFE_INTEGER",
+		);
+	}
+	return long.toNumber();
+}
+
+if (_m0.util.Long !== Long) {
+	_m0.util.Long = Long as any;
+	_m0.configure();
+}
+
 function isSet(value: any): boolean {
 	return value !== null && value !== undefined;
 }
@@ -43,10 +43,17 @@ export interface QueuedTask<T extends TaskType = TaskType> {
 }
 
 type TasksListener = (tasks: Map<string, QueuedTask>) => void;
+/** Progress of a running task, with a low resolution JPEG preview if the task renders one */
+export interface TaskProgress {
+	percent: number;
+	preview?: Uint8Array;
+}
+
 type TaskUpdateListener = <T extends TaskType = TaskType>(
 	taskId: string,
 	message: string,
 	update: Task<T>["response"],
+	progress?: TaskProgress,
 ) => void;
 
 interface FileManager {
@@ -67,6 +74,18 @@ export function assetEntryToBase64(entry: AssetEntry): Promise<string> {
 	});
 }
 
+// Hex SHA-256 of a blob, the content hash the server stores files under.
+// Set it as an asset's `hash` so the server can skip uploads of content it already has.
+export async function sha256Hex(blob: Blob): Promise<string> {
+	const digest = await crypto.subtle.digest(
+		"SHA-256",
+		await blob.arrayBuffer(),
+	);
+	return Array.from(new Uint8Array(digest))
+		.map((byte) => byte.toString(16).padStart(2, "0"))
+		.join("");
+}
+
 export function base64ToBlob(base64: string): Blob {
 	const parts = base64.split(",");
 	const byteString = atob(parts[1]);
@@ -229,6 +248,9 @@ export class TaskQueue {
 	cancelTask(id: string) {
 		const task = this.tasks.get(id);
 		if (task) {
+			if (task.worker) {
+				this.workers.get(task.worker)?.cancel?.(id);
+			}
 			this.tasks.set(id, { ...task, status: QueuedTaskStatus.Cancelled });
 			this.emit(TaskQueueEvent.QueueChange);
 		}
@@ -258,8 +280,9 @@ export class TaskQueue {
 		taskId: string,
 		message: string,
 		update: Task<T>["response"],
+		progress?: TaskProgress,
 	) {
-		this.emit(TaskQueueEvent.TaskUpdate, taskId, update, message);
+		this.emit(TaskQueueEvent.TaskUpdate, taskId, update, message, progress);
 	}
 
 	on(event: TaskQueueEvent, callback: TasksListener | TaskUpdateListener) {
@@ -281,7 +304,12 @@ export class TaskQueue {
 	emit(event: TaskQueueEvent, ...args: any[]) {
 		this.listeners[event]?.forEach((callback) => {
 			if (event === TaskQueueEvent.TaskUpdate) {
-				(callback as TaskUpdateListener)(args[0], args[1], args[2]);
+				(callback as TaskUpdateListener)(
+					args[0],
+					args[1],
+					args[2],
+					args[3],
+				);
 			} else {
 				(callback as TasksListener)(this.tasks);
 			}
@@ -2,6 +2,7 @@ import {
 	AssetEntry,
 	assetEntryToBase64,
 	base64ToBlob,
+	sha256Hex,
 	QueuedTask,
 	QueuedTaskStatus,
 	TaskQueue,
@@ -27,6 +28,8 @@ export interface TWorker {
 	message: string;
 
 	onAvailableTasksChange: () => void;
+	/** Stop working on a task the queue no longer wants */
+	cancel?: (taskId: string) => void;
 	setMessage: (message: string) => void;
 	setStatus: (status: WorkerStatus) => void;
 	dispose: () => void;
@@ -132,6 +135,9 @@ export class WebWorkerAdapter extends BaseWorker {
 }
 
 const VERBOSE = true; // Set this to false to disable verbose printing
+const UPLOAD_CHUNK_SIZE = 256 * 1024;
+// 1.0.0: the server handshake carries capacity and supported tasks
+const PROTOCOL_VERSION = "1.0.0";
 
 function verbosePrint(action: string, message: unknown) {
 	if (!VERBOSE) return;
@@ -158,6 +164,11 @@ export class APIWorker extends BaseWorker {
 	private wsUrl: URL;
 	private apiBaseUrl: URL;
 	private ws: WebSocket;
+	// how many tasks the server accepts at once, and the ones it is running
+	private capacity: number = 1;
+	private running: Set<string> = new Set();
+	// task types the server runs, from its handshake (empty: offer everything)
+	private supportedTasks: Set<string> = new Set();
 
 	constructor(baseUrl: string, taskQueue: TaskQueue) {
 		super(taskQueue);
@@ -185,7 +196,7 @@ export class APIWorker extends BaseWorker {
 			verbosePrint("WebSocket connection established", this.id);
 			this.ws.send(
 				wsmsg.ClientMessage.encode({
-					handshake: { version: "0.0.0" },
+					handshake: { version: PROTOCOL_VERSION },
 				}).finish(),
 			);
 			this.setMessage("Connected to server");
@@ -218,6 +229,15 @@ export class APIWorker extends BaseWorker {
 						message.handshake,
 					);
 					this.handshaked = true;
+					this.supportedTasks = new Set(
+						message.handshake.tasks.map((task) => task.name),
+					);
+					// the handshake carries the first capacity, so offer tasks right away
+					if (message.handshake.capacity > 0) {
+						this.capacity = message.handshake.capacity;
+						this.onAvailableTasksChange(true);
+					}
+					return;
 				} else {
 					verbosePrint(
 						"Received unexpected message before handshake",
@@ -244,6 +264,12 @@ export class APIWorker extends BaseWorker {
 					message.incrementalUpdate.update![
 						task?.task.name || "text2text"
 					],
+					{
+						percent: message.incrementalUpdate.percent,
+						preview: message.incrementalUpdate.preview.length
+							? message.incrementalUpdate.preview
+							: undefined,
+					},
 				);
 			} else if (message.taskResult) {
 				verbosePrint("Received task result", message.taskResult);
@@ -252,7 +278,7 @@ export class APIWorker extends BaseWorker {
 					message.taskResult.result as Task<TaskType>["response"],
 				);
 				this.setMessage(`Task ${message.taskResult.taskId} resolved`);
-				this.setStatus(WorkerStatus.Idle);
+				this.finished(message.taskResult.taskId);
 
 				// ask for available tasks
 				this.onAvailableTasksChange();
@@ -263,7 +289,7 @@ export class APIWorker extends BaseWorker {
 					message.error.error,
 				);
 				this.setMessage(`Task ${message.error.taskId} failed`);
-				this.setStatus(WorkerStatus.Idle);
+				this.finished(message.error.taskId);
 
 				// ask for available tasks
 				this.onAvailableTasksChange();
@@ -272,26 +298,27 @@ export class APIWorker extends BaseWorker {
 					"Received accept_task message",
 					message.acceptTask,
 				);
-				const task = this.taskQueue.getTask(message.acceptTask.taskId);
-				if (task && task.status === QueuedTaskStatus.Queued) {
-					this.taskQueue.claimTask(
-						message.acceptTask.taskId,
-						this.id,
-					);
-					this.setStatus(WorkerStatus.Busy);
-					this.setMessage(`Executing ${task.task.name}`);
-
-					console.log("Executing task", task.task);
-					this.execute(task.task);
-				} else {
-					verbosePrint(
-						"Task not available",
-						message.acceptTask.taskId,
-					);
+				const taskIds = message.acceptTask.taskIds.length
+					? message.acceptTask.taskIds
+					: [message.acceptTask.taskId];
+				for (const taskId of taskIds) {
+					const task = this.taskQueue.getTask(taskId);
+					if (task && task.status === QueuedTaskStatus.Queued) {
+						this.taskQueue.claimTask(taskId, this.id);
+						this.running.add(taskId);
+
+						console.log("Executing task", task.task);
+						this.execute(task.task);
+					} else {
+						verbosePrint("Task not available", taskId);
+					}
 				}
 			} else if (message.fileRequest) {
 				verbosePrint("Received file request", message.fileRequest);
-				this.uploadFile(message.fileRequest.fileId as AssetEntry["id"]);
+				this.uploadFile(
+					message.fileRequest.fileId as AssetEntry["id"],
+					message.fileRequest.offset,
+				);
 			} else if (message.fileSend) {
 				verbosePrint(
 					"Received file send notification",
@@ -303,6 +330,10 @@ export class APIWorker extends BaseWorker {
 					"Received request for available tasks",
 					message.requestAvailableTasks,
 				);
+				this.capacity = Math.max(
+					1,
+					message.requestAvailableTasks.capacity,
+				);
 				this.onAvailableTasksChange(true);
 			}
 		};
@@ -321,13 +352,19 @@ export class APIWorker extends BaseWorker {
 
 	onAvailableTasksChange(force = false): void {
 		if (
-			(!force && this.status === WorkerStatus.Busy) ||
+			(!force && this.running.size >= this.capacity) ||
 			this.status === WorkerStatus.Paused
 		) {
 			return;
 		}
 
-		const availableTasks = this.taskQueue.getAvailableTasks();
+		const availableTasks = this.taskQueue
+			.getAvailableTasks()
+			.filter(
+				(queuedTask) =>
+					this.supportedTasks.size === 0 ||
+					this.supportedTasks.has(queuedTask.task.name),
+			);
 		verbosePrint("Available tasks", availableTasks);
 
 		const transpose = {
@@ -359,6 +396,13 @@ export class APIWorker extends BaseWorker {
 		this.ws.send(wsmsg.ClientMessage.encode(message).finish());
 	}
 
+	private finished(taskId: string) {
+		this.running.delete(taskId);
+		if (this.running.size === 0) {
+			this.setStatus(WorkerStatus.Idle);
+		}
+	}
+
 	async execute<T extends TaskType>(task: Task<T>) {
 		this.setStatus(WorkerStatus.Busy);
 		this.setMessage(`Executing ${task.name}`);
@@ -375,6 +419,18 @@ export class APIWorker extends BaseWorker {
 		this.ws.send(wsmsg.ClientMessage.encode(message).finish());
 	}
 
+	cancel(taskId: string) {
+		if (!this.running.has(taskId)) {
+			return;
+		}
+		const message = wsmsg.ClientMessage.create({
+			cancel: { taskId },
+		});
+		verbosePrint("Cancelling task", taskId);
+		// the server answers with an error for the task, which frees its slot
+		this.ws.send(wsmsg.ClientMessage.encode(message).finish());
+	}
+
 	pause() {
 		const message = wsmsg.ClientMessage.create({
 			pause: {},
@@ -402,26 +458,42 @@ export class APIWorker extends BaseWorker {
 		}
 	};
 
-	private async uploadFile(fileId: AssetEntry["id"]): Promise<void> {
+	// Streams a file to the server in binary chunks over the websocket,
+	// starting at `offset` when the server already has part of it
+	private async uploadFile(
+		fileId: AssetEntry["id"],
+		offset: number = 0,
+	): Promise<void> {
 		const file = await this.taskQueue.getFile(fileId);
 		if (file) {
 			try {
-				const formData = new FormData();
-				formData.append("file", file.file, file.id);
-
-				const response = await fetch(
-					`${this.apiBaseUrl}/upload/${fileId}`,
-					{
-						method: "POST",
-						body: formData,
-					},
-				);
+				const blob = file.file;
+				let start = offset;
+				do {
+					// don't queue the whole file in the socket's send buffer
+					while (this.ws.bufferedAmount > 4 * UPLOAD_CHUNK_SIZE) {
+						await new Promise((resolve) => setTimeout(resolve, 10));
+					}
+					const data = new Uint8Array(
+						await blob
+							.slice(start, start + UPLOAD_CHUNK_SIZE)
+							.arrayBuffer(),
+					);
+					this.ws.send(
+						wsmsg.ClientMessage.encode({
+							fileChunk: {
+								fileId,
+								name: file.id,
+								offset: start,
+								data,
+								size: blob.size,
+							},
+						}).finish(),
+					);
+					start += UPLOAD_CHUNK_SIZE;
+				} while (start < blob.size);
 
-				if (response.ok) {
-					verbosePrint("File uploaded successfully", fileId);
-				} else {
-					throw new Error(`HTTP error! status: ${response.status}`);
-				}
+				verbosePrint("File uploaded successfully", fileId);
 			} catch (error) {
 				verbosePrint("Error uploading file", error);
 				throw error;
@@ -448,11 +520,18 @@ export class APIWorker extends BaseWorker {
 			);
 			if (response.ok) {
 				const blob = await response.blob();
+				const hash = await sha256Hex(blob);
+				const expected = response.headers.get("X-Content-SHA256");
+				if (expected && expected !== hash) {
+					throw new Error(
+						`Integrity check failed for ${fileId}: expected ${expected}, got ${hash}`,
+					);
+				}
 				this.taskQueue.addAssetEntry({
 					id: fileId as AssetEntry["id"],
 					file: blob,
 					size: blob.size,
-					hash: "hash",
+					hash,
 				});
 				verbosePrint("File received and added to asset entry", fileId);
 			} else {